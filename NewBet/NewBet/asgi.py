@@ -0,0 +1,18 @@
+"""
+ASGI config for NewBet project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Live score streams are served by event loop under ASGI server, without
+holding a thread per open stream.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "NewBet.settings")
+
+application = get_asgi_application()
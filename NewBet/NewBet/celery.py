@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.schedules import crontab
 from django.conf import settings
 
 # settings for celery
@@ -15,4 +16,16 @@ app.conf.beat_schedule = {
         'task': 'betapp.tasks.check_fixtures',
         'schedule': crontab(minute='*/3'),  # Every 3 minutes
     },
+    'poll-live-fixtures': {
+        'task': 'betapp.tasks.poll_live_fixtures',
+        'schedule': crontab(minute='*/5'),  # Every 5 minutes
+    },
+    'refresh-due-odds': {
+        'task': 'betapp.tasks.refresh_odds',
+        'schedule': crontab(minute='*/5'),  # Every 5 minutes
+    },
+    'send-bet-confirmations': {
+        'task': 'betapp.tasks.send_bet_confirmations',
+        'schedule': settings.BET_CONFIRMATION_WINDOW,
+    },
 }
\ No newline at end of file
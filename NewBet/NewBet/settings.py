@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'betapp.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,6 +78,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'NewBet.wsgi.application'
+ASGI_APPLICATION = 'NewBet.asgi.application'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -88,6 +90,25 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            # Every transaction takes SQLite's write lock when it begins and
+            # waits up to timeout seconds for it. With default DEFERRED mode
+            # place_bet's transaction reads first and upgrades to write lock
+            # later - concurrent bets fail with "database is locked" on the
+            # upgrade instead of waiting. This serializes atomic blocks,
+            # including read-only ones, autocommit reads aren't affected.
+            # Databases with row locks don't need it.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Test database is file, not in-memory one - threads of
+        # ConcurrentBetTest share in-memory database through shared cache,
+        # whose table locks fail at once instead of honouring timeout, so
+        # the test wouldn't exercise locking the way production does.
+        # DATABASES can't be overridden per test case, it's created once.
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
@@ -147,10 +168,67 @@ SESSION_COOKIE_AGE = 15 * 60
 # Email
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Seconds bet confirmations are buffered before being sent in one batch
+BET_CONFIRMATION_WINDOW = 10
+# Max number of bets loaded per query by send_bet_confirmations
+BET_CONFIRMATION_BATCH_SIZE = 500
+# If True, bets buffered in one window are sent as one email per user
+BET_CONFIRMATION_DIGEST = True
+
 # Redis
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
 REDIS_DB = 0
 
+# Cache, shared by all workers - tests use local memory cache and don't
+# collect metrics
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://{}:{}/{}'.format(REDIS_HOST, REDIS_PORT, REDIS_DB),
+    }
+}
+
+# Request, API and task metrics are collected in redis and served at /metrics
+METRICS_ENABLED = True
+# Bearer token scrapers send to read /metrics/ without staff login, empty
+# allows staff only
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Bets shown on one page of account details
+BET_HISTORY_PAGE_SIZE = 50
+
+# Users on one page of leaderboard API and in top bettors of competitions page
+LEADERBOARD_PAGE_SIZE = 20
+TOP_BETTORS = 5
+# Seconds top bettors of competitions page are cached
+TOP_BETTORS_CACHE_TIMEOUT = 30
+
+# Seconds rendered fixtures lists are cached, changes invalidate them sooner
+FIXTURES_CACHE_TIMEOUT = 10 * 60
+
+# Seconds of silence after which live scores stream sends keepalive comment
+LIVE_STREAM_KEEPALIVE = 15
+
 # Celery
-CELERYBEAT_SCHEDULER = 'djcelery.schedulers.DatabaseScheduler'
\ No newline at end of file
+CELERYBEAT_SCHEDULER = 'djcelery.schedulers.DatabaseScheduler'
+
+# Gzipped cassette recorded by record_cassette command - if set, TheSportsDB
+# responses are replayed from it instead of calling the API, each delayed by
+# latency seconds with error rate fraction of them failing
+SPORTSDB_CASSETTE = os.environ.get('SPORTSDB_CASSETTE')
+SPORTSDB_REPLAY_LATENCY = float(os.environ.get('SPORTSDB_REPLAY_LATENCY', 0))
+SPORTSDB_REPLAY_ERROR_RATE = float(
+    os.environ.get('SPORTSDB_REPLAY_ERROR_RATE', 0)
+)
+
+# Max number of competitions fetched from API in parallel by check_fixtures
+FIXTURES_REFRESH_CONCURRENCY = 8
+
+# Seconds competition refresh holds its lease lock at most, runs of crashed
+# workers release the competition after that
+COMPETITION_REFRESH_LEASE = 5 * 60
+
+# Max number of fixtures whose odds are refreshed by one refresh_odds run,
+# the most overdue go first
+ODDS_REFRESH_BUDGET = 200
\ No newline at end of file
@@ -22,4 +22,8 @@ urlpatterns = [
     path('show_team/<int:team_id>/', ShowTeamView.as_view(), name="show-team"),
     path('add_competitions/<int:season>/', AddCompetitionsView.as_view(), name="add-competitions"),
     path('team_standings/<int:competition_id>/<int:team_id>/', TeamStandingsView.as_view(), name="team-standings"),
+    path('competition_standings/<int:competition_id>/', CompetitionStandingsView.as_view(), name="competition-standings"),
+    path('live_scores/<int:competition_id>/', LiveScoresView.as_view(), name="live-scores"),
+    path('leaderboard/', LeaderboardView.as_view(), name="leaderboard"),
+    path('metrics/', MetricsView.as_view(), name="metrics"),
 ]
\ No newline at end of file
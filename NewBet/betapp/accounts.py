@@ -0,0 +1,173 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, When, Value, Q, F, Sum, Count
+
+from .models import AccountSummary, Bet, LOST, WON, PENDING, PAYOUT, CENT
+
+
+SUMMARY_BATCH_SIZE = 100
+REBUILD_BATCH_SIZE = 1000
+
+
+def record_placed_bet(app_user_id, bet_amount):
+    """
+    Adds new pending bet to AppUser's summary, creating the summary with
+    first bet. Call it in transaction placing the bet.
+    """
+    changes = {'bets_count': F('bets_count') + 1,
+               'pending_count': F('pending_count') + 1,
+               'total_staked': F('total_staked') + bet_amount,
+               'pending_exposure': F('pending_exposure') + bet_amount}
+    summaries = AccountSummary.objects.filter(app_user_id=app_user_id)
+    if not summaries.update(**changes):
+        # Concurrent first bet may have created it meanwhile
+        AccountSummary.objects.bulk_create(
+            [AccountSummary(app_user_id=app_user_id)], ignore_conflicts=True
+        )
+        summaries.update(**changes)
+
+
+def summary_case(field, changes):
+    """
+    :param changes: list of (app_user_id, value added to field) tuples
+    :return: CASE expression adding each user's value to field
+    """
+    return Case(*[When(app_user_id=app_user_id, then=F(field) + Value(value))
+                  for app_user_id, value in changes],
+                default=F(field),
+                output_field=AccountSummary._meta.get_field(field))
+
+
+def record_settled_bets(settled):
+    """
+    Moves settled bets from pending to won/lost in summaries of their
+    AppUsers, with one CASE update per SUMMARY_BATCH_SIZE users
+    :param settled: list of (app_user_id, won count, lost count, Decimal
+    staked, Decimal returned) tuples
+    """
+    for start in range(0, len(settled), SUMMARY_BATCH_SIZE):
+        batch = settled[start:start + SUMMARY_BATCH_SIZE]
+        app_user_ids = [row[0] for row in batch]
+        AccountSummary.objects.bulk_create(
+            [AccountSummary(app_user_id=app_user_id)
+             for app_user_id in app_user_ids], ignore_conflicts=True
+        )
+        AccountSummary.objects.filter(app_user_id__in=app_user_ids).update(
+            pending_count=summary_case('pending_count', [
+                (app_user_id, -(won + lost))
+                for app_user_id, won, lost, staked, returned in batch]),
+            won_count=summary_case('won_count', [
+                (app_user_id, won)
+                for app_user_id, won, lost, staked, returned in batch]),
+            lost_count=summary_case('lost_count', [
+                (app_user_id, lost)
+                for app_user_id, won, lost, staked, returned in batch]),
+            pending_exposure=summary_case('pending_exposure', [
+                (app_user_id, -staked)
+                for app_user_id, won, lost, staked, returned in batch]),
+            total_returned=summary_case('total_returned', [
+                (app_user_id, returned)
+                for app_user_id, won, lost, staked, returned in batch]),
+        )
+
+
+def write_summaries(bets, summaries):
+    """
+    Replaces given summaries with ones aggregated from given bets
+    :return: int - number of summaries written
+    """
+    pending = Q(bet_result=PENDING)
+    rows = bets.order_by().values('bet_user').annotate(
+        bets_count=Count('id'),
+        pending_count=Count('id', filter=pending),
+        won_count=Count('id', filter=Q(bet_result=WON)),
+        lost_count=Count('id', filter=Q(bet_result=LOST)),
+        total_staked=Sum('bet_amount'),
+        total_returned=Sum(PAYOUT, filter=Q(bet_result=WON)),
+        pending_exposure=Sum('bet_amount', filter=pending),
+    )
+
+    with transaction.atomic():
+        summaries.delete()
+        created = AccountSummary.objects.bulk_create(
+            [AccountSummary(
+                app_user_id=row.pop('bet_user'),
+                total_returned=(row.pop('total_returned') or Decimal(0))
+                .quantize(CENT),
+                pending_exposure=row.pop('pending_exposure') or 0,
+                **row
+            ) for row in rows],
+            batch_size=SUMMARY_BATCH_SIZE
+        )
+    return len(created)
+
+
+def rebuild_account_summaries(app_user_ids=None):
+    """
+    Computes summaries of given AppUsers (all if None) from all their bets,
+    with one aggregate query per REBUILD_BATCH_SIZE users
+    :return: int - number of summaries written
+    """
+    if app_user_ids is None:
+        return write_summaries(Bet.objects.all(),
+                               AccountSummary.objects.all())
+    app_user_ids = list(app_user_ids)
+    written = 0
+    for start in range(0, len(app_user_ids), REBUILD_BATCH_SIZE):
+        batch = app_user_ids[start:start + REBUILD_BATCH_SIZE]
+        written += write_summaries(
+            Bet.objects.filter(bet_user_id__in=batch),
+            AccountSummary.objects.filter(app_user_id__in=batch)
+        )
+    return written
+
+
+def get_summary(app_user):
+    """
+    :param app_user: AppUser, best loaded with select_related('summary')
+    :return: AccountSummary of AppUser, unsaved empty one if it has no bets
+    """
+    try:
+        return app_user.summary
+    except AccountSummary.DoesNotExist:
+        return AccountSummary(app_user=app_user)
+
+
+def encode_cursor(bet):
+    return "{}_{}".format(bet.bet_placed_at.isoformat(), bet.id)
+
+
+def decode_cursor(cursor):
+    """
+    :return: tuple (datetime, int) of cursor's bet, None if it's invalid
+    """
+    try:
+        placed_at, bet_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(placed_at), int(bet_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def bets_page(app_user_id, cursor=None, size=50):
+    """
+    Returns page of AppUser's bets, newest first, using keyset pagination -
+    page after cursor is read straight from (bet_user, bet_placed_at) index,
+    however deep in history it is
+    :param cursor: string - encoded last bet of previous page, None for
+    first page
+    :return: tuple (list of Bet objects, cursor of next page or None)
+    """
+    bets = Bet.objects.filter(bet_user_id=app_user_id)\
+        .select_related('fixture__home_team', 'fixture__away_team')\
+        .order_by('-bet_placed_at', '-id')
+    position = decode_cursor(cursor) if cursor else None
+    if position is not None:
+        placed_at, bet_id = position
+        bets = bets.filter(Q(bet_placed_at__lt=placed_at) |
+                           Q(bet_placed_at=placed_at, id__lt=bet_id))
+    page = list(bets[:size + 1])
+    if len(page) > size:
+        return page[:size], encode_cursor(page[size - 1])
+    return page, None
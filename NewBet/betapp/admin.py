@@ -1,6 +1,7 @@
 # betapp/admin.py
 from django.contrib import admin
-from betapp.models import Competition, Team, Fixture, AppUser, Bet, Bookmaker
+from betapp.models import Competition, Team, Fixture, AppUser, Bet, Bookmaker, \
+    LeagueTableRow, AccountSummary
 
 
 class FixtureAdmin(admin.ModelAdmin):
@@ -9,6 +10,16 @@ class FixtureAdmin(admin.ModelAdmin):
     search_fields = ['matchday', 'home_team__name', 'away_team__name']
 
 
+class LeagueTableRowAdmin(admin.ModelAdmin):
+    list_display = ['id', 'competition', 'team', 'played', 'goal_difference',
+                    'points']
+
+
+class AccountSummaryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'app_user', 'bets_count', 'pending_count',
+                    'total_staked', 'total_returned', 'pending_exposure']
+
+
 class BetAdmin(admin.ModelAdmin):
     list_display = ['id', 'bet_user', 'bet_amount', 'fixture', 'bet',
                     'bet_course', 'bet_result']
@@ -20,4 +31,6 @@ admin.site.register(Team)
 admin.site.register(Fixture, FixtureAdmin)
 admin.site.register(AppUser)
 admin.site.register(Bet, BetAdmin)
-admin.site.register(Bookmaker)
\ No newline at end of file
+admin.site.register(Bookmaker)
+admin.site.register(LeagueTableRow, LeagueTableRowAdmin)
+admin.site.register(AccountSummary, AccountSummaryAdmin)
\ No newline at end of file
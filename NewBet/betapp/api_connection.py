@@ -1,23 +1,223 @@
 # betapp/api_connection.py - The Sports DB (100% FREE, no API key)
 import requests
 import json
+import threading
+import time
+from collections import Counter
 from datetime import datetime
 
-class TheSportsDB:
+import redis
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .cassettes import Cassette, ReplaySession
+from .metrics import metrics, shared_redis
+
+
+# Seconds response of endpoint is fresh, then how long it may still be served
+# stale while being refreshed in background. Endpoints with ttl 0 aren't cached
+CACHE_POLICIES = {
+    'all_leagues.php': (24 * 60 * 60, 24 * 60 * 60),
+    'search_all_teams.php': (12 * 60 * 60, 12 * 60 * 60),
+    'eventsseason.php': (10 * 60, 60 * 60),
+    'lookuptable.php': (10 * 60, 60 * 60),
+    'livescore.php': (0, 0),
+    'lookupevent.php': (0, 0),
+    'lookuptimeline.php': (0, 0),
+}
+DEFAULT_CACHE_POLICY = (60, 5 * 60)
+
+
+class LocalCache:
+    """
+    In-process cache, also used as fake of RedisCache in tests
+    """
     def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value, expires_at = self.data.get(key, (None, 0))
+            if expires_at < time.time():
+                self.data.pop(key, None)
+                return None
+            return value
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.data[key] = (value, time.time() + timeout)
+
+
+class RedisCache:
+    """
+    Cache shared by all workers, errors of redis server are treated as misses
+    """
+    def __init__(self, client, prefix="sportsdb:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            value = self.client.get(self.prefix + key)
+        except redis.RedisError:
+            return None
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, timeout):
+        try:
+            self.client.set(self.prefix + key, json.dumps(value),
+                            ex=int(timeout))
+        except redis.RedisError:
+            pass
+
+
+class TieredCache:
+    """
+    Checks local cache first, then shared one - filling local on shared hit
+    """
+    def __init__(self, local, shared, local_timeout=30):
+        self.local = local
+        self.shared = shared
+        self.local_timeout = local_timeout
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value, self.local_timeout)
+        return value
+
+    def set(self, key, value, timeout):
+        self.shared.set(key, value, timeout)
+        self.local.set(key, value, min(timeout, self.local_timeout))
+
+
+class SingleFlight:
+    """
+    Runs only one call per key at a time, concurrent callers of the same key
+    wait for and share its result
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def in_flight(self, key):
+        with self.lock:
+            return key in self.calls
+
+    def do(self, key, function):
+        """
+        :return: tuple (result, True if result was shared from other call)
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event(),
+                                          "result": None}
+        if not leader:
+            call["done"].wait()
+            return call["result"], True
+        try:
+            call["result"] = function()
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+        return call["result"], False
+
+
+class TheSportsDB:
+    def __init__(self, cache=None, session=None, pool_size=10):
         self.base_url = "https://www.thesportsdb.com/api/v1/json/3/"
-    
-    def make_request(self, endpoint):
+        self.cache = cache if cache is not None else LocalCache()
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+        self.single_flight = SingleFlight()
+        self.counters = Counter()
+        self.counters_lock = threading.Lock()
+
+    def count(self, name):
+        with self.counters_lock:
+            self.counters[name] += 1
+        metrics.increment("betapp_api_events_total", {"event": name})
+
+    def stats(self):
+        """Returns hit/miss/stale/coalesced/error/request counters"""
+        with self.counters_lock:
+            return dict(self.counters)
+
+    def fetch(self, endpoint):
         """Make API request - completely free, no API key needed"""
         url = self.base_url + endpoint
+        self.count("requests")
+        start = time.perf_counter()
         try:
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=10)
             if response.status_code == 200:
                 return response.json()
+            self.count("errors")
             return None
         except Exception as e:
+            self.count("errors")
             print(f"Request failed: {e}")
             return None
+        finally:
+            metrics.observe("betapp_api_request_duration_seconds",
+                            {"endpoint": endpoint.split("?")[0]},
+                            time.perf_counter() - start)
+
+    def refresh(self, endpoint, ttl, stale_ttl):
+        """
+        Fetches endpoint and stores response in cache, concurrent refreshes
+        of the same endpoint are coalesced into one request
+        """
+        def fetch_and_store():
+            data = self.fetch(endpoint)
+            if data is not None:
+                self.cache.set(endpoint, {"data": data,
+                                          "stored_at": time.time()},
+                               ttl + stale_ttl)
+            return data
+
+        data, shared = self.single_flight.do(endpoint, fetch_and_store)
+        if shared:
+            self.count("coalesced")
+        return data
+
+    def make_request(self, endpoint):
+        """
+        Returns cached response of endpoint if fresh, stale one while
+        refreshing it in background, else fetches it
+        """
+        ttl, stale_ttl = CACHE_POLICIES.get(endpoint.split("?")[0],
+                                            DEFAULT_CACHE_POLICY)
+        if not ttl:
+            return self.fetch(endpoint)
+
+        entry = self.cache.get(endpoint)
+        if entry is not None:
+            age = time.time() - entry["stored_at"]
+            if age < ttl:
+                self.count("hits")
+                return entry["data"]
+            if age < ttl + stale_ttl:
+                self.count("stale")
+                if not self.single_flight.in_flight(endpoint):
+                    threading.Thread(target=self.refresh,
+                                     args=(endpoint, ttl, stale_ttl),
+                                     daemon=True).start()
+                return entry["data"]
+
+        self.count("misses")
+        return self.refresh(endpoint, ttl, stale_ttl)
 
     def get_all_leagues(self):
         """Get all football leagues"""
@@ -39,12 +239,35 @@ class TheSportsDB:
         """Get league table"""
         return self.make_request(f"lookuptable.php?l={league_id}&s=2024-2025")
 
-    def get_live_scores(self):
-        """Get live scores (limited)"""
-        return self.make_request("livescore.php?l=4328")
+    def get_live_scores(self, league_id=4328):
+        """Get live scores of all league's matches in one request (limited)"""
+        return self.make_request(f"livescore.php?l={league_id}")
+
+    def get_event(self, event_id):
+        """Get current data of single event"""
+        return self.make_request(f"lookupevent.php?id={event_id}")
+
+    def get_event_timeline(self, event_id):
+        """Get goals, cards and substitutions of single event"""
+        return self.make_request(f"lookuptimeline.php?id={event_id}")
+
+def replay_session():
+    """
+    :return: ReplaySession of cassette set in SPORTSDB_CASSETTE setting, None
+    if API should be called over network
+    """
+    if not settings.SPORTSDB_CASSETTE:
+        return None
+    return ReplaySession(Cassette.load(settings.SPORTSDB_CASSETTE),
+                         latency=settings.SPORTSDB_REPLAY_LATENCY,
+                         error_rate=settings.SPORTSDB_REPLAY_ERROR_RATE)
+
 
-# Initialize the API
-sports_api = TheSportsDB()
+# Initialize the API, responses are shared by all workers through redis
+sports_api = TheSportsDB(cache=TieredCache(
+    LocalCache(),
+    RedisCache(shared_redis())
+), session=replay_session())
 
 # Popular League IDs
 LEAGUE_IDS = {
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class BetappConfig(AppConfig):
     name = 'betapp'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,70 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from .accounts import record_placed_bet
+from .leaderboard import leaderboard
+from .models import AppUser, Bet, Fixture
+from .notifications import bet_notifier
+
+
+MIN_BET_AMOUNT = Decimal('0.01')
+
+# Fixture field holding course of each bet type offered
+COURSE_FIELDS = {
+    1: 'course_team_home_win',
+    0: 'course_draw',
+    2: 'course_team_away_win',
+}
+
+
+class BetRejected(Exception):
+    """Raised when bet can't be placed, message is shown to user"""
+
+
+def place_bet(app_user_id, fixture_id, bet, bet_amount, bet_course):
+    """
+    Places bet in one short transaction: checks that fixture is still
+    scheduled and its course is still the one user saw, debits AppUser with
+    conditional update (cash >= bet_amount), inserts Bet and adds it to
+    AppUser's account summary; stake is subtracted from leaderboard once it
+    commits. Only fixture's competition id is read into Python, never
+    AppUser or Fixture row, so concurrent bets can't overwrite each other's
+    balance and bets on one fixture don't wait for each other.
+    :param app_user_id: int
+    :param fixture_id: int
+    :param bet: int - bet type, see Bet.BET_TYPES
+    :param bet_amount: Decimal
+    :param bet_course: float - course user saw when placing bet
+    :return: Bet object
+    """
+    course_field = COURSE_FIELDS.get(bet)
+    if course_field is None:
+        raise BetRejected("This bet type is not offered")
+    if bet_amount < MIN_BET_AMOUNT:
+        raise BetRejected("Minimal bet amount is {}".format(MIN_BET_AMOUNT))
+
+    with transaction.atomic():
+        competition_id = Fixture.objects.filter(
+            id=fixture_id, status=1, **{course_field: bet_course}
+        ).values_list('competition_id', flat=True).first()
+        if competition_id is None:
+            raise BetRejected("Fixture is no longer open or course has "
+                              "changed")
+        debited = AppUser.objects.filter(id=app_user_id,
+                                         cash__gte=bet_amount)\
+            .update(cash=F('cash') - bet_amount)
+        if not debited:
+            raise BetRejected("Not enough cash")
+        placed_bet = Bet.objects.create(bet_user_id=app_user_id,
+                                        bet_amount=bet_amount,
+                                        fixture_id=fixture_id,
+                                        bet=bet,
+                                        bet_course=bet_course
+                                        )
+        record_placed_bet(app_user_id, bet_amount)
+        leaderboard.record([(app_user_id, competition_id, -bet_amount)])
+        transaction.on_commit(lambda: bet_notifier.queue(placed_bet.id),
+                              robust=True)
+    return placed_bet
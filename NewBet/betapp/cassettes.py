@@ -0,0 +1,132 @@
+from collections import Counter
+from contextlib import contextmanager
+import gzip
+import json
+import random
+import threading
+import time
+
+import requests
+
+
+class Cassette:
+    """
+    Recorded TheSportsDB responses, stored as gzipped JSON. Every url keeps
+    all its responses in order, so repeated requests (like live score polls)
+    are replayed as the sequence that was recorded.
+    """
+    def __init__(self, interactions=None, meta=None):
+        self.interactions = interactions if interactions is not None else {}
+        self.meta = meta if meta is not None else {}
+        self.lock = threading.Lock()
+
+    def record(self, url, status_code, body):
+        with self.lock:
+            self.interactions.setdefault(url, []).append(
+                {"status": status_code, "body": body}
+            )
+
+    def responses(self, url):
+        return self.interactions.get(url, [])
+
+    def save(self, path):
+        with gzip.open(path, "wt", encoding="utf-8") as cassette_file:
+            json.dump({"meta": self.meta,
+                       "interactions": self.interactions}, cassette_file)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rt", encoding="utf-8") as cassette_file:
+            data = json.load(cassette_file)
+        return cls(data["interactions"], data.get("meta"))
+
+
+class ReplayResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class RecordingSession:
+    """
+    Session passing requests to real one and recording their responses
+    into cassette
+    """
+    def __init__(self, cassette, session=None):
+        self.cassette = cassette
+        self.session = session or requests.Session()
+
+    def get(self, url, timeout=None):
+        response = self.session.get(url, timeout=timeout)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        self.cassette.record(url, response.status_code, body)
+        return response
+
+
+class ReplaySession:
+    """
+    In-process stand-in of TheSportsDB answering from cassette, used instead
+    of network session of TheSportsDB client. Every response is delayed by
+    latency seconds (plus up to jitter), error_rate of requests fail - with
+    error_status response, or connection error if it's None. Urls missing
+    in cassette get 404 and are collected in missing.
+    """
+    def __init__(self, cassette, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=503, seed=None):
+        self.cassette = cassette
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+        self.positions = Counter()
+        self.missing = []
+        self.lock = threading.Lock()
+
+    def get(self, url, timeout=None):
+        with self.lock:
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            failed = self.rng.random() < self.error_rate
+            position = self.positions[url]
+            self.positions[url] += 1
+        if delay:
+            time.sleep(delay)
+        if failed:
+            if self.error_status is None:
+                raise requests.ConnectionError(
+                    "Injected connection error: {}".format(url)
+                )
+            return ReplayResponse(self.error_status, None)
+
+        responses = self.cassette.responses(url)
+        if not responses:
+            with self.lock:
+                self.missing.append(url)
+            return ReplayResponse(404, None)
+        # Last response is repeated once recorded sequence is exhausted
+        response = responses[min(position, len(responses) - 1)]
+        return ReplayResponse(response["status"], response["body"])
+
+    def rewind(self):
+        with self.lock:
+            self.positions.clear()
+
+
+@contextmanager
+def using_session(api, session, cache):
+    """
+    Temporarily sends requests of TheSportsDB client through given session
+    and cache, e.g. to replay cassette with empty cache
+    """
+    previous = api.session, api.cache
+    api.session, api.cache = session, cache
+    try:
+        yield api
+    finally:
+        api.session, api.cache = previous
@@ -2,6 +2,7 @@ from django import forms
 from django.forms import ModelForm
 
 from .models import *
+from .betting import COURSE_FIELDS
 
 
 class LoginForm(forms.Form):
@@ -19,6 +20,19 @@ class RegisterForm(forms.Form):
 
 
 class BetForm(ModelForm):
+    # Courses shown to user, bet is placed only if they haven't changed
+    course_team_home_win = forms.FloatField(widget=forms.HiddenInput)
+    course_draw = forms.FloatField(widget=forms.HiddenInput)
+    course_team_away_win = forms.FloatField(widget=forms.HiddenInput)
+
     class Meta:
         model = Bet
         fields = ['bet_amount', 'bet']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Only bet types with course in fixture can be placed
+        self.fields['bet'].choices = [
+            (bet, label) for bet, label in Bet.BET_TYPES
+            if bet in COURSE_FIELDS
+        ]
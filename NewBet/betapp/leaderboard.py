@@ -0,0 +1,154 @@
+from collections import Counter
+from uuid import uuid4
+
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from .metrics import shared_redis
+from .models import AppUser, Bet, WON, PAYOUT
+
+
+class Leaderboard:
+    """
+    Ranks AppUsers by profit (returned minus staked) in redis sorted sets -
+    "leaderboard:profit" over all bets and
+    "leaderboard:{competition_id}:profit" per competition, members are
+    AppUser ids. Stakes are subtracted when
+    bets are placed and payouts added when they are settled, so top pages
+    and rank lookups are O(log n) without scanning bets.
+    """
+    PREFIX = "leaderboard:"
+    REBUILD_PREFIX = "leaderboard-rebuild:"
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def key(cls, competition_id=None):
+        if competition_id is None:
+            return cls.PREFIX + "profit"
+        return "{}{}:profit".format(cls.PREFIX, competition_id)
+
+    def change(self, changes):
+        """
+        Adds profit changes to overall and competitions' rankings in one
+        round trip
+        :param changes: iterable of (app_user_id, competition_id, amount)
+        """
+        totals = Counter()
+        for app_user_id, competition_id, amount in changes:
+            totals[(self.key(), app_user_id)] += float(amount)
+            totals[(self.key(competition_id), app_user_id)] += float(amount)
+        if not totals:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for (key, app_user_id), amount in totals.items():
+                pipe.zincrby(key, amount, app_user_id)
+            pipe.execute()
+        except Exception as e:
+            # rebuild_leaderboard command brings rankings back in line
+            print(f"Updating leaderboard failed: {e}")
+
+    def record(self, changes):
+        """
+        Applies profit changes once current transaction commits, see change
+        """
+        changes = list(changes)
+        transaction.on_commit(lambda: self.change(changes))
+
+    def page(self, competition_id=None, page=1, size=20):
+        """
+        :param page: int - 1 for the best users
+        :return: tuple (list of (rank, app_user_id, profit) tuples, number
+        of ranked users)
+        """
+        start = (page - 1) * size
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zrevrange(self.key(competition_id), start, start + size - 1,
+                       withscores=True)
+        pipe.zcard(self.key(competition_id))
+        entries, count = pipe.execute()
+        return [(start + i + 1, int(app_user_id), round(profit, 2))
+                for i, (app_user_id, profit) in enumerate(entries)], count
+
+    def rank(self, app_user_id, competition_id=None):
+        """
+        :return: tuple (rank, profit) of AppUser, None if it isn't ranked
+        """
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zrevrank(self.key(competition_id), app_user_id)
+        pipe.zscore(self.key(competition_id), app_user_id)
+        rank, profit = pipe.execute()
+        if rank is None:
+            return None
+        return rank + 1, round(float(profit), 2)
+
+    def rebuild(self, profits):
+        """
+        Replaces all rankings with given profits. New rankings are written
+        under temporary keys and renamed over current ones in one
+        transaction, which also deletes rankings missing in profits, so
+        readers never see them half built. Changes recorded after profits
+        were aggregated and before the swap are still lost - rebuild when
+        no bets are being placed or settled.
+        :param profits: iterable of (app_user_id, competition_id, profit)
+        :return: int - number of ranked users
+        """
+        rankings = {}
+        for app_user_id, competition_id, profit in profits:
+            for key in (self.key(), self.key(competition_id)):
+                ranking = rankings.setdefault(key, Counter())
+                ranking[app_user_id] += float(profit)
+
+        # Temporary keys are outside PREFIX, so they aren't taken for stale
+        # rankings by concurrent rebuild
+        temporary_prefix = "{}{}:".format(self.REBUILD_PREFIX, uuid4().hex)
+        pipe = self.client.pipeline(transaction=False)
+        for key, ranking in rankings.items():
+            pipe.zadd(temporary_prefix + key, dict(ranking))
+        pipe.execute()
+
+        stale_keys = [key for key in self.client.scan_iter(self.PREFIX + "*")
+                      if key not in rankings]
+        pipe = self.client.pipeline(transaction=True)
+        if stale_keys:
+            pipe.delete(*stale_keys)
+        for key in rankings:
+            pipe.rename(temporary_prefix + key, key)
+        pipe.execute()
+        return len(rankings.get(self.key(), ()))
+
+
+def profits_from_bets():
+    """
+    Computes profit of every AppUser in every competition from all bets
+    with one aggregate query
+    :return: list of (app_user_id, competition_id, Decimal profit) tuples
+    """
+    return [(app_user_id, competition_id, (returned or 0) - staked)
+            for app_user_id, competition_id, staked, returned in
+            Bet.objects.order_by().values('bet_user', 'fixture__competition')
+            .annotate(staked=Sum('bet_amount'),
+                      returned=Sum(PAYOUT, filter=Q(bet_result=WON)))
+            .values_list('bet_user', 'fixture__competition', 'staked',
+                         'returned')]
+
+
+def with_usernames(entries):
+    """
+    Loads usernames of ranked AppUsers with one query
+    :param entries: list of (rank, app_user_id, profit) tuples
+    :return: list of dicts with rank, app_user_id, username and profit
+    """
+    if not entries:
+        return []
+    usernames = dict(AppUser.objects.filter(
+        id__in=[app_user_id for rank, app_user_id, profit in entries]
+    ).values_list('id', 'user__username'))
+    return [{"rank": rank, "app_user_id": app_user_id,
+             "username": usernames.get(app_user_id), "profit": profit}
+            for rank, app_user_id, profit in entries]
+
+
+leaderboard = Leaderboard(shared_redis())
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import queue
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from .metrics import shared_redis
+
+
+class LiveBroadcaster:
+    """
+    Fans out changes of live fixtures to stream subscribers. Changes are
+    published to redis channel "competition:{id}:live", every process keeps
+    one pattern subscription and passes messages to in-memory queues of its
+    subscribers, so streams don't touch db or redis per client.
+    """
+    PATTERN = "competition:*:live"
+    # Changes kept for slow subscriber, newer ones are dropped when full
+    QUEUE_SIZE = 100
+
+    def __init__(self, client):
+        self.client = client
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.listener = None
+        self.listening = threading.Event()
+
+    @staticmethod
+    def channel(competition_id):
+        return "competition:{}:live".format(competition_id)
+
+    @staticmethod
+    def fixture_message(fixture):
+        return json.dumps({"id": fixture.id,
+                           "status": fixture.status,
+                           "goals_home_team": fixture.goals_home_team,
+                           "goals_away_team": fixture.goals_away_team,
+                           "minute": fixture.minute})
+
+    def publish(self, fixture):
+        """
+        Publishes fixture's score, minute and status once current
+        transaction commits
+        :param fixture: Fixture object
+        """
+        channel = self.channel(fixture.competition_id)
+        message = self.fixture_message(fixture)
+
+        def send():
+            try:
+                self.client.publish(channel, message)
+            except Exception as e:
+                print(f"Publishing change of fixture {fixture.id} failed: {e}")
+
+        transaction.on_commit(send)
+
+    def subscribe(self, competition_id, subscriber=None):
+        """
+        Registers subscriber of competition's changes, starts listening to
+        redis when first one subscribes
+        :param subscriber: queue getting messages, new queue.Queue if None
+        :return: queue.Queue or given subscriber getting JSON messages of
+        changed fixtures
+        """
+        if subscriber is None:
+            subscriber = queue.Queue(maxsize=self.QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.setdefault(competition_id, set()).add(subscriber)
+        self.ensure_listener()
+        self.listening.wait(timeout=settings.LIVE_STREAM_KEEPALIVE)
+        return subscriber
+
+    def ensure_listener(self):
+        """
+        Starts listening to redis unless listener thread is alive. Called on
+        subscribe and by streams on every keepalive, so listener which died
+        with its redis connection is restarted while anybody streams.
+        :return: bool - True if new listener was started
+        """
+        with self.lock:
+            if self.listener is not None and self.listener.is_alive():
+                return False
+            self.listening.clear()
+            self.listener = threading.Thread(target=self.listen, daemon=True)
+            self.listener.start()
+            return True
+
+    def unsubscribe(self, competition_id, subscriber):
+        with self.lock:
+            subscribers = self.subscribers.get(competition_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self.subscribers.pop(competition_id, None)
+
+    def dispatch(self, channel, message):
+        competition_id = int(channel.split(":")[1])
+        with self.lock:
+            subscribers = list(self.subscribers.get(competition_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                pass
+
+    def listen(self):
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(self.PATTERN)
+            self.listening.set()
+            for message in pubsub.listen():
+                if message['type'] == 'pmessage':
+                    self.dispatch(message['channel'], message['data'])
+        except Exception as e:
+            # Streams start listening again on their next keepalive
+            print(f"Live scores subscription failed: {e}")
+        finally:
+            self.listening.set()
+
+
+class AsyncSubscriber:
+    """
+    Subscriber queue of stream served by event loop - listener thread hands
+    messages over to the loop, so one process serves many streams without
+    a thread per stream
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=LiveBroadcaster.QUEUE_SIZE)
+
+    def put_nowait(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self.offer, message)
+        except RuntimeError:
+            # Loop of disconnected stream is already closed
+            pass
+
+    def offer(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self, timeout):
+        """
+        :raise asyncio.TimeoutError: if no message comes in timeout seconds
+        """
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+live_scores = LiveBroadcaster(shared_redis())
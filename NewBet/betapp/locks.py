@@ -0,0 +1,59 @@
+from contextlib import contextmanager
+import uuid
+
+from .metrics import shared_redis
+
+
+class LeaseLock:
+    """
+    Redis lease lock: key "{name}:lease" holds random token of the owner and
+    expires after ttl, so lock of crashed worker is freed on its own.
+    Only the owner can release it.
+    """
+    # Deletes lock only if it's still held with given token
+    RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.release_script = client.register_script(self.RELEASE_SCRIPT)
+
+    @staticmethod
+    def key(name):
+        return "{}:lease".format(name)
+
+    def acquire(self, name, ttl):
+        """
+        :param ttl: int - seconds after which lock expires
+        :return: string token if lock was acquired, None if it's held
+        """
+        token = uuid.uuid4().hex
+        if self.client.set(self.key(name), token, nx=True, ex=ttl):
+            return token
+        return None
+
+    def release(self, name, token):
+        """
+        :return: True if lock was released, False if it expired before
+        """
+        return bool(self.release_script(keys=[self.key(name)], args=[token]))
+
+    @contextmanager
+    def hold(self, name, ttl):
+        """
+        Context manager yielding True if lock was acquired, False if it's
+        held by someone else - caller should skip its work then
+        """
+        token = self.acquire(name, ttl)
+        try:
+            yield token is not None
+        finally:
+            if token is not None:
+                self.release(name, token)
+
+
+lease_lock = LeaseLock(shared_redis())
@@ -0,0 +1,400 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+import json
+import random
+import statistics
+import subprocess
+from time import perf_counter
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from betapp import betting
+from betapp.api_connection import sports_api, LocalCache
+from betapp.cassettes import Cassette, ReplaySession, using_session
+from betapp.models import AppUser, User, Bet, Fixture, Team, Competition
+from betapp.odds import price_fixtures
+from betapp.settlement import settle_fixtures
+from betapp.standings import standings_store
+from betapp.synthetic import seed_competition, seed_app_users, seed_bets
+from betapp.tasks import fetch_competition
+from betapp.update_db import calculate_result_odds, create_fixtures, \
+    create_team_standing, create_competition, update_fixtures
+
+
+BENCHMARKS = ("settlement", "odds", "import", "standings", "views", "ingest",
+              "placement")
+
+
+class Rollback(Exception):
+    pass
+
+
+def sizes(value):
+    return [int(size) for size in value.split(",") if size]
+
+
+class Discarded:
+    """
+    Stand-in of leaderboard and bet notifier - benchmark bets are neither
+    ranked nor confirmed
+    """
+    def record(self, changes):
+        pass
+
+    def queue(self, bet_id):
+        pass
+
+
+@contextmanager
+def unpublished_bets():
+    """Places bets without their redis side effects"""
+    previous = betting.leaderboard, betting.bet_notifier
+    betting.leaderboard = betting.bet_notifier = Discarded()
+    try:
+        yield
+    finally:
+        betting.leaderboard, betting.bet_notifier = previous
+
+
+@contextmanager
+def rolled_back():
+    """Runs block in transaction which is always rolled back"""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+class Command(BaseCommand):
+    help = "Times settlement, odds pricing, fixture import, standings, " \
+           "views and concurrent bet placement on deterministic data of " \
+           "several sizes and appends results as one JSON line to " \
+           "--output. All benchmark data is rolled back or deleted " \
+           "afterwards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bets', type=sizes, default=[1000, 100000],
+                            help="comma separated numbers of settled bets")
+        parser.add_argument('--teams', type=sizes, default=[20, 200],
+                            help="comma separated numbers of teams")
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', default=",".join(BENCHMARKS),
+                            help="comma separated benchmarks to run")
+        parser.add_argument('--output', default="benchmarks.jsonl")
+        parser.add_argument('--cassette',
+                            help="cassette of record_cassette command, "
+                                 "import and refresh of its leagues are "
+                                 "timed against its replayed responses")
+        parser.add_argument('--latency', type=float, default=0,
+                            help="seconds every replayed response is delayed")
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help="fraction of replayed requests failing")
+        parser.add_argument('--placements', type=int, default=2000,
+                            help="number of concurrently placed bets")
+        parser.add_argument('--threads', type=int, default=8,
+                            help="threads placing bets")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.results = []
+        only = options['only'].split(",")
+        # Query log of DEBUG would keep every seeding INSERT in memory
+        with override_settings(DEBUG=False):
+            for name in BENCHMARKS:
+                if name in only:
+                    getattr(self, "bench_" + name)()
+
+        run = {"timestamp": timezone.now().isoformat(),
+               "revision": self.revision(),
+               "database": connection.vendor,
+               "options": {key: options[key]
+                           for key in ("bets", "teams", "users", "repeat",
+                                       "seed", "cassette", "latency",
+                                       "error_rate", "placements",
+                                       "threads")},
+               "results": self.results}
+        with open(options['output'], "a") as output:
+            output.write(json.dumps(run) + "\n")
+        self.stdout.write("Results appended to {}".format(options['output']))
+
+    @staticmethod
+    def revision():
+        try:
+            return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                  capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def rng(self):
+        return random.Random(self.options['seed'])
+
+    def measure(self, name, size, function, repeat=None, setup=None):
+        """
+        Runs function repeat times and records best and median time and
+        number of queries of one run
+        :param setup: function run untimed before every run, e.g. to reset
+        rows changed by previous run
+        """
+        times = []
+        for i in range(repeat or self.options['repeat']):
+            if setup is not None:
+                setup()
+            with CaptureQueriesContext(connection) as queries:
+                start = perf_counter()
+                function()
+                times.append(perf_counter() - start)
+        result = {"name": name, "size": size,
+                  "seconds": round(min(times), 6),
+                  "median": round(statistics.median(times), 6),
+                  "queries": len(queries)}
+        self.results.append(result)
+        self.stdout.write("{name:<32} {size:>9} {seconds:>10.4f}s "
+                          "{queries:>6} queries".format(**result))
+
+    def skip(self, name, reason):
+        self.results.append({"name": name, "skipped": reason})
+        self.stdout.write("{:<32} skipped: {}".format(name, reason))
+
+    def bench_settlement(self):
+        for bets_count in self.options['bets']:
+            rng = self.rng()
+            with rolled_back():
+                competition, teams = seed_competition(rng, 2)
+                fixture = Fixture.objects.filter(competition=competition)\
+                    .first()
+                app_user_ids = seed_app_users(self.options['users'],
+                                              prefix="bench")
+                seed_bets(rng, [fixture.id], app_user_ids, bets_count)
+                Fixture.objects.filter(id=fixture.id).update(
+                    status=2, goals_home_team=2, goals_away_team=1
+                )
+                fixture.refresh_from_db()
+                self.measure("settlement", bets_count,
+                             lambda: settle_fixtures([fixture]), repeat=1)
+
+    def bench_odds(self):
+        for teams_count in self.options['teams']:
+            rng = self.rng()
+            pairs = [((rng.randint(3, 10), rng.randint(2, 8),
+                       rng.randint(1, 7)),
+                      (rng.randint(3, 10), rng.randint(2, 8),
+                       rng.randint(1, 7)))
+                     for i in range(teams_count * (teams_count - 1))]
+
+            def scalar():
+                for home, away in pairs:
+                    calculate_result_odds({
+                        'home_wins': home[0], 'home_draws': home[1],
+                        'home_losses': home[2], 'away_wins': away[0],
+                        'away_draws': away[1], 'away_losses': away[2],
+                    })
+
+            self.measure("odds:scalar", len(pairs), scalar)
+            self.measure("odds:vectorized", len(pairs),
+                         lambda: price_fixtures([home for home, away in pairs],
+                                                [away for home, away in pairs]))
+
+    def bench_import(self):
+        for teams_count in self.options['teams']:
+            with rolled_back():
+                competition = Competition.objects.create(
+                    caption="Bench import", league="Bench", year=2024,
+                    api_id=0, number_of_teams=teams_count,
+                    number_of_matchdays=2 * (teams_count - 1),
+                    current_matchday=1
+                )
+                teams = Team.objects.bulk_create(
+                    [Team(name="Team {}".format(i), short_name="T",
+                          competition=competition)
+                     for i in range(teams_count)]
+                )
+                kickoff = timezone.now() + timedelta(days=1)
+                events = {"events": [
+                    {"idEvent": str(i), "strHomeTeam": home.name,
+                     "strAwayTeam": away.name,
+                     "dateEvent": (kickoff + timedelta(days=i // teams_count))
+                     .date().isoformat(), "strTime": "15:00:00"}
+                    for i, (home, away)
+                    in enumerate((home, away) for home in teams
+                                 for away in teams if home != away)
+                ]}
+                team_ids = {team.name: team.id for team in teams}
+                # Every run imports into empty competition, not re-imports
+                self.measure("import:fixtures", len(events["events"]),
+                             lambda: create_fixtures(0, competition, team_ids,
+                                                     events),
+                             setup=lambda: Fixture.objects.filter(
+                                 competition=competition).delete())
+
+    def bench_standings(self):
+        try:
+            standings_store.client.ping()
+        except Exception as e:
+            self.skip("standings", "redis unavailable: {}".format(e))
+            return
+        for teams_count in self.options['teams']:
+            with rolled_back():
+                competition, teams = seed_competition(self.rng(), teams_count)
+                try:
+                    self.measure("standings:write", teams_count,
+                                 lambda: create_team_standing(competition.id))
+                    self.measure("standings:read", teams_count,
+                                 lambda: standings_store.read_history(
+                                     competition.id))
+                finally:
+                    standings_store.client.delete(
+                        standings_store.key(competition.id)
+                    )
+
+    def bench_views(self):
+        locmem = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }}
+        with override_settings(ALLOWED_HOSTS=['testserver'], CACHES=locmem):
+            for teams_count in self.options['teams']:
+                rng = self.rng()
+                with rolled_back():
+                    competition, teams = seed_competition(
+                        rng, teams_count, finished_matchdays=teams_count - 1
+                    )
+                    app_user_ids = seed_app_users(10, prefix="bench")
+                    scheduled = list(Fixture.objects.filter(
+                        competition=competition, status=1
+                    ).values_list('id', flat=True))
+                    seed_bets(rng, scheduled, app_user_ids, 1000)
+                    app_user = AppUser.objects.select_related('user')\
+                        .get(id=app_user_ids[0])
+                    self.bench_competition_views(competition, teams[0],
+                                                 scheduled[0], app_user,
+                                                 teams_count)
+
+    def bench_competition_views(self, competition, team, fixture_id,
+                                app_user, size):
+        client = Client()
+        client.force_login(app_user.user)
+        urls = [
+            ("competitions", reverse('competitions')),
+            ("competition", reverse('competition', args=[competition.id])),
+            ("finished-fixtures", reverse('finished-fixtures',
+                                          args=[competition.id])),
+            ("competition-table", reverse('competition-table',
+                                          args=[competition.id])),
+            ("show-team", reverse('show-team', args=[team.id])),
+            ("bet-fixture", reverse('bet-fixture', args=[fixture_id])),
+            ("account-details", reverse('account-details')),
+        ]
+        for name, url in urls:
+            def cold():
+                cache.clear()
+                client.get(url)
+            self.measure("view:" + name, size, cold)
+            self.measure("view:" + name + ":warm", size,
+                         lambda: client.get(url))
+
+    def bench_ingest(self):
+        if not self.options['cassette']:
+            self.skip("ingest", "no --cassette given")
+            return
+        cassette = Cassette.load(self.options['cassette'])
+        for league in cassette.meta.get("leagues", []):
+            events = cassette.responses(
+                sports_api.base_url + "eventsseason.php?id={}".format(
+                    league["id"])
+            )
+            size = len((events[0]["body"] or {}).get("events") or []) \
+                if events else 0
+            session = ReplaySession(cassette, latency=self.options['latency'],
+                                    error_rate=self.options['error_rate'],
+                                    seed=self.options['seed'])
+            with rolled_back(), \
+                    using_session(sports_api, session, LocalCache()):
+                imported = []
+                self.measure("ingest:import", size, lambda: imported.append(
+                    create_competition(league["id"], league["name"])
+                ), repeat=1)
+
+                def refresh():
+                    # Every refresh goes through replayed transport
+                    sports_api.cache = LocalCache()
+                    competition, events_data, fetch_time = \
+                        fetch_competition(imported[0])
+                    update_fixtures(competition, events_data=events_data)
+
+                self.measure("ingest:refresh", size, refresh)
+            if session.missing:
+                self.stdout.write("Requests missing in cassette: {}".format(
+                    ", ".join(sorted(set(session.missing)))))
+
+    def bench_placement(self):
+        """
+        Places bets of few users from many threads and records throughput
+        and lost updates - accepted bets whose stake wasn't debited or which
+        weren't saved. Threads need committed data, so it's deleted at the
+        end instead of rolled back.
+        """
+        placements = self.options['placements']
+        users_count = min(self.options['users'], 10)
+        # Enough cash for 3/4 of bets, so some are rejected
+        cash = placements * 3 // 4 // users_count
+        competition, teams = seed_competition(self.rng(), 2,
+                                              caption="Bench placement")
+        try:
+            app_user_ids = seed_app_users(users_count,
+                                          prefix="bench_placement", cash=cash)
+            fixture = Fixture.objects.filter(competition=competition).first()
+
+            def place(app_user_id):
+                try:
+                    betting.place_bet(app_user_id, fixture.id, 1,
+                                      Decimal("1.00"),
+                                      fixture.course_team_home_win)
+                    return True
+                except betting.BetRejected:
+                    return False
+                finally:
+                    connection.close()
+
+            with unpublished_bets(), \
+                    ThreadPoolExecutor(max_workers=self.options['threads']) \
+                    as executor:
+                start = perf_counter()
+                accepted = sum(executor.map(
+                    place, (app_user_ids[i % users_count]
+                            for i in range(placements))
+                ))
+                seconds = perf_counter() - start
+
+            # Every bet stakes 1.00
+            debited = users_count * cash - sum(
+                AppUser.objects.filter(id__in=app_user_ids)
+                .values_list('cash', flat=True)
+            )
+            saved = Bet.objects.filter(fixture=fixture).count()
+            result = {"name": "placement", "size": placements,
+                      "threads": self.options['threads'],
+                      "seconds": round(seconds, 6),
+                      "bets_per_second": round(placements / seconds, 1),
+                      "accepted": accepted,
+                      "lost_updates": int(abs(accepted - debited) +
+                                          abs(accepted - saved))}
+            self.results.append(result)
+            self.stdout.write("{name:<32} {size:>9} {seconds:>10.4f}s "
+                              "{bets_per_second:>9} bets/s "
+                              "{lost_updates:>4} lost updates".format(**result))
+        finally:
+            competition.delete()
+            User.objects.filter(username__startswith="bench_placement_")\
+                .delete()
@@ -0,0 +1,78 @@
+from random import Random
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from betapp.accounts import rebuild_account_summaries
+from betapp.models import Fixture
+from betapp.standings import standings_store
+from betapp.synthetic import seed_competition, seed_app_users, seed_bets, \
+    standings_history, SEED_BATCH_SIZE
+from betapp.update_db import rebuild_league_table
+
+
+class Command(BaseCommand):
+    help = "Generates deterministic synthetic competitions, teams, " \
+           "fixtures, users and pending bets for profiling, e.g. " \
+           "--leagues 50 --users 100000 --bets 1000000. Rows are written " \
+           "in batches, so memory use doesn't grow with --bets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--leagues', type=int, default=5)
+        parser.add_argument('--teams', type=int, default=20,
+                            help="number of teams of every league")
+        parser.add_argument('--finished-matchdays', type=int, default=10)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--bets', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default="synthetic",
+                            help="prefix of usernames and league names, "
+                                 "change it to generate data again")
+        parser.add_argument('--standings', action='store_true',
+                            help="also write standings history to redis")
+
+    def handle(self, *args, **options):
+        rng = Random(options['seed'])
+        prefix = options['prefix']
+        finished_matchdays = min(options['finished_matchdays'],
+                                 2 * (options['teams'] - 1))
+
+        competitions = []
+        for i in range(options['leagues']):
+            with transaction.atomic():
+                competition, teams = seed_competition(
+                    rng, options['teams'], api_id=-(i + 1),
+                    caption="{} League {}".format(prefix, i),
+                    finished_matchdays=finished_matchdays
+                )
+                rebuild_league_table(competition)
+            competitions.append(competition)
+            if options['standings']:
+                for matchday, positions in \
+                        standings_history(competition).items():
+                    standings_store.write_matchday(competition.id, matchday,
+                                                   positions)
+            self.stdout.write("Created {} with {} teams".format(
+                competition, len(teams)))
+
+        with transaction.atomic():
+            app_user_ids = seed_app_users(options['users'], prefix=prefix)
+        self.stdout.write("Created {} users".format(len(app_user_ids)))
+
+        fixture_ids = list(Fixture.objects.filter(competition__in=competitions,
+                                                  status=1)
+                           .values_list('id', flat=True))
+        if not fixture_ids or not app_user_ids:
+            self.stdout.write("No scheduled fixtures or users, no bets "
+                              "created")
+            return
+        created = 0
+        while created < options['bets']:
+            count = min(SEED_BATCH_SIZE * 50, options['bets'] - created)
+            with transaction.atomic():
+                created += seed_bets(rng, fixture_ids, app_user_ids, count,
+                                     summaries=False)
+            self.stdout.write("Created {} bets".format(created))
+        # Summaries are aggregated once from all bets, not after every chunk
+        self.stdout.write("Computed {} account summaries".format(
+            rebuild_account_summaries(app_user_ids)))
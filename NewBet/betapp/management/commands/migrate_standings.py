@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from betapp.standings import standings_store
+
+
+class Command(BaseCommand):
+    help = "Converts per team standing hashes in redis to per competition " \
+           "standings hashes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete old per team keys")
+
+    def handle(self, *args, **options):
+        converted = standings_store.migrate_team_keys(
+            delete=not options['keep']
+        )
+        self.stdout.write("Converted {} team standing keys".format(converted))
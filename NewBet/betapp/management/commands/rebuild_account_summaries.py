@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from betapp.accounts import rebuild_account_summaries
+
+
+class Command(BaseCommand):
+    help = "Computes account summaries of all AppUsers from their bets"
+
+    def handle(self, *args, **options):
+        written = rebuild_account_summaries()
+        self.stdout.write("Rebuilt {} account summaries".format(written))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from betapp.leaderboard import leaderboard, profits_from_bets
+
+
+class Command(BaseCommand):
+    help = "Computes overall and per competition leaderboards in redis " \
+           "from all bets"
+
+    def handle(self, *args, **options):
+        ranked = leaderboard.rebuild(profits_from_bets())
+        self.stdout.write("Ranked {} users".format(ranked))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from betapp.models import Competition
+from betapp.update_db import rebuild_league_table
+
+
+class Command(BaseCommand):
+    help = "Computes league tables of all competitions from finished fixtures"
+
+    def handle(self, *args, **options):
+        for competition in Competition.objects.all():
+            rebuild_league_table(competition)
+            self.stdout.write("Rebuilt league table of {}".format(competition))
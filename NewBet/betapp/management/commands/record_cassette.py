@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from betapp.api_connection import TheSportsDB, LocalCache
+from betapp.cassettes import Cassette, RecordingSession
+
+
+def league_ids(value):
+    return [league_id for league_id in value.split(",") if league_id]
+
+
+class Command(BaseCommand):
+    help = "Records TheSportsDB responses used by import, refresh and live " \
+           "polling of given leagues (leagues list, teams, season events, " \
+           "table, live scores and lookups and timelines of live events) " \
+           "into gzipped cassette, which can be replayed offline with " \
+           "SPORTSDB_CASSETTE setting or bench --cassette."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--leagues', type=league_ids, default=["4328"],
+                            help="comma separated TheSportsDB league ids")
+        parser.add_argument('--polls', type=int, default=1,
+                            help="number of recorded live polls of every "
+                                 "league - its live scores and lookup and "
+                                 "timeline of every live event")
+        parser.add_argument('--interval', type=float, default=60,
+                            help="seconds between live polls")
+        parser.add_argument('--output', default="sportsdb.json.gz")
+
+    def handle(self, *args, **options):
+        cassette = Cassette()
+        # Empty cache, so every request reaches the API and is recorded
+        api = TheSportsDB(cache=LocalCache(),
+                          session=RecordingSession(cassette))
+
+        leagues_data = api.get_all_leagues()
+        if not leagues_data or not leagues_data.get('leagues'):
+            raise CommandError("Leagues list couldn't be fetched")
+        names = {str(league['idLeague']): league['strLeague']
+                 for league in leagues_data['leagues']}
+
+        leagues = []
+        for league_id in options['leagues']:
+            if league_id not in names:
+                raise CommandError("Unknown league {}".format(league_id))
+            api.get_teams_by_league(names[league_id])
+            api.get_events_by_league(league_id)
+            api.get_league_table(league_id)
+            leagues.append({"id": league_id, "name": names[league_id]})
+
+        for poll in range(options['polls']):
+            if poll:
+                time.sleep(options['interval'])
+            for league in leagues:
+                live_data = api.get_live_scores(league["id"])
+                # poll_live_fixtures looks up events and their timelines too
+                for event in (live_data or {}).get('events') or []:
+                    if event.get('idEvent'):
+                        api.get_event(event['idEvent'])
+                        api.get_event_timeline(event['idEvent'])
+
+        cassette.meta = {"leagues": leagues,
+                         "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+        cassette.save(options['output'])
+        self.stdout.write("Recorded {} requests of {} leagues to {}".format(
+            sum(len(responses)
+                for responses in cassette.interactions.values()),
+            len(leagues), options['output']))
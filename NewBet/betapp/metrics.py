@@ -0,0 +1,235 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import Counter
+import math
+import threading
+
+import redis
+from django.conf import settings
+
+
+# Upper bounds of latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Name to (type, help) of every exported metric
+METRICS = {
+    "betapp_http_requests_total":
+        ("counter", "Requests handled by views"),
+    "betapp_http_request_duration_seconds":
+        ("histogram", "Latency of views"),
+    "betapp_http_sql_queries_total":
+        ("counter", "SQL queries run by views"),
+    "betapp_http_sql_duration_seconds_total":
+        ("counter", "Seconds spent in SQL queries by views"),
+    "betapp_http_redis_commands_total":
+        ("counter", "Redis commands sent by views"),
+    "betapp_api_request_duration_seconds":
+        ("histogram", "Latency of TheSportsDB requests per endpoint"),
+    "betapp_api_events_total":
+        ("counter", "TheSportsDB client requests, errors and cache results"),
+    "betapp_task_duration_seconds":
+        ("histogram", "Duration of celery tasks"),
+}
+
+# Batch of current request, its metrics are sent to redis at once
+current_batch = ContextVar('metrics_batch', default=None)
+# Counter of redis commands of current request
+redis_commands = ContextVar('redis_commands', default=None)
+
+
+def series(name, labels):
+    """
+    :return: string - prometheus series like 'name{label="value"}'
+    """
+    if not labels:
+        return name
+    return "{}{{{}}}".format(name, ",".join(
+        '{}="{}"'.format(label, str(value).replace("\\", "\\\\")
+                         .replace('"', '\\"').replace("\n", "\\n"))
+        for label, value in sorted(labels.items())
+    ))
+
+
+def format_bound(bound):
+    return "+Inf" if bound == math.inf else repr(float(bound))
+
+
+class MetricsBatch:
+    """
+    Sums metric changes in memory until they are flushed to redis, threads
+    carried into batch by MetricsRegistry.carry may change it at once
+    """
+    def __init__(self):
+        self.changes = Counter()
+        self.lock = threading.Lock()
+
+    def increment(self, name, labels=None, value=1):
+        with self.lock:
+            self.changes[series(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        labels = dict(labels or {})
+        with self.lock:
+            # Buckets are cumulative, all of them are kept so none is missing
+            # from exported histogram
+            for bound in LATENCY_BUCKETS + (math.inf,):
+                self.changes[series(name + "_bucket",
+                                    dict(labels, le=format_bound(bound)))] \
+                    += int(value <= bound)
+            self.changes[series(name + "_sum", labels)] += value
+            self.changes[series(name + "_count", labels)] += 1
+
+
+class MetricsRegistry:
+    """
+    Metrics shared by all web and celery worker processes - every process
+    adds its changes to redis hash "metrics" (series to value), which is
+    rendered in Prometheus text format by /metrics
+    """
+    KEY = "metrics"
+
+    def __init__(self, client):
+        self.client = client
+
+    @contextmanager
+    def batch(self):
+        """
+        Collects all metric changes made in block, including ones made
+        deeper by increment/observe, and sends them in one round trip
+        """
+        batch = MetricsBatch()
+        token = current_batch.set(batch)
+        try:
+            yield batch
+        finally:
+            current_batch.reset(token)
+            self.flush(batch)
+
+    def increment(self, name, labels=None, value=1):
+        with self.change() as batch:
+            batch.increment(name, labels, value)
+
+    def observe(self, name, labels, value):
+        with self.change() as batch:
+            batch.observe(name, labels, value)
+
+    @contextmanager
+    def change(self):
+        """
+        Yields batch of current block, or new one sent at the end of block
+        if there is none
+        """
+        batch = current_batch.get()
+        if batch is not None:
+            yield batch
+        else:
+            with self.batch() as batch:
+                yield batch
+
+    def carry(self, function):
+        """
+        Wraps function so it adds metric changes to batch of caller when run
+        by other thread, e.g. ThreadPoolExecutor - its threads don't inherit
+        context variables, so every change would be sent on its own
+        :return: wrapped function, function itself if caller has no batch
+        """
+        batch = current_batch.get()
+        if batch is None:
+            return function
+
+        def run(*args, **kwargs):
+            token = current_batch.set(batch)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                current_batch.reset(token)
+        return run
+
+    def flush(self, batch):
+        if not settings.METRICS_ENABLED or not batch.changes:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for field, value in batch.changes.items():
+                pipe.hincrbyfloat(self.KEY, field, value)
+            pipe.execute()
+        except Exception as e:
+            print(f"Sending metrics failed: {e}")
+
+    def collect(self):
+        """
+        :return: dict - series to value summed over all processes
+        """
+        return {field: float(value)
+                for field, value in self.client.hgetall(self.KEY).items()}
+
+    @staticmethod
+    def family(field):
+        name = field.split("{")[0]
+        for suffix in ("_bucket", "_sum", "_count"):
+            if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+                return name[:-len(suffix)]
+        return name
+
+    @staticmethod
+    def sort_key(field):
+        # Series of one family grouped by labels, buckets in order of bounds
+        name, brace, labels = field.partition("{")
+        bound = labels.partition('le="')[2].partition('"')[0]
+        return (name, labels.replace('le="{}"'.format(bound), ""),
+                math.inf if bound in ("", "+Inf") else float(bound))
+
+    def render(self):
+        """
+        :return: string - all metrics in Prometheus text format
+        """
+        families = {}
+        for field, value in self.collect().items():
+            families.setdefault(self.family(field), []).append((field, value))
+
+        lines = []
+        for name in sorted(families):
+            metric_type, help_text = METRICS.get(name, ("untyped", name))
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for field, value in sorted(families[name],
+                                       key=lambda item:
+                                       self.sort_key(item[0])):
+                lines.append("{} {}".format(field, repr(value)))
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedRedis(redis.StrictRedis):
+    """
+    Redis client counting commands sent while handling request, pipeline
+    counts as one command
+    """
+    @staticmethod
+    def count_command():
+        counter = redis_commands.get()
+        if counter is not None:
+            counter["commands"] += 1
+
+    def execute_command(self, *args, **options):
+        self.count_command()
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, *args, **kwargs):
+        self.count_command()
+        return super().pipeline(*args, **kwargs)
+
+
+def shared_redis():
+    """
+    :return: InstrumentedRedis client of redis configured in settings
+    """
+    return InstrumentedRedis(host=settings.REDIS_HOST,
+                             port=settings.REDIS_PORT,
+                             db=settings.REDIS_DB,
+                             decode_responses=True)
+
+
+metrics = MetricsRegistry(redis.StrictRedis(host=settings.REDIS_HOST,
+                                            port=settings.REDIS_PORT,
+                                            db=settings.REDIS_DB,
+                                            decode_responses=True))
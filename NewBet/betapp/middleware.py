@@ -0,0 +1,55 @@
+from collections import Counter
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connection
+
+from .metrics import metrics, redis_commands
+
+
+class MetricsMiddleware:
+    """
+    Records latency, number and time of SQL queries and number of redis
+    commands of every request, labeled with url name of view
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        sql = Counter()
+
+        def time_query(execute, sql_text, params, many, context):
+            start = perf_counter()
+            try:
+                return execute(sql_text, params, many, context)
+            finally:
+                sql["queries"] += 1
+                sql["seconds"] += perf_counter() - start
+
+        commands = Counter()
+        token = redis_commands.set(commands)
+        start = perf_counter()
+        try:
+            with metrics.batch() as batch, \
+                    connection.execute_wrapper(time_query):
+                response = self.get_response(request)
+                match = request.resolver_match
+                labels = {"view": match.url_name or match.view_name
+                          if match else "unmatched"}
+                batch.observe("betapp_http_request_duration_seconds", labels,
+                              perf_counter() - start)
+                batch.increment("betapp_http_requests_total",
+                                dict(labels, method=request.method,
+                                     status=response.status_code))
+                batch.increment("betapp_http_sql_queries_total", labels,
+                                sql["queries"])
+                batch.increment("betapp_http_sql_duration_seconds_total",
+                                labels, sql["seconds"])
+                batch.increment("betapp_http_redis_commands_total", labels,
+                                commands["commands"])
+        finally:
+            redis_commands.reset(token)
+        return response
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:51
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Max
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Repeated imports could create the same team or fixture twice - merges
+    them before unique constraints are added. Fixtures of duplicate teams
+    move to the oldest team, bets of duplicate fixtures move to the newest
+    fixture, which has the latest odds and score.
+    """
+    Team = apps.get_model('betapp', 'Team')
+    Fixture = apps.get_model('betapp', 'Fixture')
+    Bet = apps.get_model('betapp', 'Bet')
+
+    teams = Team.objects.filter(competition__isnull=False).order_by()\
+        .values('competition', 'name')\
+        .annotate(count=Count('id'), kept=Min('id')).filter(count__gt=1)
+    for team in teams:
+        duplicate_ids = list(Team.objects.filter(
+            competition=team['competition'], name=team['name']
+        ).exclude(id=team['kept']).values_list('id', flat=True))
+        Fixture.objects.filter(home_team_id__in=duplicate_ids)\
+            .update(home_team_id=team['kept'])
+        Fixture.objects.filter(away_team_id__in=duplicate_ids)\
+            .update(away_team_id=team['kept'])
+        Team.objects.filter(id__in=duplicate_ids).delete()
+
+    fixtures = Fixture.objects.order_by()\
+        .values('competition', 'home_team', 'away_team', 'date')\
+        .annotate(count=Count('id'), kept=Max('id')).filter(count__gt=1)
+    for fixture in fixtures:
+        duplicate_ids = list(Fixture.objects.filter(
+            competition=fixture['competition'],
+            home_team=fixture['home_team'], away_team=fixture['away_team'],
+            date=fixture['date']
+        ).exclude(id=fixture['kept']).values_list('id', flat=True))
+        Bet.objects.filter(fixture_id__in=duplicate_ids)\
+            .update(fixture_id=fixture['kept'])
+        Fixture.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betapp', '0002_bookmaker_bet_bet_placed_at_bet_bookmaker_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bet',
+            index=models.Index(fields=['fixture', 'bet_result'], name='bet_fixture_result_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bet',
+            index=models.Index(fields=['bet_user', 'bet_placed_at'], name='bet_user_placed_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='competition',
+            index=models.Index(fields=['api_id', 'caption'], name='competition_api_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fixture',
+            index=models.Index(fields=['competition', 'status', 'date'], name='fixture_competition_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fixture',
+            index=models.Index(fields=['status', 'date'], name='fixture_status_date_idx'),
+        ),
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='fixture',
+            constraint=models.UniqueConstraint(fields=('competition', 'home_team', 'away_team', 'date'), name='unique_fixture'),
+        ),
+        migrations.AddConstraint(
+            model_name='team',
+            constraint=models.UniqueConstraint(fields=('competition', 'name'), name='unique_team_in_competition'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betapp', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeagueTableRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('played', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('draws', models.IntegerField(default=0)),
+                ('losses', models.IntegerField(default=0)),
+                ('goals_for', models.IntegerField(default=0)),
+                ('goals_against', models.IntegerField(default=0)),
+                ('goal_difference', models.IntegerField(default=0)),
+                ('points', models.IntegerField(default=0)),
+                ('competition', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='table_rows', to='betapp.competition')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='table_rows', to='betapp.team')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['competition', '-points', '-goal_difference', '-goals_for'], name='table_row_ranking_idx')],
+                'constraints': [models.UniqueConstraint(fields=('competition', 'team'), name='unique_table_row')],
+            },
+        ),
+    ]
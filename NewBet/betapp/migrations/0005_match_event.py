@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betapp', '0004_league_table'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.IntegerField()),
+                ('event_type', models.CharField(max_length=32)),
+                ('detail', models.CharField(blank=True, default='', max_length=64)),
+                ('player', models.CharField(blank=True, default='', max_length=100)),
+                ('home', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('fixture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='match_events', to='betapp.fixture')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['event_type', 'fixture'], name='match_event_type_idx')],
+                'constraints': [models.UniqueConstraint(fields=('fixture', 'minute', 'event_type', 'player'), name='unique_match_event')],
+            },
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:22
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q, F, Sum, Count, ExpressionWrapper
+from django.db.models.functions import Cast
+
+
+def backfill_summaries(apps, schema_editor):
+    """
+    Computes summary of every AppUser with bets from all its bets, like
+    rebuild_account_summaries command does
+    """
+    AccountSummary = apps.get_model('betapp', 'AccountSummary')
+    Bet = apps.get_model('betapp', 'Bet')
+    payout_field = models.DecimalField(max_digits=14, decimal_places=4)
+    payout = ExpressionWrapper(
+        F('bet_amount') * Cast('bet_course', payout_field),
+        output_field=payout_field
+    )
+    # Bet results: 0 lost, 1 won, 2 pending
+    rows = Bet.objects.order_by().values('bet_user').annotate(
+        bets_count=Count('id'),
+        pending_count=Count('id', filter=Q(bet_result=2)),
+        won_count=Count('id', filter=Q(bet_result=1)),
+        lost_count=Count('id', filter=Q(bet_result=0)),
+        total_staked=Sum('bet_amount'),
+        total_returned=Sum(payout, filter=Q(bet_result=1)),
+        pending_exposure=Sum('bet_amount', filter=Q(bet_result=2)),
+    )
+    AccountSummary.objects.bulk_create(
+        [AccountSummary(
+            app_user_id=row.pop('bet_user'),
+            total_returned=(row.pop('total_returned') or Decimal(0))
+            .quantize(Decimal('0.01')),
+            pending_exposure=row.pop('pending_exposure') or 0,
+            **row
+        ) for row in rows],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betapp', '0005_match_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bets_count', models.IntegerField(default=0)),
+                ('pending_count', models.IntegerField(default=0)),
+                ('won_count', models.IntegerField(default=0)),
+                ('lost_count', models.IntegerField(default=0)),
+                ('total_staked', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_returned', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('pending_exposure', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('app_user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='betapp.appuser')),
+            ],
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:47
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def detach_duplicate_api_ids(apps, schema_editor):
+    """
+    Rescheduled events used to be imported again as new fixtures - newest
+    fixture of every API event keeps its id, older copies (and their bets)
+    stay but are no longer matched to the API
+    """
+    Fixture = apps.get_model('betapp', 'Fixture')
+    duplicates = Fixture.objects.filter(api_fixture_id__isnull=False)\
+        .order_by().values('competition', 'api_fixture_id')\
+        .annotate(count=Count('id'), newest=Max('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        Fixture.objects.filter(competition=duplicate['competition'],
+                               api_fixture_id=duplicate['api_fixture_id'])\
+            .exclude(id=duplicate['newest']).update(api_fixture_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betapp', '0006_account_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(detach_duplicate_api_ids,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='fixture',
+            constraint=models.UniqueConstraint(fields=('competition', 'api_fixture_id'), name='unique_fixture_api_id'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betapp', '0007_fixture_api_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bet',
+            name='fixture',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='fixture', to='betapp.fixture'),
+        ),
+    ]
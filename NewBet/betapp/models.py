@@ -1,4 +1,7 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models.functions import Cast
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 
@@ -12,6 +15,12 @@ class Competition(models.Model):
     current_matchday = models.IntegerField()
     api_id = models.IntegerField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['api_id', 'caption'],
+                         name='competition_api_id_idx'),
+        ]
+
     def __str__(self):
         return self.caption
 
@@ -24,6 +33,12 @@ class Team(models.Model):
     short_name = models.CharField(max_length=64)
     competition = models.ForeignKey(Competition, null=True, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['competition', 'name'],
+                                    name='unique_team_in_competition'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -33,6 +48,21 @@ STATUS_TAB = ((1, "SCHEDULED"),
               (3, "PLAYING")
               )
 
+# Values of Bet.bet_result
+LOST = 0
+WON = 1
+PENDING = 2
+
+# Payouts (amount * course) are computed in db with this precision and
+# rounded to CENT when credited
+PAYOUT_FIELD = models.DecimalField(max_digits=14, decimal_places=4)
+CENT = Decimal('0.01')
+# Payout of Bet, for queries over bets
+PAYOUT = models.ExpressionWrapper(
+    models.F('bet_amount') * Cast('bet_course', PAYOUT_FIELD),
+    output_field=PAYOUT_FIELD
+)
+
 BET_CHOICES = ((1, 1),
                (2, 2),
                (0, 0)
@@ -56,14 +86,97 @@ class Fixture(models.Model):
     # New fields for enhanced functionality
     api_fixture_id = models.IntegerField(null=True, blank=True)
     minute = models.IntegerField(null=True, blank=True)
+    # Summary of match_events: event type to {"home": count, "away": count}
     events = models.JSONField(null=True, blank=True)
     odds_bookmakers = models.JSONField(null=True, blank=True)
     last_odds_update = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['competition', 'home_team', 'away_team', 'date'],
+                name='unique_fixture'
+            ),
+            models.UniqueConstraint(
+                fields=['competition', 'api_fixture_id'],
+                name='unique_fixture_api_id'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['competition', 'status', 'date'],
+                         name='fixture_competition_status_idx'),
+            models.Index(fields=['status', 'date'],
+                         name='fixture_status_date_idx'),
+        ]
+
     def __str__(self):
         return str(self.home_team.name + " - " + self.away_team.name)
 
 
+class MatchEvent(models.Model):
+    """
+    Single event of match (goal, card, substitution) from API timeline,
+    events are only appended - the same event polled again is ignored
+    thanks to unique_match_event
+    """
+    fixture = models.ForeignKey(Fixture, related_name='match_events',
+                                on_delete=models.CASCADE)
+    minute = models.IntegerField()
+    event_type = models.CharField(max_length=32)
+    detail = models.CharField(max_length=64, blank=True, default="")
+    player = models.CharField(max_length=100, blank=True, default="")
+    home = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['fixture', 'minute', 'event_type', 'player'],
+                name='unique_match_event'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['event_type', 'fixture'],
+                         name='match_event_type_idx'),
+        ]
+
+    def __str__(self):
+        return "{}' {} {}".format(self.minute, self.event_type, self.player)
+
+
+class LeagueTableRow(models.Model):
+    """
+    Team's row in competition's league table, updated incrementally as
+    fixtures finish
+    """
+    competition = models.ForeignKey(Competition, related_name='table_rows',
+                                    on_delete=models.CASCADE)
+    team = models.ForeignKey(Team, related_name='table_rows',
+                             on_delete=models.CASCADE)
+    played = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    draws = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+    goals_for = models.IntegerField(default=0)
+    goals_against = models.IntegerField(default=0)
+    goal_difference = models.IntegerField(default=0)
+    points = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['competition', 'team'],
+                                    name='unique_table_row'),
+        ]
+        indexes = [
+            models.Index(fields=['competition', '-points', '-goal_difference',
+                                 '-goals_for'],
+                         name='table_row_ranking_idx'),
+        ]
+
+    def __str__(self):
+        return "{} - {}".format(self.team, self.points)
+
+
 # ADD THE MISSING AppUser MODEL
 class AppUser(models.Model):
     cash = models.DecimalField(
@@ -79,9 +192,9 @@ class AppUser(models.Model):
 
 
 class Bet(models.Model):
-    BET_RESULTS = ((0, "LOST"),
-                   (1, "WON"),
-                   (2, "PENDING")
+    BET_RESULTS = ((LOST, "LOST"),
+                   (WON, "WON"),
+                   (PENDING, "PENDING")
                    )
     
     BET_TYPES = (
@@ -100,13 +213,52 @@ class Bet(models.Model):
         max_digits=6, 
         decimal_places=2
     )
-    fixture = models.ForeignKey(Fixture, related_name="fixture", on_delete=models.CASCADE)
+    # Covered by bet_fixture_result_idx, which starts with fixture
+    fixture = models.ForeignKey(Fixture, related_name="fixture",
+                                on_delete=models.CASCADE, db_index=False)
     bet = models.IntegerField(choices=BET_TYPES)
     bet_course = models.FloatField(default=0)
     bet_result = models.IntegerField(default=2, blank=True, choices=BET_RESULTS)
     bookmaker = models.CharField(max_length=50, default="Custom")
     bet_placed_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['fixture', 'bet_result'],
+                         name='bet_fixture_result_idx'),
+            models.Index(fields=['bet_user', 'bet_placed_at'],
+                         name='bet_user_placed_at_idx'),
+        ]
+
+
+class AccountSummary(models.Model):
+    """
+    Totals of AppUser's bets, updated incrementally when bets are placed and
+    settled so account page doesn't aggregate whole bet history
+    """
+    app_user = models.OneToOneField(AppUser, related_name='summary',
+                                    on_delete=models.CASCADE)
+    bets_count = models.IntegerField(default=0)
+    pending_count = models.IntegerField(default=0)
+    won_count = models.IntegerField(default=0)
+    lost_count = models.IntegerField(default=0)
+    total_staked = models.DecimalField(max_digits=14, decimal_places=2,
+                                       default=0)
+    total_returned = models.DecimalField(max_digits=14, decimal_places=2,
+                                         default=0)
+    # Amount staked on bets which aren't settled yet
+    pending_exposure = models.DecimalField(max_digits=14, decimal_places=2,
+                                           default=0)
+
+    @property
+    def win_rate(self):
+        """Fraction of settled bets which were won, None if none settled"""
+        settled = self.won_count + self.lost_count
+        return self.won_count / settled if settled else None
+
+    def __str__(self):
+        return "{} - {} bets".format(self.app_user, self.bets_count)
+
 
 class Bookmaker(models.Model):
     """Store different bookmakers"""
@@ -0,0 +1,92 @@
+from django.core.mail import get_connection, send_mass_mail
+
+from .metrics import shared_redis
+from .models import Bet
+
+
+SENDER = 'admin@newbet.com'
+
+
+class BetNotifier:
+    """
+    Buffers ids of placed bets in redis list "bet_confirmations" so
+    confirmations are sent in batches by periodic send_bet_confirmations
+    task instead of one celery message and one SMTP session per bet
+    """
+    KEY = "bet_confirmations"
+
+    def __init__(self, client):
+        self.client = client
+
+    def queue(self, bet_id):
+        self.client.rpush(self.KEY, bet_id)
+
+    def requeue(self, bet_ids):
+        if bet_ids:
+            self.client.rpush(self.KEY, *bet_ids)
+
+    def drain(self, limit):
+        """
+        Takes up to limit oldest queued bet ids off the list in one round trip
+        :return: list of ints
+        """
+        pipe = self.client.pipeline()
+        pipe.lrange(self.KEY, 0, limit - 1)
+        pipe.ltrim(self.KEY, limit, -1)
+        bet_ids, trimmed = pipe.execute()
+        return [int(bet_id) for bet_id in bet_ids]
+
+
+def bet_line(bet):
+    return "{} PLN on {} in fixture {}, your course is {}".format(
+        bet.bet_amount, bet.get_bet_display(), bet.fixture, bet.bet_course
+    )
+
+
+def confirmation_messages(bets, digest=False):
+    """
+    Builds confirmation emails of given bets
+    :param bets: iterable of Bet objects with bet_user__user and fixture's
+    teams loaded
+    :param digest: bool - if True, user's bets are rolled into one email
+    :return: list of (subject, message, sender, recipients) tuples
+    """
+    if not digest:
+        return [("Bet number {}".format(bet.id),
+                 "Hello {}! \n\nYou've made a bet in our betapp. Your bet "
+                 "was {}".format(bet.bet_user, bet_line(bet)),
+                 SENDER, [bet.bet_user.user.email])
+                for bet in bets]
+
+    users_bets = {}
+    for bet in bets:
+        users_bets.setdefault(bet.bet_user, []).append(bet)
+    return [("Your {} new bets".format(len(user_bets))
+             if len(user_bets) > 1 else "Bet number {}".format(user_bets[0].id),
+             "Hello {}! \n\nYou've made bets in our betapp:\n{}".format(
+                 app_user, "\n".join("- " + bet_line(bet)
+                                     for bet in user_bets)),
+             SENDER, [app_user.user.email])
+            for app_user, user_bets in users_bets.items()]
+
+
+def send_confirmations(bet_ids, digest=False, connection=None):
+    """
+    Loads given bets with related objects in one query and sends their
+    confirmations through one mail connection
+    :param bet_ids: list of ints
+    :param digest: bool - if True, one email per user
+    :param connection: mail connection, new one is opened if None
+    :return: int - number of sent emails
+    """
+    bets = Bet.objects.filter(id__in=bet_ids)\
+        .select_related('bet_user__user', 'fixture__home_team',
+                        'fixture__away_team').order_by('id')
+    messages = confirmation_messages(bets, digest)
+    if not messages:
+        return 0
+    return send_mass_mail(messages, fail_silently=False,
+                          connection=connection or get_connection())
+
+
+bet_notifier = BetNotifier(shared_redis())
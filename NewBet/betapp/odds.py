@@ -0,0 +1,43 @@
+from collections import defaultdict
+
+import numpy as np
+
+
+def price_fixtures(home_balances, away_balances):
+    """
+    Calculates result odds of many fixtures at once, same way as
+    update_db.calculate_result_odds does for single fixture
+    :param home_balances: array (n, 3) - wins, draws, losses of home teams
+    :param away_balances: array (n, 3) - wins, draws, losses of away teams
+    :return: array (n, 3) - home win, draw, away win odds
+    """
+    home_balances = np.asarray(home_balances, dtype=float).reshape(-1, 3)
+    away_balances = np.asarray(away_balances, dtype=float).reshape(-1, 3)
+
+    # Sum all games
+    sum_of_fixtures = home_balances.sum(axis=1) + away_balances.sum(axis=1)
+
+    # Calculate prices of particular outcomes
+    prices = np.column_stack([
+        home_balances[:, 0] + away_balances[:, 2],
+        home_balances[:, 1] + away_balances[:, 1],
+        home_balances[:, 2] + away_balances[:, 0],
+    ])
+
+    # If price is 0 then assume outcome is unlikely
+    prices[prices == 0] = 0.1
+
+    return np.round(1 / (prices / sum_of_fixtures[:, np.newaxis]), 2)
+
+
+def group_by_value(ids, values):
+    """
+    Groups ids by their values, used to write many rows with few CASE branches
+    :param ids: list of row ids
+    :param values: array of values in order of ids
+    :return: dict - value to list of ids
+    """
+    groups = defaultdict(list)
+    for row_id, value in zip(ids, values.tolist()):
+        groups[value].append(row_id)
+    return groups
@@ -0,0 +1,92 @@
+from datetime import timedelta
+import heapq
+
+from django.db.models import Case, When, Value, Q, F, DateTimeField
+
+
+# (time to kickoff up to, refresh interval) - odds of fixtures close to
+# kickoff are refreshed often, of far ones rarely
+ODDS_REFRESH_INTERVALS = (
+    (timedelta(hours=1), timedelta(minutes=5)),
+    (timedelta(days=1), timedelta(hours=1)),
+    (timedelta(days=7), timedelta(hours=12)),
+)
+FAR_ODDS_REFRESH_INTERVAL = timedelta(days=7)
+
+
+def refresh_interval(time_to_kickoff):
+    """
+    :param time_to_kickoff: timedelta
+    :return: timedelta - how often odds of fixture should be refreshed
+    """
+    for up_to, interval in ODDS_REFRESH_INTERVALS:
+        if time_to_kickoff <= up_to:
+            return interval
+    return FAR_ODDS_REFRESH_INTERVAL
+
+
+def next_refresh(kickoff, last_odds_update, now):
+    """
+    :param kickoff: datetime
+    :param last_odds_update: datetime or None if odds were never refreshed
+    :param now: datetime
+    :return: datetime - when odds of fixture should be refreshed next
+    """
+    if last_odds_update is None:
+        return now
+    return last_odds_update + refresh_interval(kickoff - now)
+
+
+def due_fixtures(fixtures, now, budget):
+    """
+    Picks fixtures whose odds are due, most overdue first, earlier kickoff
+    breaking ties
+    :param fixtures: iterable of (id, kickoff, last_odds_update) tuples
+    :param now: datetime
+    :param budget: int - max number of picked fixtures
+    :return: tuple (list of picked fixture ids,
+                    int - number of all due fixtures,
+                    datetime - next refresh of fixture left in queue or None)
+    """
+    queue = [(next_refresh(kickoff, last_odds_update, now), kickoff,
+              fixture_id)
+             for fixture_id, kickoff, last_odds_update in fixtures]
+    heapq.heapify(queue)
+    due = sum(1 for refresh_at, kickoff, fixture_id in queue
+              if refresh_at <= now)
+
+    picked = []
+    while queue and queue[0][0] <= now and len(picked) < budget:
+        picked.append(heapq.heappop(queue)[2])
+    return picked, due, queue[0][0] if queue else None
+
+
+def odds_due_filter(now):
+    """
+    :return: Q - fixtures whose odds are due at now, same condition as
+    next_refresh(...) <= now but on plain columns, so it can use indexes
+    """
+    due = Q(last_odds_update__isnull=True)
+    lower = None
+    for up_to, interval in ODDS_REFRESH_INTERVALS:
+        band = Q(date__lte=now + up_to)
+        if lower is not None:
+            band &= Q(date__gt=now + lower)
+        due |= band & Q(last_odds_update__lte=now - interval)
+        lower = up_to
+    return due | Q(date__gt=now + lower,
+                   last_odds_update__lte=now - FAR_ODDS_REFRESH_INTERVAL)
+
+
+def refresh_at_expression(now):
+    """
+    :return: expression computing next_refresh of fixture in db
+    """
+    return Case(
+        When(last_odds_update__isnull=True, then=Value(now)),
+        *[When(date__lte=now + up_to,
+               then=F('last_odds_update') + Value(interval))
+          for up_to, interval in ODDS_REFRESH_INTERVALS],
+        default=F('last_odds_update') + Value(FAR_ODDS_REFRESH_INTERVAL),
+        output_field=DateTimeField()
+    )
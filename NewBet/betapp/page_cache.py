@@ -0,0 +1,63 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+COMPETITIONS_VERSION_KEY = "competitions:version"
+
+
+def fixtures_version_key(competition_id):
+    return "fixtures:version:{}".format(competition_id)
+
+
+def get_version(key):
+    """
+    Returns current version of cached pages, rendered fragments are cached
+    under it so bumping version invalidates them
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def initial_version():
+    # Evicted version restarts from current time, so it can't match any
+    # version fragments were cached under before
+    return int(time.time() * 1000)
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, initial_version(), timeout=None)
+
+
+def get_fixtures_version(competition_id):
+    return get_version(fixtures_version_key(competition_id))
+
+
+def get_competitions_version():
+    return get_version(COMPETITIONS_VERSION_KEY)
+
+
+def invalidate_fixtures(*competition_ids):
+    """
+    Invalidates cached fixtures pages of given competitions once current
+    transaction commits. Has to be called after every fixture change made
+    without save(), saves are handled by signals
+    """
+    def bump():
+        for competition_id in set(competition_ids):
+            bump_version(fixtures_version_key(competition_id))
+    transaction.on_commit(bump)
+
+
+def invalidate_competitions():
+    """
+    Invalidates cached competitions list once current transaction commits
+    """
+    transaction.on_commit(lambda: bump_version(COMPETITIONS_VERSION_KEY))
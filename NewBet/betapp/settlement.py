@@ -0,0 +1,138 @@
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, When, Value, Q, F, Sum, Count
+
+from .models import AppUser, Bet, Fixture, LOST, WON, PENDING, PAYOUT, \
+    CENT
+from .accounts import record_settled_bets
+from .leaderboard import leaderboard
+
+
+CREDIT_BATCH_SIZE = 100
+
+
+def winning_bet_types(goals_home_team, goals_away_team):
+    """
+    Returns set of bet types (see Bet.BET_TYPES) won for given final score.
+    Double Chance (6) is graded as "1X" - home win or draw
+    :param goals_home_team: int
+    :param goals_away_team: int
+    :return: set of ints
+    """
+    won = set()
+    if goals_home_team > goals_away_team:
+        won.add(1)
+    elif goals_home_team == goals_away_team:
+        won.add(0)
+    else:
+        won.add(2)
+
+    if goals_home_team + goals_away_team > 2:
+        won.add(3)
+    else:
+        won.add(4)
+
+    if goals_home_team > 0 and goals_away_team > 0:
+        won.add(5)
+    if goals_home_team >= goals_away_team:
+        won.add(6)
+    return won
+
+
+def winning_bets_condition(fixtures):
+    """
+    Builds Q object matching winning bets of all given fixtures
+    :param fixtures: iterable of finished Fixture objects
+    :return: Q object
+    """
+    return reduce(or_, (Q(fixture_id=fixture.id,
+                          bet__in=winning_bet_types(fixture.goals_home_team,
+                                                    fixture.goals_away_team))
+                        for fixture in fixtures))
+
+
+def credit_users(user_payouts):
+    """
+    Adds payouts to AppUsers' cash with CASE updates of CREDIT_BATCH_SIZE
+    users each
+    :param user_payouts: list of (app_user_id, Decimal amount) tuples
+    """
+    for start in range(0, len(user_payouts), CREDIT_BATCH_SIZE):
+        batch = user_payouts[start:start + CREDIT_BATCH_SIZE]
+        AppUser.objects.filter(id__in=[user_id for user_id, total in batch])\
+            .update(cash=Case(*[When(id=user_id,
+                                     then=F('cash') + Value(total.quantize(CENT)))
+                                for user_id, total in batch],
+                              output_field=AppUser._meta.get_field('cash')))
+
+
+def settle_fixtures(fixtures):
+    """
+    Grades all pending bets of given finished fixtures and credits winners.
+    Number of statements doesn't depend on number of bets, only on number
+    of their AppUsers: one CASE update grading bets, one aggregate of
+    payouts per AppUser, then CASE updates crediting winners (one per
+    CREDIT_BATCH_SIZE users) and updating account summaries (two per
+    SUMMARY_BATCH_SIZE users), all in single transaction. Payouts are added
+    to leaderboard once it commits.
+    :param fixtures: iterable of Fixture objects with final score set
+    :return: int - number of settled bets
+    """
+    fixtures = [fixture for fixture in fixtures
+                if fixture.goals_home_team is not None
+                and fixture.goals_away_team is not None]
+    if not fixtures:
+        return 0
+
+    fixture_ids = [fixture.id for fixture in fixtures]
+    won_condition = winning_bets_condition(fixtures)
+
+    with transaction.atomic():
+        # Lock fixtures so concurrent runs settle each fixture only once
+        list(Fixture.objects.select_for_update()
+             .filter(id__in=fixture_ids).values_list('id', flat=True))
+
+        pending = Bet.objects.filter(fixture_id__in=fixture_ids,
+                                     bet_result=PENDING)
+        competition_ids = {fixture.id: fixture.competition_id
+                           for fixture in fixtures}
+        # Totals of every user in every settled fixture, summed per user
+        # for cash and account summaries and per competition for leaderboard
+        user_totals = {}
+        profits = []
+        for app_user_id, fixture_id, won_count, settled_count, staked, \
+                returned in pending.order_by()\
+                .values('bet_user', 'fixture').annotate(
+                    won_count=Count('id', filter=won_condition),
+                    settled_count=Count('id'),
+                    staked=Sum('bet_amount'),
+                    returned=Sum(PAYOUT, filter=won_condition))\
+                .values_list('bet_user', 'fixture', 'won_count',
+                             'settled_count', 'staked', 'returned'):
+            returned = returned or Decimal(0)
+            totals = user_totals.setdefault(app_user_id,
+                                            [0, 0, Decimal(0), Decimal(0)])
+            totals[0] += won_count
+            totals[1] += settled_count - won_count
+            totals[2] += staked
+            totals[3] += returned
+            if won_count:
+                profits.append((app_user_id, competition_ids[fixture_id],
+                                returned))
+
+        settled = [(app_user_id, won_count, lost_count, staked,
+                    returned.quantize(CENT))
+                   for app_user_id, (won_count, lost_count, staked, returned)
+                   in user_totals.items()]
+        credit_users([(app_user_id, returned)
+                      for app_user_id, won_count, lost_count, staked,
+                      returned in settled if won_count])
+        record_settled_bets(settled)
+        leaderboard.record(profits)
+
+        return pending.update(bet_result=Case(When(won_condition,
+                                                   then=Value(WON)),
+                                              default=Value(LOST)))
@@ -0,0 +1,70 @@
+from contextlib import ExitStack
+from time import perf_counter
+
+from celery.signals import task_prerun, task_postrun
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Competition, Team, Fixture
+from .page_cache import invalidate_fixtures, invalidate_competitions
+from .tasks import schedule_kickoff
+from .metrics import metrics
+
+
+# Start time and metrics batch of celery tasks running in this process,
+# by task id
+task_starts = {}
+
+
+@receiver(post_save, sender=Fixture)
+def fixture_saved(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Queues kickoff task for new scheduled fixtures and ones saved with their
+    date - writers not changing kickoff save with update_fields without
+    date. Extra tasks of unchanged kickoff are harmless, kick_off_fixture
+    starts fixture only once.
+    """
+    if instance.status != 1:
+        return
+    if created or update_fields is None or 'date' in update_fields:
+        schedule_kickoff(instance)
+
+
+@receiver(post_save, sender=Fixture)
+@receiver(post_delete, sender=Fixture)
+def fixture_changed(sender, instance, **kwargs):
+    invalidate_fixtures(instance.competition_id)
+
+
+@receiver(post_save, sender=Team)
+def team_changed(sender, instance, **kwargs):
+    if instance.competition_id is not None:
+        invalidate_fixtures(instance.competition_id)
+
+
+@receiver(post_save, sender=Competition)
+@receiver(post_delete, sender=Competition)
+def competition_changed(sender, instance, **kwargs):
+    invalidate_competitions()
+    invalidate_fixtures(instance.id)
+
+
+@task_prerun.connect
+def task_started(task_id, **kwargs):
+    # All metrics of task (API requests, its duration) are sent in one
+    # round trip when it finishes
+    batch = ExitStack()
+    batch.enter_context(metrics.batch())
+    task_starts[task_id] = perf_counter(), batch
+
+
+@task_postrun.connect
+def task_finished(task_id, task, state=None, **kwargs):
+    started = task_starts.pop(task_id, None)
+    if started is None:
+        return
+    start, batch = started
+    with batch:
+        metrics.observe("betapp_task_duration_seconds",
+                        {"task": task.name, "state": state or "UNKNOWN"},
+                        perf_counter() - start)
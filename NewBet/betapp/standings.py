@@ -0,0 +1,130 @@
+import time
+
+from .metrics import shared_redis
+
+
+class StandingsStore:
+    """
+    Stores history of team standings, one redis hash per competition:
+    "{competition_id}:standings" with matchday fields holding packed
+    "team_id:position,..." lists ordered by position, and "updated" field
+    with time of last change. Whole history is read with one HGETALL.
+    """
+    UPDATED_FIELD = "updated"
+
+    # Sets matchday's positions and time of change in one round trip,
+    # unless they are already stored
+    WRITE_SCRIPT = """
+    local current = redis.call('HGET', KEYS[1], ARGV[1])
+    if current == ARGV[2] or (current and ARGV[4] == '0') then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2], 'updated', ARGV[3])
+    return 1
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.write_script = client.register_script(self.WRITE_SCRIPT)
+
+    @staticmethod
+    def key(competition_id):
+        return "{}:standings".format(competition_id)
+
+    @staticmethod
+    def pack(positions):
+        """
+        :param positions: dict - team id to position
+        :return: string "team_id:position,..." ordered by position
+        """
+        return ",".join("{}:{}".format(team_id, position)
+                        for team_id, position
+                        in sorted(positions.items(), key=lambda item: item[1]))
+
+    @staticmethod
+    def unpack(packed):
+        """
+        :return: dict - team id to position
+        """
+        positions = {}
+        for item in packed.split(","):
+            if item:
+                team_id, position = item.split(":")
+                positions[int(team_id)] = int(position)
+        return positions
+
+    def write_matchday(self, competition_id, matchday, positions,
+                       overwrite=True):
+        """
+        Saves positions of all competition's teams after given matchday
+        :param positions: dict - team id to position
+        :param overwrite: bool - if False, already stored matchday is kept
+        :return: True if stored standings changed, else False
+        """
+        return bool(self.write_script(keys=[self.key(competition_id)],
+                                      args=[matchday, self.pack(positions),
+                                            time.time(), int(overwrite)]))
+
+    def read_history(self, competition_id):
+        """
+        :return: tuple (dict - matchday to dict of team id to position,
+                        float - time of last change or None)
+        """
+        data = self.client.hgetall(self.key(competition_id))
+        updated = data.pop(self.UPDATED_FIELD, None)
+        history = {int(matchday): self.unpack(packed)
+                   for matchday, packed in data.items()}
+        return history, float(updated) if updated is not None else None
+
+    def last_modified(self, competition_id):
+        """
+        :return: float - time of last change of competition's standings or
+        None if there are no standings
+        """
+        updated = self.client.hget(self.key(competition_id),
+                                   self.UPDATED_FIELD)
+        return float(updated) if updated is not None else None
+
+    def team_history(self, competition_id, team_id):
+        """
+        :return: tuple (list of matchdays, list of team's positions)
+        """
+        history, updated = self.read_history(competition_id)
+        matchday_list = [matchday for matchday in sorted(history)
+                         if team_id in history[matchday]]
+        standing_list = [history[matchday][team_id]
+                         for matchday in matchday_list]
+        return matchday_list, standing_list
+
+    def migrate_team_keys(self, delete=True):
+        """
+        Converts old per team "{competition}:{team}:standing" hashes to
+        per competition ones
+        :param delete: bool - if True, old keys are removed
+        :return: int - number of converted team keys
+        """
+        old_keys = [key for key in self.client.scan_iter("*:*:standing")
+                    if key.count(":") == 2]
+        pipe = self.client.pipeline(transaction=False)
+        for key in old_keys:
+            pipe.hgetall(key)
+        team_hashes = pipe.execute() if old_keys else []
+
+        competitions = {}
+        for key, standings in zip(old_keys, team_hashes):
+            competition_id, team_id, suffix = key.split(":")
+            matchdays = competitions.setdefault(int(competition_id), {})
+            for matchday, position in standings.items():
+                matchdays.setdefault(int(matchday), {})[int(team_id)] = \
+                    int(position)
+
+        for competition_id, matchdays in competitions.items():
+            for matchday, positions in matchdays.items():
+                self.write_matchday(competition_id, matchday, positions,
+                                    overwrite=False)
+        if delete and old_keys:
+            self.client.delete(*old_keys)
+        return len(old_keys)
+
+
+standings_store = StandingsStore(shared_redis())
@@ -0,0 +1,178 @@
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+import itertools
+
+from django.utils import timezone
+
+from .accounts import rebuild_account_summaries
+from .models import AppUser, User, Competition, Team, Fixture, Bet
+from .update_db import table_row_changes
+
+
+# Rows written per INSERT, rows of one batch are all that is kept in memory
+SEED_BATCH_SIZE = 2000
+
+BET_TYPES = [bet_type for bet_type, label in Bet.BET_TYPES]
+
+
+def batches(items, size=SEED_BATCH_SIZE):
+    """
+    Splits iterable into lists of at most size items, lazily
+    """
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def round_robin(teams):
+    """
+    Schedules double round robin with circle method - every team plays once
+    per matchday (or rests when number of teams is odd), second half of
+    season has home and away teams swapped
+    :return: list of (matchday, home team, away team) tuples
+    """
+    slots = list(teams) + ([None] if len(teams) % 2 else [])
+    rounds = len(slots) - 1
+    schedule = []
+    for round in range(rounds):
+        for i in range(len(slots) // 2):
+            home_team, away_team = slots[i], slots[-1 - i]
+            if home_team is None or away_team is None:
+                continue
+            if round % 2:
+                home_team, away_team = away_team, home_team
+            schedule.append((round + 1, home_team, away_team))
+            schedule.append((round + 1 + rounds, away_team, home_team))
+        slots = [slots[0], slots[-1]] + slots[1:-1]
+    return sorted(schedule, key=lambda fixture: fixture[0])
+
+
+def seed_competition(rng, teams_count, api_id=0, caption="Synthetic",
+                     finished_matchdays=0):
+    """
+    Creates competition with teams playing each other home and away on
+    weekly matchdays. Fixtures of first finished_matchdays matchdays are
+    finished with random scores, the rest is scheduled with random odds.
+    :param rng: random.Random
+    :return: tuple (Competition, list of Team objects)
+    """
+    competition = Competition.objects.create(
+        caption=caption, league=caption[:12], year=2024, api_id=api_id,
+        number_of_teams=teams_count,
+        number_of_matchdays=2 * (teams_count - 1 + teams_count % 2),
+        current_matchday=finished_matchdays + 1
+    )
+    teams = Team.objects.bulk_create(
+        [Team(name="{} Team {}".format(caption, i),
+              short_name="T{}".format(i), code="T{}".format(i),
+              competition=competition)
+         for i in range(teams_count)], batch_size=SEED_BATCH_SIZE
+    )
+
+    # Finished matchdays are in the past, the first scheduled one tomorrow
+    start = timezone.now() - timedelta(weeks=finished_matchdays, days=-1)
+
+    def fixtures():
+        for i, (matchday, home_team, away_team) in enumerate(
+                round_robin(teams)):
+            fixture = Fixture(home_team=home_team, away_team=away_team,
+                              competition=competition, matchday=matchday,
+                              date=start + timedelta(weeks=matchday - 1,
+                                                     minutes=i))
+            if matchday <= finished_matchdays:
+                fixture.status = 2
+                fixture.goals_home_team = rng.randint(0, 4)
+                fixture.goals_away_team = rng.randint(0, 3)
+            else:
+                fixture.status = 1
+                fixture.course_team_home_win = round(rng.uniform(1.2, 4), 2)
+                fixture.course_draw = round(rng.uniform(2.5, 4.5), 2)
+                fixture.course_team_away_win = round(rng.uniform(1.2, 6), 2)
+            yield fixture
+
+    for batch in batches(fixtures()):
+        Fixture.objects.bulk_create(batch)
+    return competition, teams
+
+
+def seed_app_users(count, prefix="synthetic", cash=100):
+    """
+    Creates count Users with AppUsers, passwords are unusable
+    :return: list of AppUser ids
+    """
+    app_user_ids = []
+    names = ("{}_{}".format(prefix, i) for i in range(count))
+    for batch in batches(names):
+        users = User.objects.bulk_create(
+            [User(username=name, email="{}@newbet.com".format(name),
+                  password="!") for name in batch]
+        )
+        app_users = AppUser.objects.bulk_create(
+            [AppUser(user=user, cash=cash, bank_account_number=111)
+             for user in users]
+        )
+        app_user_ids.extend(app_user.id for app_user in app_users)
+    return app_user_ids
+
+
+def seed_bets(rng, fixture_ids, app_user_ids, count, summaries=True):
+    """
+    Creates count pending bets on random fixtures by random users, batch by
+    batch, and computes account summaries of the users
+    :param rng: random.Random
+    :param summaries: bool - False leaves summaries to caller, e.g. to
+    compute them once after seeding bets in several calls
+    :return: int - number of created bets
+    """
+    def bets():
+        for i in range(count):
+            yield Bet(bet_user_id=rng.choice(app_user_ids),
+                      fixture_id=rng.choice(fixture_ids),
+                      bet_amount=Decimal(rng.randint(1, 500)) / 100,
+                      bet=rng.choice(BET_TYPES),
+                      bet_course=round(rng.uniform(1.1, 5), 2))
+
+    created = 0
+    for batch in batches(bets()):
+        Bet.objects.bulk_create(batch)
+        created += len(batch)
+    if summaries:
+        rebuild_account_summaries(app_user_ids)
+    return created
+
+
+def standings_history(competition):
+    """
+    Computes positions of competition's teams after every finished
+    matchday from its finished fixtures, ranked like league table
+    :return: dict - matchday to dict of team id to position
+    """
+    totals = {team_id: Counter() for team_id in
+              Team.objects.filter(competition=competition)
+              .values_list('id', flat=True)}
+    fixtures = Fixture.objects.filter(competition=competition, status=2)\
+        .order_by('matchday')\
+        .values_list('matchday', 'home_team_id', 'away_team_id',
+                     'goals_home_team', 'goals_away_team')
+
+    def positions():
+        ranking = sorted(totals, key=lambda team_id: (
+            -totals[team_id]['points'], -totals[team_id]['goal_difference'],
+            -totals[team_id]['goals_for'], team_id))
+        return {team_id: i + 1 for i, team_id in enumerate(ranking)}
+
+    history = {}
+    for matchday, matchday_fixtures in itertools.groupby(
+            fixtures, key=lambda fixture: fixture[0]):
+        for matchday, home_team_id, away_team_id, goals_home_team, \
+                goals_away_team in matchday_fixtures:
+            totals[home_team_id].update(table_row_changes(goals_home_team,
+                                                          goals_away_team))
+            totals[away_team_id].update(table_row_changes(goals_away_team,
+                                                          goals_home_team))
+        history[matchday] = positions()
+    return history
@@ -1,55 +1,322 @@
 # betapp/tasks.py - Updated to use sports_api
-from celery import shared_task
+from concurrent.futures import ThreadPoolExecutor
+import json
+from time import perf_counter
+
+from celery import shared_task, group
 from celery.schedules import crontab
 
-from django.core.mail import send_mail
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
 from django.utils import timezone
 
 from .models import *
-from .update_db import update_fixtures, create_team_standing
+from .update_db import update_fixtures, create_team_standing, \
+    update_live_fixtures, refresh_due_odds, append_match_events
+from .page_cache import invalidate_fixtures
+from .live_stream import live_scores
+from .notifications import bet_notifier, send_confirmations
+from .locks import lease_lock, LeaseLock
 from .api_connection import sports_api  # Changed from football_apis to sports_api
+from .metrics import metrics
+
+
+# Redis hash with last refresh run of every competition
+REFRESH_RUNS_KEY = "refresh_competition:runs"
 
 
 @shared_task
 def bet_created(bet_id):
     """
-    Sends email with confirmation of creating new bet
+    Sends email with confirmation of creating new bet. New bets are queued
+    with bet_notifier instead, kept for messages queued before
     :param bet_id: int
     :return: True if mail sending was successfull, else False
     """
-    bet = Bet.objects.get(id=bet_id)
-    bet_owner = bet.bet_user
-    user = User.objects.get(id=bet_owner.id)
+    return bool(send_confirmations([bet_id]))
+
+
+@shared_task
+def send_bet_confirmations():
+    """
+    Sends confirmations of bets queued with bet_notifier since last run,
+    BET_CONFIRMATION_BATCH_SIZE bets per query, all through one mail
+    connection. Ids of batch that failed to send are queued again.
+    :return: int - number of sent emails
+    """
+    sent = 0
+    with get_connection() as connection:
+        while True:
+            bet_ids = bet_notifier.drain(settings.BET_CONFIRMATION_BATCH_SIZE)
+            if not bet_ids:
+                return sent
+            try:
+                sent += send_confirmations(
+                    bet_ids, digest=settings.BET_CONFIRMATION_DIGEST,
+                    connection=connection
+                )
+            except Exception:
+                bet_notifier.requeue(bet_ids)
+                raise
+
+
+@shared_task
+def kick_off_fixture(fixture_id):
+    """
+    Marks fixture as playing, queued by schedule_kickoff with its kickoff as
+    ETA. Fixtures rescheduled to later date are left untouched, their new
+    kickoff has its own task queued.
+    :param fixture_id: int
+    :return: True if fixture status was changed, else False
+    """
+    return bool(start_fixtures(Fixture.objects.filter(
+        id=fixture_id, status=1, date__lte=timezone.now()
+    )))
+
+
+def schedule_kickoff(fixture):
+    """
+    Queues kick_off_fixture task to run at fixture's kickoff, once current
+    transaction commits
+    :param fixture: Fixture object
+    """
+    kickoff = Fixture._meta.get_field('date').to_python(fixture.date)
+    if timezone.is_naive(kickoff):
+        kickoff = timezone.make_aware(kickoff)
 
-    subject = "Bet number {}".format(bet.id)
-    message = """Hello {}! \n\nYo've made a bet in our betapp. Your bet was
-     {} PLN on {} in fixture {}, your course is {}""".format(bet_owner,
-                                                             bet.bet_amount,
-                                                             bet.bet,
-                                                             bet.fixture,
-                                                             bet.bet_course)
-    mail_sent = send_mail(subject, message, 'admin@newbet.com',
-                          [user.email])
-    return mail_sent
+    def queue():
+        try:
+            kick_off_fixture.apply_async((fixture.id,), eta=kickoff)
+        except Exception as e:
+            # change_status safety net will start the fixture instead
+            print(f"Scheduling kickoff of fixture {fixture.id} failed: {e}")
+
+    transaction.on_commit(queue)
 
 
 def change_status():
-    now = timezone.now()
-    fixtures = Fixture.objects.filter(status=1)
+    """
+    Safety net for kickoffs whose tasks were lost, starts all overdue
+    scheduled fixtures with single update
+    :return: int - number of started fixtures
+    """
+    return start_fixtures(Fixture.objects.filter(status=1,
+                                                 date__lte=timezone.now()))
+
+
+def start_fixtures(fixtures):
+    """
+    Marks given fixtures as playing and publishes their kickoff to live
+    score streams
+    :param fixtures: Fixture queryset
+    :return: int - number of started fixtures
+    """
+    fixtures = list(fixtures.only('id', 'competition_id', 'goals_home_team',
+                                  'goals_away_team', 'minute'))
+    if not fixtures:
+        return 0
+    started = Fixture.objects.filter(
+        id__in=[fixture.id for fixture in fixtures], status=1
+    ).update(status=3)
+    invalidate_fixtures(*{fixture.competition_id for fixture in fixtures})
     for fixture in fixtures:
-        if fixture.date < now:
-            fixture.status = 3
-            fixture.save()
+        fixture.status = 3
+        live_scores.publish(fixture)
+    return started
 
 
-def update_fixtures_foo():
-    competitons = Competition.objects.all()
-    for competition in competitons:
-        update_fixtures(api_id=competition.api_id)
+def fetch_competition(competition):
+    """
+    Fetches competition's events from API
+    :return: tuple (competition, events data, seconds spent)
+    """
+    start = perf_counter()
+    events_data = sports_api.get_events_by_league(competition.api_id)
+    return competition, events_data, perf_counter() - start
+
+
+def refresh_lock_name(competition_id):
+    return "refresh_competition:{}".format(competition_id)
+
+
+def write_competition(competition, events_data, fetch_time):
+    """
+    Writes fetched events of competition to db while holding its lease lock,
+    competition being written by other run is skipped so the same fixtures
+    are never written by two runs at once.
+    Finished run is recorded in redis hash "refresh_competition:runs".
+    :return: dict with fetch/write seconds and number of touched fixtures,
+    or {"skipped": True} if competition was locked
+    """
+    with lease_lock.hold(refresh_lock_name(competition.id),
+                         settings.COMPETITION_REFRESH_LEASE) as acquired:
+        if not acquired:
+            print(f"Competition {competition.id} is being refreshed, skipped")
+            return {"skipped": True}
+        start = perf_counter()
+        touched = update_fixtures(competition, events_data=events_data)
         create_team_standing(competition_id=competition.id)
+        run = {"fetch": round(fetch_time, 3),
+               "write": round(perf_counter() - start, 3),
+               "fixtures": touched}
+        lease_lock.client.hset(REFRESH_RUNS_KEY, competition.id,
+                               json.dumps(dict(
+                                   run, finished_at=timezone.now().isoformat()
+                               )))
+        return run
+
+
+@shared_task
+def refresh_competition(competition_id):
+    """
+    Refreshes fixtures and standings of one competition, queued for
+    every competition by check_fixtures
+    :param competition_id: int
+    :return: dict - see write_competition
+    """
+    competition = Competition.objects.filter(id=competition_id).first()
+    if competition is None:
+        return {"skipped": True}
+    # Don't call API when other run holds the competition
+    if lease_lock.client.exists(LeaseLock.key(
+            refresh_lock_name(competition_id))):
+        return {"skipped": True}
+    return write_competition(*fetch_competition(competition))
+
+
+def update_fixtures_foo(concurrency=None):
+    """
+    Refreshes all competitions - API data of all of them is fetched in
+    parallel first, then written to db one by one
+    :param concurrency: int - max number of parallel API requests
+    :return: dict with run of every competition id, see write_competition
+    """
+    concurrency = concurrency or settings.FIXTURES_REFRESH_CONCURRENCY
+    competitions = list(Competition.objects.all())
+    if not competitions:
+        return {}
+
+    with metrics.change(), \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        fetched = list(executor.map(metrics.carry(fetch_competition),
+                                    competitions))
+
+    return {competition.id: write_competition(competition, events_data,
+                                              fetch_time)
+            for competition, events_data, fetch_time in fetched}
 
 
 @shared_task
 def check_fixtures():
+    """
+    Starts overdue fixtures and queues refresh of every competition as
+    separate task, so competitions are refreshed in parallel by workers
+    :return: list of ids of competitions queued for refresh
+    """
     change_status()
-    update_fixtures_foo()
\ No newline at end of file
+    competition_ids = list(Competition.objects.values_list('id', flat=True))
+    group(refresh_competition.s(competition_id)
+          for competition_id in competition_ids).apply_async()
+    return competition_ids
+
+
+@shared_task
+def refresh_odds():
+    """
+    Refreshes odds of fixtures which are due, within ODDS_REFRESH_BUDGET
+    :return: dict - see refresh_due_odds
+    """
+    return refresh_due_odds()
+
+
+def fetch_live_events(fixtures, concurrency=None):
+    """
+    Fetches current state of live fixtures - one livescore request per
+    league covers all its matches, fixtures missing there are looked up
+    one by one. All requests run in parallel.
+    :param fixtures: list of Fixture objects with teams and competition loaded
+    :return: dict - fixture id to API event
+    """
+    concurrency = concurrency or settings.FIXTURES_REFRESH_CONCURRENCY
+    league_ids = {fixture.competition.api_id for fixture in fixtures}
+    with metrics.change(), \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        by_id = {}
+        by_teams = {}
+        for data in executor.map(metrics.carry(sports_api.get_live_scores),
+                                 league_ids):
+            for event in (data or {}).get('events') or []:
+                by_id[str(event.get('idEvent'))] = event
+                by_teams[(event.get('strHomeTeam'),
+                          event.get('strAwayTeam'))] = event
+
+        events = {}
+        missing = []
+        for fixture in fixtures:
+            event = by_id.get(str(fixture.api_fixture_id)) \
+                or by_teams.get((fixture.home_team.name,
+                                 fixture.away_team.name))
+            if event is not None:
+                events[fixture.id] = event
+            elif fixture.api_fixture_id:
+                missing.append(fixture)
+
+        looked_up = executor.map(metrics.carry(
+            lambda fixture: sports_api.get_event(fixture.api_fixture_id)
+        ), missing)
+        for fixture, data in zip(missing, looked_up):
+            found = (data or {}).get('events') or []
+            if found:
+                events[fixture.id] = found[0]
+    return events
+
+
+def live_state(fixture):
+    return (fixture.status, fixture.goals_home_team, fixture.goals_away_team,
+            fixture.minute)
+
+
+def fetch_timelines(fixtures, concurrency=None):
+    """
+    Fetches timelines (goals, cards, substitutions) of fixtures in parallel
+    :param fixtures: list of Fixture objects
+    :return: dict - fixture id to list of timeline items
+    """
+    concurrency = concurrency or settings.FIXTURES_REFRESH_CONCURRENCY
+    fixtures = [fixture for fixture in fixtures if fixture.api_fixture_id]
+    with metrics.change(), \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = executor.map(metrics.carry(
+            lambda fixture: sports_api.get_event_timeline(
+                fixture.api_fixture_id
+            )
+        ), fixtures)
+        return {fixture.id: (data or {}).get('timeline') or []
+                for fixture, data in zip(fixtures, responses)}
+
+
+@shared_task
+def poll_live_fixtures(concurrency=None):
+    """
+    Polls API for state of all live fixtures and saves what has changed,
+    new events of matches are appended to MatchEvent - timelines are only
+    fetched for fixtures whose score, minute or status changed in this poll
+    :param concurrency: int - max number of parallel API requests
+    :return: dict with numbers of polled, changed and finished fixtures and
+    of new events
+    """
+    fixtures = list(Fixture.objects.filter(status=3)
+                    .select_related('home_team', 'away_team', 'competition'))
+    if not fixtures:
+        return {"polled": 0, "changed": 0, "finished": 0, "new_events": 0}
+    polled_states = {fixture.id: live_state(fixture) for fixture in fixtures}
+    changed, finished = update_live_fixtures(
+        fixtures, fetch_live_events(fixtures, concurrency)
+    )
+    moved = [fixture for fixture in fixtures
+             if live_state(fixture) != polled_states[fixture.id]]
+    new_events = append_match_events(fetch_timelines(moved, concurrency)) \
+        if moved else 0
+    return {"polled": len(fixtures), "changed": changed, "finished": finished,
+            "new_events": new_events}
@@ -1,3 +1,2133 @@
-from django.test import TestCase
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+import fnmatch
+import io
+import itertools
+import json
+import queue
+import os
+import re
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core import mail
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .api_connection import TheSportsDB, LocalCache
+from .cassettes import Cassette, RecordingSession, ReplaySession
+from .models import AppUser, User, Competition, Team, Fixture, Bet, \
+    MatchEvent, LeagueTableRow, AccountSummary
+from .betting import place_bet, BetRejected
+from .forms import BetForm
+from .accounts import bets_page, rebuild_account_summaries
+from .leaderboard import Leaderboard, profits_from_bets
+from .views import get_top_bettors
+from .settlement import winning_bet_types, settle_fixtures
+from .odds import price_fixtures
+from .odds_schedule import refresh_interval, due_fixtures, odds_due_filter
+from .standings import StandingsStore
+from .notifications import BetNotifier
+from .locks import LeaseLock
+from .live_stream import LiveBroadcaster
+from .metrics import MetricsRegistry, InstrumentedRedis
+from .update_db import create_competition as import_competition, \
+    calculate_result_odds, update_fixture, \
+    rebuild_league_table, create_league_table_rows, update_live_fixtures, \
+    parse_minute, refresh_due_odds, append_match_events
+from .tasks import kick_off_fixture, change_status, update_fixtures_foo, \
+    send_bet_confirmations, refresh_competition, refresh_lock_name, \
+    check_fixtures, REFRESH_RUNS_KEY, poll_live_fixtures
+
+
+# Every test case runs with local memory cache and without collecting
+# metrics, so tests don't need redis - cases testing metrics enable them
+TEST_SETTINGS = override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    },
+    METRICS_ENABLED=False,
+)
+
+
+def create_competition(caption="Test League", api_id=1):
+    return Competition.objects.create(caption=caption, league=caption[:12],
+                                      number_of_matchdays=38, year=2024,
+                                      number_of_teams=20, current_matchday=1,
+                                      api_id=api_id)
+
+
+def create_teams(competition, count=2):
+    return [Team.objects.create(name="Team {}".format(i),
+                                short_name="T{}".format(i),
+                                competition=competition)
+            for i in range(count)]
+
+
+def create_app_user(username, cash=100):
+    user = User.objects.create_user(username=username, password="secret",
+                                    email="{}@newbet.com".format(username))
+    return AppUser.objects.create(user=user, cash=cash,
+                                  bank_account_number=111)
+
+
+@TEST_SETTINGS
+class SettlementTest(TestCase):
+    def setUp(self):
+        self.competition = create_competition()
+        home_team, away_team = create_teams(self.competition)
+        self.fixture = Fixture.objects.create(
+            home_team=home_team, away_team=away_team,
+            competition=self.competition, matchday=1, date=timezone.now(),
+            status=2, goals_home_team=2, goals_away_team=1
+        )
+        self.app_user = create_app_user("bettor", cash=0)
+
+    def bet(self, bet, amount="10.00", course=2.5):
+        return Bet.objects.create(bet_user=self.app_user, fixture=self.fixture,
+                                  bet=bet, bet_amount=Decimal(amount),
+                                  bet_course=course)
+
+    def test_winning_bet_types(self):
+        self.assertEqual(winning_bet_types(2, 1), {1, 3, 5, 6})
+        self.assertEqual(winning_bet_types(0, 0), {0, 4, 6})
+        self.assertEqual(winning_bet_types(0, 3), {2, 3})
+        self.assertEqual(winning_bet_types(1, 1), {0, 4, 5, 6})
+
+    def test_settle_grades_all_bet_types(self):
+        bets = {bet_type: self.bet(bet_type)
+                for bet_type, label in Bet.BET_TYPES}
+
+        self.assertEqual(settle_fixtures([self.fixture]), len(bets))
+
+        results = dict(Bet.objects.values_list('bet', 'bet_result'))
+        self.assertEqual(results, {0: 0, 1: 1, 2: 0, 3: 1, 4: 0, 5: 1, 6: 1})
+        self.app_user.refresh_from_db()
+        self.assertEqual(self.app_user.cash, Decimal("100.00"))
+
+    def test_settle_credits_once(self):
+        self.bet(1, amount="3.33", course=1.5)
+        settle_fixtures([self.fixture])
+        settle_fixtures([self.fixture])
+
+        self.app_user.refresh_from_db()
+        self.assertEqual(self.app_user.cash, Decimal("5.00"))
+
+
+@TEST_SETTINGS
+class KickoffTest(TestCase):
+    def setUp(self):
+        self.competition = create_competition()
+        self.home_team, self.away_team = create_teams(self.competition)
+
+    def create_fixture(self, date):
+        return Fixture.objects.create(home_team=self.home_team,
+                                      away_team=self.away_team,
+                                      competition=self.competition,
+                                      matchday=1, date=date)
+
+    @mock.patch.object(kick_off_fixture, 'apply_async')
+    def test_kickoff_queued_on_create_and_reschedule(self, apply_async):
+        kickoff = timezone.now() + timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            fixture = self.create_fixture(kickoff)
+        apply_async.assert_called_once_with((fixture.id,), eta=kickoff)
+
+        fixture = Fixture.objects.get(id=fixture.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            fixture.matchday = 2
+            fixture.save(update_fields=['matchday'])
+        self.assertEqual(apply_async.call_count, 1)
+
+        new_kickoff = kickoff + timedelta(hours=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            fixture.date = new_kickoff
+            fixture.save(update_fields=['date'])
+        apply_async.assert_called_with((fixture.id,), eta=new_kickoff)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            fixture.save()
+        self.assertEqual(apply_async.call_count, 3)
+
+    def test_kick_off_fixture_ignores_rescheduled(self):
+        fixture = self.create_fixture(timezone.now() + timedelta(days=1))
+        self.assertFalse(kick_off_fixture(fixture.id))
+        Fixture.objects.filter(id=fixture.id)\
+            .update(date=timezone.now() - timedelta(minutes=1))
+        self.assertTrue(kick_off_fixture(fixture.id))
+        self.assertEqual(Fixture.objects.get(id=fixture.id).status, 3)
+
+    def test_change_status_starts_overdue_fixtures(self):
+        overdue = self.create_fixture(timezone.now() - timedelta(minutes=5))
+        upcoming = self.create_fixture(timezone.now() + timedelta(days=1))
+
+        self.assertEqual(change_status(), 1)
+        self.assertEqual(Fixture.objects.get(id=overdue.id).status, 3)
+        self.assertEqual(Fixture.objects.get(id=upcoming.id).status, 1)
+
+
+@TEST_SETTINGS
+class QueryPlanTest(TestCase):
+    """
+    Runs EXPLAIN on hot queries and fails if any table is fully scanned
+    """
+    FULL_SCAN = {
+        'sqlite': re.compile(r"\bSCAN (?!.*USING (COVERING )?INDEX)(\w+)"),
+        'postgresql': re.compile(r"Seq Scan on (\w+)"),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.competitions = [create_competition("League {}".format(i), i)
+                            for i in range(3)]
+        cls.app_user = create_app_user("bettor")
+        kickoff = timezone.now()
+        for competition in cls.competitions:
+            teams = create_teams(competition, 6)
+            for matchday, home_team in enumerate(teams):
+                for away_team in teams:
+                    if home_team == away_team:
+                        continue
+                    fixture = Fixture.objects.create(
+                        home_team=home_team, away_team=away_team,
+                        competition=competition, matchday=matchday,
+                        date=kickoff + timedelta(days=matchday),
+                        status=1 + matchday % 2
+                    )
+                    Bet.objects.create(bet_user=cls.app_user, fixture=fixture,
+                                       bet=1, bet_amount=1, bet_course=2)
+        cls.competition = cls.competitions[0]
+        cls.team = Team.objects.filter(competition=cls.competition).first()
+        cls.fixture = Fixture.objects.filter(competition=cls.competition)\
+            .first()
+
+    def assertNoFullScan(self, queryset):
+        pattern = self.FULL_SCAN.get(connection.vendor)
+        if pattern is None:
+            self.skipTest("No plan parser for {}".format(connection.vendor))
+        plan = queryset.explain()
+        self.assertIsNone(pattern.search(plan), plan)
+
+    def test_fixtures_of_competition(self):
+        self.assertNoFullScan(Fixture.objects.filter(
+            competition=self.competition, status=1))
+
+    def test_overdue_fixtures(self):
+        self.assertNoFullScan(Fixture.objects.filter(
+            status=1, date__lte=timezone.now()))
+
+    def test_scheduled_fixtures_by_api_id(self):
+        self.assertNoFullScan(Fixture.objects.filter(
+            status=1, competition__api_id=self.competition.api_id))
+
+    def test_fixture_lookup(self):
+        self.assertNoFullScan(Fixture.objects.filter(
+            home_team=self.fixture.home_team_id,
+            away_team=self.fixture.away_team_id,
+            competition=self.competition, date=self.fixture.date))
+
+    def test_team_fixtures(self):
+        self.assertNoFullScan(Fixture.objects.filter(home_team=self.team))
+        self.assertNoFullScan(Fixture.objects.filter(away_team=self.team))
+
+    def test_team_lookup(self):
+        self.assertNoFullScan(Team.objects.filter(
+            name=self.team.name, competition=self.competition))
+
+    def test_competition_lookup(self):
+        self.assertNoFullScan(Competition.objects.filter(
+            caption=self.competition.caption,
+            api_id=self.competition.api_id))
+
+    def test_pending_bets_of_fixture(self):
+        self.assertNoFullScan(Bet.objects.filter(
+            fixture=self.fixture, bet_result=2))
+
+    def test_bets_of_user(self):
+        self.assertNoFullScan(Bet.objects.filter(bet_user=self.app_user)
+                              .order_by('-bet_placed_at'))
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    """
+    Records requested urls and answers them with given data, optionally
+    blocking until released
+    """
+    def __init__(self, data=None, release=None):
+        self.data = data if data is not None else {"leagues": []}
+        self.release = release
+        self.urls = []
+
+    def get(self, url, timeout=None):
+        self.urls.append(url)
+        if self.release is not None:
+            self.release.wait(5)
+        return FakeResponse(self.data)
+
+
+@TEST_SETTINGS
+class TransportTest(TestCase):
+    def test_responses_are_cached(self):
+        session = FakeSession()
+        api = TheSportsDB(cache=LocalCache(), session=session)
+
+        self.assertEqual(api.get_all_leagues(), {"leagues": []})
+        self.assertEqual(api.get_all_leagues(), {"leagues": []})
+
+        self.assertEqual(len(session.urls), 1)
+        self.assertEqual(api.stats(), {"requests": 1, "misses": 1, "hits": 1})
+
+    def test_live_scores_are_not_cached(self):
+        session = FakeSession()
+        api = TheSportsDB(cache=LocalCache(), session=session)
+        api.get_live_scores()
+        api.get_live_scores()
+        self.assertEqual(len(session.urls), 2)
+
+    def test_stale_response_served_while_refreshing(self):
+        session = FakeSession(data={"events": ["new"]})
+        cache = LocalCache()
+        api = TheSportsDB(cache=cache, session=session)
+        endpoint = "eventsseason.php?id=1"
+        cache.set(endpoint, {"data": {"events": ["old"]},
+                             "stored_at": time.time() - 20 * 60}, 60)
+
+        self.assertEqual(api.make_request(endpoint), {"events": ["old"]})
+        for i in range(50):
+            if cache.get(endpoint)["data"] == {"events": ["new"]}:
+                break
+            time.sleep(0.01)
+        self.assertEqual(api.make_request(endpoint), {"events": ["new"]})
+        self.assertEqual(len(session.urls), 1)
+
+    def test_concurrent_requests_are_coalesced(self):
+        release = threading.Event()
+        session = FakeSession(release=release)
+        api = TheSportsDB(cache=LocalCache(), session=session)
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(api.get_all_leagues())
+        ) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        while not api.single_flight.in_flight("all_leagues.php"):
+            time.sleep(0.001)
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(session.urls), 1)
+        self.assertEqual(results, [{"leagues": []}] * 5)
+
+
+@TEST_SETTINGS
+class CassetteTest(TestCase):
+    BASE_URL = "https://www.thesportsdb.com/api/v1/json/3/"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "sportsdb.json.gz")
+
+    def test_recorded_responses_are_replayed(self):
+        cassette = Cassette()
+        api = TheSportsDB(cache=LocalCache(), session=RecordingSession(
+            cassette, FakeSession(data={"leagues": ["recorded"]})
+        ))
+        api.get_all_leagues()
+        cassette.save(self.path)
+
+        session = ReplaySession(Cassette.load(self.path))
+        api = TheSportsDB(cache=LocalCache(), session=session)
+        self.assertEqual(api.get_all_leagues(), {"leagues": ["recorded"]})
+        self.assertIsNone(api.get_league_table(1))
+        self.assertEqual(session.missing,
+                         [self.BASE_URL + "lookuptable.php?l=1&s=2024-2025"])
+
+    def test_repeated_requests_replay_recorded_sequence(self):
+        url = self.BASE_URL + "livescore.php?l=1"
+        cassette = Cassette()
+        for minute in (10, 20):
+            cassette.record(url, 200, {"events": [minute]})
+        api = TheSportsDB(cache=LocalCache(),
+                          session=ReplaySession(cassette))
+        self.assertEqual([api.get_live_scores(1) for i in range(3)],
+                         [{"events": [10]}, {"events": [20]},
+                          {"events": [20]}])
+
+    def test_errors_are_injected(self):
+        cassette = Cassette()
+        cassette.record(self.BASE_URL + "all_leagues.php", 200, {})
+        for error_status in (503, None):
+            api = TheSportsDB(cache=LocalCache(), session=ReplaySession(
+                cassette, error_rate=1, error_status=error_status
+            ))
+            self.assertIsNone(api.get_all_leagues())
+            self.assertEqual(api.stats()["errors"], 1)
+
+    @mock.patch('betapp.cassettes.requests.Session')
+    def test_record_command(self, session):
+        # Every url gets the same response, with one league and live event
+        session.return_value = FakeSession(data={"leagues": [
+            {"idLeague": "7", "strLeague": "Test League", "strSport": "Soccer"}
+        ], "events": [{"idEvent": "70"}]})
+        call_command('record_cassette', leagues=["7"], polls=2, interval=0,
+                     output=self.path, stdout=io.StringIO())
+
+        cassette = Cassette.load(self.path)
+        self.assertEqual(cassette.meta["leagues"],
+                         [{"id": "7", "name": "Test League"}])
+        self.assertEqual(len(cassette.interactions), 7)
+        for url in ["livescore.php?l=7", "lookupevent.php?id=70",
+                    "lookuptimeline.php?id=70"]:
+            self.assertEqual(len(cassette.responses(self.BASE_URL + url)), 2)
+
+    def test_bench_replays_import_and_refresh(self):
+        teams = ["Team {}".format(i) for i in range(4)]
+        cassette = Cassette(meta={"leagues": [{"id": "7",
+                                               "name": "Test League"}]})
+        cassette.record(self.BASE_URL + "search_all_teams.php?l=Test League",
+                        200, {"teams": [{"strTeam": name, "strTeamBadge": None,
+                                         "strTeamShort": None}
+                                        for name in teams]})
+        cassette.record(self.BASE_URL + "eventsseason.php?id=7", 200, {
+            "events": [{"idEvent": str(i), "strHomeTeam": home_team,
+                        "strAwayTeam": away_team, "dateEvent": "2020-08-01",
+                        "strTime": "15:00:00", "intHomeScore": "1",
+                        "intAwayScore": "0"}
+                       for i, (home_team, away_team)
+                       in enumerate(itertools.permutations(teams, 2))]
+        })
+        cassette.save(self.path)
+        output = os.path.join(os.path.dirname(self.path), "bench.jsonl")
+
+        call_command('bench', only="ingest", cassette=self.path, repeat=2,
+                     output=output, stdout=io.StringIO())
+
+        with open(output) as results:
+            run = json.loads(results.readline())
+        self.assertEqual([(result["name"], result["size"])
+                          for result in run["results"]],
+                         [("ingest:import", 12), ("ingest:refresh", 12)])
+        self.assertEqual(run["options"]["cassette"], self.path)
+        self.assertFalse(Competition.objects.exists())
+
+
+@TEST_SETTINGS
+class RefreshTest(TestCase):
+    def setUp(self):
+        self.competitions = [create_competition("League {}".format(i), i)
+                             for i in range(4)]
+        competition = self.competitions[0]
+        home_team, away_team = create_teams(competition)
+        self.fixture = Fixture.objects.create(
+            home_team=home_team, away_team=away_team, competition=competition,
+            matchday=1, date=timezone.now() + timedelta(days=2),
+            api_fixture_id=1
+        )
+        # The fixture was rescheduled to later date
+        self.rescheduled = (timezone.now() + timedelta(days=9)).date()
+        self.events = {"events": [{
+            "idEvent": "1",
+            "strHomeTeam": home_team.name, "strAwayTeam": away_team.name,
+            "dateEvent": self.rescheduled.isoformat(), "strTime": "18:00:00",
+        }]}
+        self.redis = FakeRedis()
+        self.lease_lock = LeaseLock(self.redis)
+        patcher = mock.patch('betapp.tasks.lease_lock', self.lease_lock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('betapp.tasks.create_team_standing')
+    @mock.patch('betapp.tasks.sports_api')
+    def test_competitions_fetched_concurrently(self, sports_api,
+                                               create_team_standing):
+        barrier = threading.Barrier(len(self.competitions), timeout=5)
+
+        def get_events_by_league(league_id):
+            # Fails unless all competitions are fetched at the same time
+            barrier.wait()
+            return self.events if league_id == 0 else None
+        sports_api.get_events_by_league.side_effect = get_events_by_league
+
+        timings = update_fixtures_foo(concurrency=len(self.competitions))
+
+        self.assertEqual(set(timings),
+                         {competition.id for competition in self.competitions})
+        self.assertEqual(set(timings[self.fixture.competition_id]),
+                         {"fetch", "write", "fixtures"})
+        self.assertEqual(timings[self.fixture.competition_id]["fixtures"], 1)
+        self.assertEqual(create_team_standing.call_count, 4)
+        self.assertEqual(Fixture.objects.get(id=self.fixture.id).date.date(),
+                         self.rescheduled)
+        self.assertEqual(len(self.redis.hgetall(REFRESH_RUNS_KEY)), 4)
+        self.assertFalse(self.redis.scan_iter("*:lease"))
+
+    @mock.patch('betapp.tasks.create_team_standing')
+    @mock.patch('betapp.tasks.sports_api')
+    def test_locked_competition_is_skipped(self, sports_api,
+                                           create_team_standing):
+        sports_api.get_events_by_league.return_value = self.events
+        competition_id = self.fixture.competition_id
+        name = refresh_lock_name(competition_id)
+        token = self.lease_lock.acquire(name, ttl=60)
+
+        self.assertEqual(refresh_competition(competition_id),
+                         {"skipped": True})
+        sports_api.get_events_by_league.assert_not_called()
+        self.assertEqual(update_fixtures_foo()[competition_id],
+                         {"skipped": True})
+        self.assertEqual(Fixture.objects.get(id=self.fixture.id).date,
+                         self.fixture.date)
+
+        self.assertFalse(self.lease_lock.release(name, "other-token"))
+        self.assertTrue(self.lease_lock.release(name, token))
+        run = refresh_competition(competition_id)
+        self.assertEqual(run["fixtures"], 1)
+        self.assertEqual(Fixture.objects.get(id=self.fixture.id).date.date(),
+                         self.rescheduled)
+
+    @mock.patch('betapp.tasks.group')
+    def test_check_fixtures_fans_out_per_competition(self, group):
+        self.assertEqual(check_fixtures(),
+                         [competition.id for competition in self.competitions])
+        signatures = list(group.call_args[0][0])
+        self.assertEqual([signature.args for signature in signatures],
+                         [(competition.id,)
+                          for competition in self.competitions])
+        group.return_value.apply_async.assert_called_once_with()
+
+
+@TEST_SETTINGS
+class ImportTest(TestCase):
+    TEAMS = ["Team {}".format(i) for i in range(4)]
+
+    def teams_data(self):
+        return {"teams": [{"strTeam": name, "strTeamBadge": None,
+                           "strTeamShort": None} for name in self.TEAMS]}
+
+    def events_data(self):
+        events = []
+        for round, home_team in enumerate(self.TEAMS):
+            for away_team in self.TEAMS:
+                if home_team != away_team:
+                    events.append({"idEvent": str(len(events) + 1),
+                                   "strHomeTeam": home_team,
+                                   "strAwayTeam": away_team,
+                                   "dateEvent": "2030-08-{:02d}".format(round + 1),
+                                   "strTime": "15:00:00"})
+        events.append(dict(events[0]))
+        events.append({"idEvent": "99", "strHomeTeam": "Unknown",
+                       "strAwayTeam": self.TEAMS[0],
+                       "dateEvent": "2030-08-01", "strTime": None})
+        return {"events": events}
+
+    @mock.patch('betapp.update_db.schedule_kickoffs')
+    @mock.patch('betapp.update_db.sports_api')
+    def test_import_competition_in_bulk(self, sports_api, schedule_kickoffs):
+        sports_api.get_teams_by_league.return_value = self.teams_data()
+        sports_api.get_events_by_league.return_value = self.events_data()
+
+        with self.assertNumQueries(11):
+            competition = import_competition(1, "Test League")
+
+        self.assertEqual(Team.objects.filter(competition=competition).count(),
+                         4)
+        fixtures = Fixture.objects.filter(competition=competition)
+        self.assertEqual(fixtures.count(), 12)
+        self.assertEqual(fixtures.filter(api_fixture_id__isnull=True).count(),
+                         0)
+        # Freshly priced fixtures aren't due for odds refresh
+        self.assertFalse(fixtures.filter(odds_due_filter(timezone.now()))
+                         .exists())
+        schedule_kickoffs.assert_called_once_with(
+            competition, list(range(1, 13)))
+
+    @mock.patch('betapp.update_db.sports_api')
+    def test_reimport_keeps_existing_fixtures(self, sports_api):
+        from .update_db import create_teams, create_fixtures
+        sports_api.get_teams_by_league.return_value = self.teams_data()
+        sports_api.get_events_by_league.return_value = self.events_data()
+        competition = create_competition()
+        team_ids = create_teams("Test League", competition)
+        create_fixtures(1, competition, team_ids)
+        fixture = Fixture.objects.order_by('id').first()
+        Fixture.objects.filter(id=fixture.id).update(course_draw=7, status=2)
+
+        self.assertEqual(create_teams("Test League", competition), team_ids)
+        create_fixtures(1, competition, team_ids)
+
+        self.assertEqual(Fixture.objects.count(), 12)
+        fixture = Fixture.objects.get(id=fixture.id)
+        self.assertEqual((fixture.course_draw, fixture.status), (7, 2))
+
+    @mock.patch('betapp.update_db.schedule_kickoffs')
+    @mock.patch('betapp.update_db.sports_api')
+    def test_rescheduled_event_moves_fixture(self, sports_api,
+                                             schedule_kickoffs):
+        from .update_db import create_teams, create_fixtures
+        sports_api.get_teams_by_league.return_value = self.teams_data()
+        events_data = self.events_data()
+        sports_api.get_events_by_league.return_value = events_data
+        competition = create_competition()
+        team_ids = create_teams("Test League", competition)
+        create_fixtures(1, competition, team_ids)
+        fixture = Fixture.objects.get(api_fixture_id=2)
+        # Postponed after it was started at its kickoff
+        Fixture.objects.filter(id=fixture.id).update(course_draw=7, status=3)
+
+        events_data["events"][1]["dateEvent"] = "2030-09-01"
+        create_fixtures(1, competition, team_ids)
+
+        self.assertEqual(Fixture.objects.count(), 12)
+        fixture = Fixture.objects.get(id=fixture.id)
+        self.assertEqual(fixture.date.date().isoformat(), "2030-09-01")
+        self.assertEqual(fixture.course_draw, 7)
+        self.assertEqual(fixture.status, 1)
+        self.assertEqual(schedule_kickoffs.call_args_list[-1],
+                         mock.call(competition, [2]))
+
+    @mock.patch('betapp.update_db.schedule_kickoffs')
+    @mock.patch('betapp.update_db.sports_api')
+    def test_fixtures_imported_without_event_id_are_matched(
+            self, sports_api, schedule_kickoffs):
+        from .update_db import create_teams, create_fixtures, \
+            parse_event_date
+        sports_api.get_teams_by_league.return_value = self.teams_data()
+        events_data = self.events_data()
+        sports_api.get_events_by_league.return_value = events_data
+        competition = create_competition()
+        team_ids = create_teams("Test League", competition)
+        event = events_data["events"][0]
+        fixture = Fixture.objects.create(
+            home_team_id=team_ids[event["strHomeTeam"]],
+            away_team_id=team_ids[event["strAwayTeam"]],
+            competition=competition, matchday=1,
+            date=parse_event_date(event), course_draw=7
+        )
+
+        create_fixtures(1, competition, team_ids)
+
+        self.assertEqual(Fixture.objects.count(), 12)
+        fixture = Fixture.objects.get(id=fixture.id)
+        self.assertEqual(fixture.api_fixture_id, 1)
+        self.assertEqual(fixture.course_draw, 7)
+        schedule_kickoffs.assert_called_once_with(competition,
+                                                  list(range(2, 13)))
+
+
+@TEST_SETTINGS
+class OddsTest(TestCase):
+    def test_price_fixtures_matches_calculate_result_odds(self):
+        balances = list(itertools.product(range(0, 11, 2), range(0, 9, 3),
+                                          range(0, 8, 3)))
+        pairs = list(itertools.product(balances, balances))[1:]
+        odds = price_fixtures([home for home, away in pairs],
+                              [away for home, away in pairs])
+
+        for (home, away), fixture_odds in zip(pairs, odds.tolist()):
+            expected = calculate_result_odds({
+                'home_wins': home[0], 'home_draws': home[1],
+                'home_losses': home[2], 'away_wins': away[0],
+                'away_draws': away[1], 'away_losses': away[2],
+            })
+            self.assertEqual(fixture_odds, [expected['home_win'],
+                                            expected['draw'],
+                                            expected['away_win']])
+
+    @mock.patch('betapp.update_db.get_team_balance')
+    def test_due_fixtures_repriced_in_bulk(self, get_team_balance):
+        get_team_balance.side_effect = lambda name, venue: (
+            {"wins": 5, "draws": 3, "losses": 2} if venue == 'home'
+            else {"wins": 1, "draws": 3, "losses": 6}
+        )
+        competition = create_competition()
+        teams = create_teams(competition, 4)
+        for home_team, away_team in itertools.permutations(teams, 2):
+            Fixture.objects.create(home_team=home_team, away_team=away_team,
+                                   competition=competition, matchday=1,
+                                   date=timezone.now() + timedelta(days=1))
+
+        with self.assertNumQueries(4):
+            self.assertEqual(refresh_due_odds(budget=20)["refreshed"], 12)
+
+        self.assertEqual(get_team_balance.call_count, 8)
+        self.assertEqual(set(Fixture.objects.values_list(
+            'course_team_home_win', 'course_draw', 'course_team_away_win'
+        )), {(1.82, 3.33, 6.67)})
+        self.assertFalse(Fixture.objects.filter(
+            last_odds_update__isnull=True).exists())
+
+
+class FakeRedis:
+    """
+    In-memory stand-in of redis client with commands used by betapp.
+    Lua scripts are emulated by python functions registered in SCRIPTS
+    """
+    def __init__(self):
+        self.data = {}
+        self.pubsubs = []
+
+    def hget(self, name, key):
+        return self.data.get(name, {}).get(str(key))
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        mapping = dict(mapping or {})
+        if key is not None:
+            mapping[key] = value
+        fields = self.data.setdefault(name, {})
+        added = len([field for field in mapping if str(field) not in fields])
+        fields.update({str(field): str(value)
+                       for field, value in mapping.items()})
+        return added
+
+    def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    def scan_iter(self, match="*"):
+        return [key for key in list(self.data)
+                if fnmatch.fnmatchcase(key, match)]
+
+    def hincrbyfloat(self, name, key, amount=1.0):
+        fields = self.data.setdefault(name, {})
+        fields[str(key)] = str(float(fields.get(str(key), 0)) + amount)
+        return float(fields[str(key)])
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def set(self, name, value, nx=False, ex=None):
+        if nx and name in self.data:
+            return None
+        self.data[name] = str(value)
+        return True
+
+    def exists(self, *names):
+        return len([name for name in names if name in self.data])
+
+    def rpush(self, name, *values):
+        items = self.data.setdefault(name, [])
+        items.extend(str(value) for value in values)
+        return len(items)
+
+    def lrange(self, name, start, end):
+        items = self.data.get(name, [])
+        return items[start:None if end == -1 else end + 1]
+
+    def ltrim(self, name, start, end):
+        self.data[name] = self.lrange(name, start, end)
+        return True
+
+    def delete(self, *names):
+        return len([self.data.pop(name) for name in names
+                    if name in self.data])
+
+    def rename(self, src, dst):
+        self.data[dst] = self.data.pop(src)
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        pubsub = FakePubSub()
+        self.pubsubs.append(pubsub)
+        return pubsub
+
+    def publish(self, channel, message):
+        receivers = [pubsub for pubsub in self.pubsubs
+                     for pattern in pubsub.patterns
+                     if fnmatch.fnmatchcase(channel, pattern)]
+        for pubsub in receivers:
+            pubsub.messages.put({"type": "pmessage", "channel": channel,
+                                 "data": message})
+        return len(receivers)
+
+    def zincrby(self, name, amount, value):
+        scores = self.data.setdefault(name, {})
+        scores[str(value)] = scores.get(str(value), 0.0) + amount
+        return scores[str(value)]
+
+    def zadd(self, name, mapping):
+        scores = self.data.setdefault(name, {})
+        added = len([member for member in mapping
+                     if str(member) not in scores])
+        scores.update({str(member): float(score)
+                       for member, score in mapping.items()})
+        return added
+
+    def zcard(self, name):
+        return len(self.data.get(name, {}))
+
+    def zscore(self, name, value):
+        return self.data.get(name, {}).get(str(value))
+
+    def ranked(self, name):
+        return sorted(self.data.get(name, {}).items(),
+                      key=lambda item: (item[1], item[0]), reverse=True)
+
+    def zrevrange(self, name, start, end, withscores=False):
+        entries = self.ranked(name)[start:None if end == -1 else end + 1]
+        return entries if withscores else [member for member, score
+                                           in entries]
+
+    def zrevrank(self, name, value):
+        members = [member for member, score in self.ranked(name)]
+        return members.index(str(value)) if str(value) in members else None
+
+    def register_script(self, script):
+        function = SCRIPTS[script]
+        return lambda keys=(), args=(): function(
+            self, list(keys), [str(arg) for arg in args]
+        )
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((getattr(self.client, name), args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        results = [call(*args, **kwargs) for call, args, kwargs in self.calls]
+        self.calls = []
+        return results
+
+
+class FakePubSub:
+    def __init__(self):
+        self.patterns = []
+        self.messages = queue.Queue()
+
+    def psubscribe(self, *patterns):
+        self.patterns.extend(patterns)
+
+    def listen(self):
+        while True:
+            message = self.messages.get()
+            if isinstance(message, Exception):
+                raise message
+            yield message
+
+
+def fake_write_standings(client, keys, args):
+    current = client.hget(keys[0], args[0])
+    if current == args[1] or (current is not None and args[3] == '0'):
+        return 0
+    client.hset(keys[0], mapping={args[0]: args[1], 'updated': args[2]})
+    return 1
+
+
+def fake_release_lease(client, keys, args):
+    if client.get(keys[0]) == args[0]:
+        return client.delete(keys[0])
+    return 0
+
+
+SCRIPTS = {
+    StandingsStore.WRITE_SCRIPT: fake_write_standings,
+    LeaseLock.RELEASE_SCRIPT: fake_release_lease,
+}
+
+
+@TEST_SETTINGS
+class StandingsStoreTest(TestCase):
+    def setUp(self):
+        self.client = FakeRedis()
+        self.store = StandingsStore(self.client)
+
+    def test_history_round_trip(self):
+        self.assertTrue(self.store.write_matchday(1, 1, {7: 2, 8: 1}))
+        self.assertTrue(self.store.write_matchday(1, 2, {7: 1, 8: 2}))
+
+        self.assertEqual(self.client.hget("1:standings", 1), "8:1,7:2")
+        history, updated = self.store.read_history(1)
+        self.assertEqual(history, {1: {7: 2, 8: 1}, 2: {7: 1, 8: 2}})
+        self.assertIsNotNone(updated)
+        self.assertEqual(self.store.team_history(1, 7), ([1, 2], [2, 1]))
+
+    def test_unchanged_matchday_is_not_rewritten(self):
+        self.store.write_matchday(1, 1, {7: 1})
+        self.assertFalse(self.store.write_matchday(1, 1, {7: 1}))
+        self.assertFalse(self.store.write_matchday(1, 1, {7: 2},
+                                                   overwrite=False))
+        self.assertTrue(self.store.write_matchday(1, 1, {7: 2}))
+
+    def test_migrate_team_keys(self):
+        self.client.hset("3:10:standing", mapping={1: 1, 2: 2})
+        self.client.hset("3:11:standing", mapping={1: 2, 2: 1})
+
+        self.assertEqual(self.store.migrate_team_keys(), 2)
+
+        self.assertEqual(self.store.read_history(3)[0],
+                         {1: {10: 1, 11: 2}, 2: {10: 2, 11: 1}})
+        self.assertEqual(self.client.scan_iter("*:*:standing"), [])
+
+
+@TEST_SETTINGS
+class CompetitionStandingsViewTest(TestCase):
+    def setUp(self):
+        self.store = StandingsStore(FakeRedis())
+        patcher = mock.patch('betapp.views.standings_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = reverse('competition-standings', args=[1])
+
+    def test_empty_standings(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.json(), {"matchday_list": [],
+                                           "team_list": [], "standings": []})
+
+    def test_standings_matrix_and_conditional_get(self):
+        self.store.write_matchday(1, 1, {7: 2, 8: 1})
+        self.store.write_matchday(1, 2, {7: 1, 8: 2, 9: 3})
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.json(), {
+            "matchday_list": [1, 2],
+            "team_list": [7, 8, 9],
+            "standings": [[2, 1], [1, 2], [None, 3]],
+        })
+
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(self.url,
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        self.store.write_matchday(1, 3, {7: 3, 8: 1, 9: 2})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@TEST_SETTINGS
+class LeagueTableTest(TestCase):
+    def setUp(self):
+        self.competition = create_competition()
+        self.teams = create_teams(self.competition, 3)
+        self.fixtures = [
+            Fixture.objects.create(home_team=home_team, away_team=away_team,
+                                   competition=self.competition, matchday=1,
+                                   date=timezone.now(), status=3)
+            for home_team, away_team in itertools.permutations(self.teams, 2)
+        ]
+
+    def table(self):
+        return list(LeagueTableRow.objects.filter(competition=self.competition)
+                    .order_by('team_id')
+                    .values_list('team_id', 'played', 'wins', 'draws',
+                                 'losses', 'goals_for', 'goals_against',
+                                 'goal_difference', 'points'))
+
+    def finish_fixtures(self):
+        scores = [(2, 0), (1, 1), (0, 3), (2, 2), (1, 0), (0, 1)]
+        for fixture, (goals_home_team, goals_away_team) in zip(self.fixtures,
+                                                               scores):
+            update_fixture(fixture, goals_away_team, goals_home_team)
+
+    def test_table_updated_incrementally(self):
+        self.finish_fixtures()
+        first, second, third = [team.id for team in self.teams]
+        self.assertEqual(self.table(), [
+            (first, 4, 2, 1, 1, 6, 2, 4, 7),
+            (second, 4, 1, 1, 2, 3, 7, -4, 4),
+            (third, 4, 1, 2, 1, 4, 4, 0, 5),
+        ])
+
+        # Finishing already finished fixture changes nothing
+        update_fixture(self.fixtures[0], 0, 5)
+        self.assertEqual(self.table()[0][1], 4)
+
+        incremental = self.table()
+        rebuild_league_table(self.competition)
+        self.assertEqual(self.table(), incremental)
+
+    def test_table_view_reads_local_table(self):
+        self.finish_fixtures()
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('competition-table',
+                                               args=[self.competition.id]))
+        table = response.context['table']
+        self.assertEqual([row['name'] for row in table],
+                         [self.teams[0].name, self.teams[2].name,
+                          self.teams[1].name])
+        self.assertEqual(table[0]['points'], 7)
+
+
+@TEST_SETTINGS
+class ViewQueryBudgetTest(TestCase):
+    """
+    Requests every page of seeded league and fails if it runs more queries
+    than its budget - number of queries must not grow with number of rows
+    """
+    BUDGETS = {
+        'competitions': 2,
+        'competition': 2,
+        'finished-fixtures': 2,
+        'competition-table': 2,
+        'login': 0,
+        'logout': 1,
+        'register': 0,
+        'bet-fixture': 2,
+        'account-details': 3,
+        'show-team': 5,
+        'add-competitions': 1,
+        'team-standings': 0,
+        'competition-standings': 0,
+        'live-scores': 0,
+        'metrics': 1,
+        'leaderboard': 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.competition = create_competition()
+        teams = create_teams(cls.competition, 20)
+        kickoff = timezone.now()
+        Fixture.objects.bulk_create([
+            Fixture(home_team=home_team, away_team=away_team,
+                    competition=cls.competition, matchday=1,
+                    date=kickoff + timedelta(hours=i),
+                    status=1 + i % 2, goals_home_team=i % 3,
+                    goals_away_team=i % 2)
+            for i, (home_team, away_team)
+            in enumerate(itertools.permutations(teams, 2))
+        ])
+        create_league_table_rows(cls.competition,
+                                 [team.id for team in teams])
+        cls.team = teams[0]
+        cls.fixture = Fixture.objects.filter(status=1).first()
+        cls.app_user = create_app_user("bettor")
+        Bet.objects.bulk_create([
+            Bet(bet_user=cls.app_user, fixture=fixture, bet=1, bet_amount=1,
+                bet_course=2)
+            for fixture in Fixture.objects.all()[:50]
+        ])
+        cls.superuser = User.objects.create_superuser("admin", "a@newbet.com",
+                                                      "secret")
+
+    def setUp(self):
+        cache.clear()
+        ranking = Leaderboard(FakeRedis())
+        ranking.change([(self.app_user.id, self.competition.id, 5)])
+        for target, value in (
+                ('betapp.views.standings_store', StandingsStore(FakeRedis())),
+                ('betapp.views.metrics', MetricsRegistry(FakeRedis())),
+                ('betapp.views.leaderboard', ranking)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def requests(self):
+        """
+        Returns (url name, method, url, user) of request for every url
+        """
+        competition_id = self.competition.id
+        return [
+            ('competitions', 'get', reverse('competitions'), None),
+            ('competition', 'get',
+             reverse('competition', args=[competition_id]), None),
+            ('finished-fixtures', 'get',
+             reverse('finished-fixtures', args=[competition_id]), None),
+            ('competition-table', 'get',
+             reverse('competition-table', args=[competition_id]), None),
+            ('login', 'get', reverse('login'), None),
+            ('logout', 'post', reverse('logout'), self.app_user.user),
+            ('register', 'get', reverse('register'), None),
+            ('bet-fixture', 'get',
+             reverse('bet-fixture', args=[self.fixture.id]),
+             self.app_user.user),
+            ('account-details', 'get', reverse('account-details'),
+             self.app_user.user),
+            ('show-team', 'get', reverse('show-team', args=[self.team.id]),
+             None),
+            ('add-competitions', 'get',
+             reverse('add-competitions', args=[2024]), self.superuser),
+            ('team-standings', 'get',
+             reverse('team-standings', args=[competition_id, self.team.id]),
+             None),
+            ('competition-standings', 'get',
+             reverse('competition-standings', args=[competition_id]), None),
+            ('live-scores', 'get',
+             reverse('live-scores', args=[competition_id]), None),
+            ('metrics', 'get', reverse('metrics'), self.superuser),
+            ('leaderboard', 'get', reverse('leaderboard'), None),
+        ]
+
+    def test_every_url_has_budget(self):
+        from NewBet.urls import urlpatterns
+        names = {getattr(pattern, "name", None) for pattern in urlpatterns}
+        names.discard(None)
+        self.assertEqual(names, set(self.BUDGETS))
+        self.assertEqual({name for name, method, url, user in self.requests()},
+                         set(self.BUDGETS))
+
+    @mock.patch('betapp.views.sports_api')
+    def test_query_budgets(self, sports_api):
+        sports_api.get_all_leagues.return_value = {"leagues": []}
+        for name, method, url, user in self.requests():
+            with self.subTest(name):
+                if user is not None:
+                    self.client.force_login(user)
+                with self.assertNumQueries(self.BUDGETS[name]):
+                    response = getattr(self.client, method)(url)
+                self.assertLess(response.status_code, 400)
+                self.client.logout()
+
+
+@override_settings(METRICS_ENABLED=True)
+@TEST_SETTINGS
+class MetricsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.competition = create_competition()
+        create_teams(cls.competition, 2)
+
+    def setUp(self):
+        cache.clear()
+        self.metrics = MetricsRegistry(FakeRedis())
+        for target, value in (
+                ('betapp.middleware.metrics', self.metrics),
+                ('betapp.views.metrics', self.metrics),
+                ('betapp.signals.metrics', self.metrics),
+                ('betapp.views.leaderboard', Leaderboard(FakeRedis()))):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_request_metrics(self):
+        self.client.get(reverse('competition', args=[self.competition.id]))
+        self.client.get(reverse('competition', args=[self.competition.id]))
+        collected = self.metrics.collect()
+        self.assertEqual(collected['betapp_http_requests_total{method="GET",'
+                                   'status="200",view="competition"}'], 2)
+        self.assertEqual(collected['betapp_http_request_duration_seconds_'
+                                   'count{view="competition"}'], 2)
+        self.assertEqual(collected['betapp_http_request_duration_seconds_'
+                                   'bucket{le="+Inf",view="competition"}'], 2)
+        # Second request is served from page cache
+        self.assertEqual(collected['betapp_http_sql_queries_total'
+                                   '{view="competition"}'], 2)
+
+    def test_metrics_only_for_staff_and_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer ")
+                         .status_code, 403)
+        with self.settings(METRICS_TOKEN="scrape-token"):
+            self.assertEqual(self.client.get(
+                url, HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+            with self.assertNumQueries(0):
+                response = self.client.get(
+                    url, HTTP_AUTHORIZATION="Bearer scrape-token")
+            self.assertEqual(response.status_code, 200)
+        staff = User.objects.create_user(username="admin", password="secret",
+                                         is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_task_and_executor_metrics_sent_once(self):
+        from .signals import task_started, task_finished
+        task = mock.Mock()
+        task.name = "betapp.tasks.poll_live_fixtures"
+        flushed = []
+        flush = self.metrics.flush
+        with mock.patch.object(self.metrics, 'flush',
+                               side_effect=lambda batch: flushed.append(
+                                   flush(batch))):
+            task_started(task_id="task-1")
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(self.metrics.carry(
+                    lambda i: self.metrics.increment("betapp_api_events_total",
+                                                     {"event": "requests"})
+                ), range(8)))
+            self.assertEqual(self.metrics.collect(), {})
+            task_finished(task_id="task-1", task=task, state="SUCCESS")
+        self.assertEqual(len(flushed), 1)
+        collected = self.metrics.collect()
+        self.assertEqual(collected['betapp_api_events_total'
+                                   '{event="requests"}'], 8)
+        self.assertEqual(collected['betapp_task_duration_seconds_count'
+                                   '{state="SUCCESS",task="betapp.tasks.'
+                                   'poll_live_fixtures"}'], 1)
+
+    def test_redis_commands_are_counted(self):
+        class CountingRedis(FakeRedis):
+            def hget(self, name, key):
+                InstrumentedRedis.count_command()
+                return super().hget(name, key)
+
+        with mock.patch('betapp.views.standings_store',
+                        StandingsStore(CountingRedis())):
+            self.client.get(reverse('competition-standings',
+                                    args=[self.competition.id]))
+        collected = self.metrics.collect()
+        self.assertEqual(collected['betapp_http_redis_commands_total'
+                                   '{view="competition-standings"}'], 1)
+        self.assertEqual(collected['betapp_http_sql_queries_total'
+                                   '{view="competition-standings"}'], 0)
+
+    def test_render(self):
+        self.metrics.observe("betapp_api_request_duration_seconds",
+                             {"endpoint": "eventsseason.php"}, 0.2)
+        self.metrics.increment("betapp_api_events_total",
+                               {"event": "requests"})
+        with self.settings(METRICS_TOKEN="scrape-token"):
+            response = self.client.get(
+                reverse('metrics'), HTTP_AUTHORIZATION="Bearer scrape-token")
+        self.assertEqual(response.status_code, 200)
+        lines = response.content.decode().splitlines()
+        self.assertIn("# TYPE betapp_api_request_duration_seconds histogram",
+                      lines)
+        buckets = [line for line in lines if line.startswith(
+            "betapp_api_request_duration_seconds_bucket")]
+        self.assertEqual(len(buckets), 12)
+        self.assertEqual(buckets[0], 'betapp_api_request_duration_seconds_'
+                         'bucket{endpoint="eventsseason.php",le="0.005"} 0.0')
+        self.assertEqual(buckets[-1], 'betapp_api_request_duration_seconds_'
+                         'bucket{endpoint="eventsseason.php",le="+Inf"} 1.0')
+        self.assertIn('betapp_api_events_total{event="requests"} 1.0', lines)
+
+    def test_disabled(self):
+        with self.settings(METRICS_ENABLED=False):
+            self.client.get(reverse('competitions'))
+        self.assertEqual(self.metrics.collect(), {})
+
+
+@TEST_SETTINGS
+class PageCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.competition = create_competition()
+        home_team, away_team = create_teams(cls.competition, 2)
+        cls.fixture = Fixture.objects.create(
+            home_team=home_team, away_team=away_team,
+            competition=cls.competition, matchday=1,
+            date=timezone.now() + timedelta(days=1), status=1,
+            course_team_home_win=1.5
+        )
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('betapp.views.leaderboard',
+                             Leaderboard(FakeRedis()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached_pages_run_no_queries(self):
+        for url in [reverse('competitions'),
+                    reverse('competition', args=[self.competition.id]),
+                    reverse('finished-fixtures', args=[self.competition.id])]:
+            with self.subTest(url):
+                self.client.get(url)
+                with self.assertNumQueries(0):
+                    response = self.client.get(url)
+                self.assertContains(response, self.competition.caption)
+
+    def test_fixture_change_invalidates_page(self):
+        url = reverse('competition', args=[self.competition.id])
+        self.assertContains(self.client.get(url), "1.5")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fixture.course_team_home_win = 2.75
+            self.fixture.save()
+
+        response = self.client.get(url)
+        self.assertContains(response, "2.75")
+        self.assertNotContains(response, "1.5")
+
+    def test_competition_change_invalidates_list(self):
+        url = reverse('competitions')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_competition("Serie A", 4332)
+        self.assertContains(self.client.get(url), "Serie A")
+
+
+@TEST_SETTINGS
+class PlaceBetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        competition = create_competition()
+        home_team, away_team = create_teams(competition, 2)
+        cls.fixture = Fixture.objects.create(
+            home_team=home_team, away_team=away_team, competition=competition,
+            matchday=1, date=timezone.now() + timedelta(days=1), status=1,
+            course_team_home_win=1.8
+        )
+        cls.app_user = create_app_user("bettor", cash=10)
+
+    def place(self, amount, course=1.8, bet=1):
+        return place_bet(self.app_user.id, self.fixture.id, bet,
+                         Decimal(amount), course)
+
+    def test_debits_cash_and_snapshots_course(self):
+        bet = self.place("4.00")
+        self.app_user.refresh_from_db()
+        self.assertEqual(self.app_user.cash, Decimal("6.00"))
+        self.assertEqual(bet.bet_course, 1.8)
+        self.assertEqual(bet.bet_result, 2)
+
+    def test_rejected_bets_change_nothing(self):
+        cases = [("20.00", 1.8, 1),  # not enough cash
+                 ("1.00", 1.9, 1),   # course has changed
+                 ("0.00", 1.8, 1),   # too small
+                 ("1.00", 1.8, 5)]   # type without course
+        for amount, course, bet in cases:
+            with self.subTest(amount=amount, course=course, bet=bet):
+                with self.assertRaises(BetRejected):
+                    self.place(amount, course, bet)
+        Fixture.objects.filter(id=self.fixture.id).update(status=3)
+        with self.assertRaises(BetRejected):
+            self.place("1.00")
+        self.app_user.refresh_from_db()
+        self.assertEqual(self.app_user.cash, Decimal("10.00"))
+        self.assertFalse(Bet.objects.exists())
+
+    def test_view_shows_rejection(self):
+        self.client.force_login(self.app_user.user)
+        response = self.client.post(
+            reverse('bet-fixture', args=[self.fixture.id]),
+            {"bet": 1, "bet_amount": "50", "course_team_home_win": 1.8,
+             "course_draw": 1, "course_team_away_win": 1})
+        self.assertContains(response, "Not enough cash")
+        self.assertFalse(Bet.objects.exists())
+        # Hidden course fields are sent without labels
+        self.assertContains(response, 'name="course_draw"')
+        self.assertNotContains(response, 'for="id_course_draw"')
+
+    def test_form_offers_only_priced_bet_types(self):
+        form = BetForm({"bet": 3, "bet_amount": "5",
+                        "course_team_home_win": 1.8, "course_draw": 1,
+                        "course_team_away_win": 1})
+        self.assertEqual([bet for bet, label in form.fields['bet'].choices],
+                         [1, 2, 0])
+        self.assertIn("bet", form.errors)
+
+
+@TEST_SETTINGS
+class AccountSummaryTest(TestCase):
+    FIELDS = ('bets_count', 'pending_count', 'won_count', 'lost_count',
+              'total_staked', 'total_returned', 'pending_exposure')
+
+    @classmethod
+    def setUpTestData(cls):
+        competition = create_competition()
+        home_team, away_team = create_teams(competition, 2)
+        cls.fixtures = [Fixture.objects.create(
+            home_team=home_team, away_team=away_team, competition=competition,
+            matchday=1, date=timezone.now() + timedelta(days=1 + i), status=1,
+            course_team_home_win=1.5, course_team_away_win=4
+        ) for i in range(2)]
+        cls.app_user = create_app_user("bettor", cash=50)
+
+    def summary(self):
+        return AccountSummary.objects.values(*self.FIELDS)\
+            .get(app_user=self.app_user)
+
+    def test_summary_follows_placement_and_settlement(self):
+        for fixture in self.fixtures:
+            place_bet(self.app_user.id, fixture.id, 1, Decimal("10.00"), 1.5)
+        place_bet(self.app_user.id, self.fixtures[0].id, 2, Decimal("5.00"), 4)
+        self.assertEqual(self.summary(), {
+            'bets_count': 3, 'pending_count': 3, 'won_count': 0,
+            'lost_count': 0, 'total_staked': Decimal("25.00"),
+            'total_returned': Decimal("0.00"),
+            'pending_exposure': Decimal("25.00")})
+
+        Fixture.objects.filter(id=self.fixtures[0].id).update(
+            status=2, goals_home_team=2, goals_away_team=0)
+        settle_fixtures([Fixture.objects.get(id=self.fixtures[0].id)])
+
+        summary = self.summary()
+        self.assertEqual(summary, {
+            'bets_count': 3, 'pending_count': 1, 'won_count': 1,
+            'lost_count': 1, 'total_staked': Decimal("25.00"),
+            'total_returned': Decimal("15.00"),
+            'pending_exposure': Decimal("10.00")})
+        self.assertEqual(AccountSummary.objects.get(
+            app_user=self.app_user).win_rate, 0.5)
+        # Incremental summary matches one computed from whole history
+        rebuild_account_summaries()
+        self.assertEqual(self.summary(), summary)
+
+    def test_bets_are_paged_by_cursor(self):
+        # Bets placed at the same moment are ordered by id
+        placed_at = timezone.now()
+        Bet.objects.bulk_create([
+            Bet(bet_user=self.app_user, fixture=self.fixtures[i % 2], bet=1,
+                bet_amount=1, bet_course=2, bet_placed_at=placed_at)
+            for i in range(5)
+        ])
+        Bet.objects.update(bet_placed_at=placed_at)
+
+        pages = []
+        cursor = None
+        while True:
+            with self.assertNumQueries(1):
+                bets, cursor = bets_page(self.app_user.id, cursor, size=2)
+            pages.append([bet.id for bet in bets])
+            if cursor is None:
+                break
+        ids = sorted(Bet.objects.values_list('id', flat=True), reverse=True)
+        self.assertEqual(pages, [ids[:2], ids[2:4], ids[4:]])
+        self.assertEqual(bets_page(self.app_user.id, "invalid", size=2)[0],
+                         bets_page(self.app_user.id, size=2)[0])
+
+    @override_settings(BET_HISTORY_PAGE_SIZE=1)
+    def test_account_page(self):
+        for fixture in self.fixtures:
+            place_bet(self.app_user.id, fixture.id, 1, Decimal("10.00"), 1.5)
+        self.client.force_login(self.app_user.user)
+        response = self.client.get(reverse('account-details'))
+        self.assertContains(response, "Bets: 2 (2 pending")
+        self.assertEqual(len(response.context["bets"]), 1)
+        older = response.context["next_cursor"]
+        self.assertContains(response, "Older bets")
+
+        response = self.client.get(reverse('account-details'),
+                                   {"before": older})
+        self.assertEqual(len(response.context["bets"]), 1)
+        self.assertIsNone(response.context["next_cursor"])
+        self.assertContains(response, "Newest bets")
+
+
+@TEST_SETTINGS
+class LeaderboardTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.competitions = [create_competition("League {}".format(i), i)
+                            for i in range(2)]
+        cls.fixtures = []
+        for competition in cls.competitions:
+            home_team, away_team = create_teams(competition, 2)
+            cls.fixtures.append(Fixture.objects.create(
+                home_team=home_team, away_team=away_team,
+                competition=competition, matchday=1,
+                date=timezone.now() + timedelta(days=1), status=1,
+                course_team_home_win=2, course_team_away_win=3
+            ))
+        cls.app_users = [create_app_user("bettor{}".format(i), cash=50)
+                         for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        self.leaderboard = Leaderboard(FakeRedis())
+        for target, value in (
+                ('betapp.betting.leaderboard', self.leaderboard),
+                ('betapp.leaderboard.leaderboard', self.leaderboard),
+                ('betapp.settlement.leaderboard', self.leaderboard),
+                ('betapp.views.leaderboard', self.leaderboard),
+                ('betapp.betting.bet_notifier', BetNotifier(FakeRedis()))):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def bet(self, app_user, fixture, bet, amount):
+        course = 2 if bet == 1 else 3
+        with self.captureOnCommitCallbacks(execute=True):
+            place_bet(app_user.id, fixture.id, bet, Decimal(amount), course)
+
+    def finish(self, fixture, goals_home_team, goals_away_team):
+        Fixture.objects.filter(id=fixture.id).update(
+            status=2, goals_home_team=goals_home_team,
+            goals_away_team=goals_away_team)
+        with self.captureOnCommitCallbacks(execute=True):
+            settle_fixtures([Fixture.objects.get(id=fixture.id)])
+
+    def ranking(self, competition_id=None):
+        entries, count = self.leaderboard.page(competition_id, size=10)
+        return [(app_user_id, profit) for rank, app_user_id, profit
+                in entries]
+
+    def test_placement_and_settlement_update_rankings(self):
+        first, second, third = self.app_users
+        self.bet(first, self.fixtures[0], 1, "10.00")
+        self.bet(second, self.fixtures[0], 2, "4.00")
+        self.bet(second, self.fixtures[1], 1, "5.00")
+        self.assertEqual(self.ranking(), [(second.id, -9), (first.id, -10)])
+
+        self.finish(self.fixtures[0], 1, 0)
+        self.assertEqual(self.ranking(), [(first.id, 10), (second.id, -9)])
+        self.assertEqual(self.ranking(self.competitions[0].id),
+                         [(first.id, 10), (second.id, -4)])
+        self.assertEqual(self.ranking(self.competitions[1].id),
+                         [(second.id, -5)])
+        self.assertEqual(self.leaderboard.rank(second.id), (2, -9))
+        self.assertIsNone(self.leaderboard.rank(third.id))
+
+        # Rebuilt rankings match incremental ones
+        incremental = self.ranking(), self.ranking(self.competitions[0].id)
+        self.leaderboard.client.zincrby(self.leaderboard.key(), 100, 999)
+        self.assertEqual(self.leaderboard.rebuild(profits_from_bets()), 2)
+        self.assertEqual((self.ranking(),
+                          self.ranking(self.competitions[0].id)), incremental)
+
+    def test_rebuild_command(self):
+        self.bet(self.app_users[0], self.fixtures[0], 1, "10.00")
+        self.leaderboard.client.data.clear()
+        call_command('rebuild_leaderboard', stdout=io.StringIO())
+        self.assertEqual(self.ranking(), [(self.app_users[0].id, -10)])
+
+    def test_rebuild_swaps_whole_rankings(self):
+        self.leaderboard.change([(self.app_users[1].id,
+                                  self.competitions[1].id, 5)])
+        self.leaderboard.rebuild([(self.app_users[0].id,
+                                   self.competitions[0].id, -3)])
+        self.assertEqual(sorted(self.leaderboard.client.data), [
+            Leaderboard.key(self.competitions[0].id), Leaderboard.key()
+        ])
+        self.assertEqual(self.ranking(), [(self.app_users[0].id, -3)])
+
+    @override_settings(LEADERBOARD_PAGE_SIZE=2)
+    def test_api_pages(self):
+        self.leaderboard.change([(app_user.id, self.competitions[0].id, i)
+                                 for i, app_user in enumerate(self.app_users)])
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('leaderboard'), {
+                "competition": self.competitions[0].id, "page": 2,
+                "app_user": self.app_users[2].id
+            })
+        self.assertEqual(response.json(), {
+            "competition": self.competitions[0].id, "page": 2, "count": 3,
+            "next": None,
+            "results": [{"rank": 3, "app_user_id": self.app_users[0].id,
+                         "username": "bettor0", "profit": 0.0}],
+            "app_user": {"app_user_id": self.app_users[2].id, "rank": 1,
+                         "profit": 2.0},
+        })
+        self.assertEqual(self.client.get(reverse('leaderboard'),
+                                         {"page": "x"}).status_code, 400)
+
+    def test_top_bettors_on_competitions_page(self):
+        self.leaderboard.change([(self.app_users[1].id,
+                                  self.competitions[0].id, 7)])
+        response = self.client.get(reverse('competitions'))
+        self.assertContains(response, "bettor1 (7.00 PLN)")
+
+    def test_top_bettors_are_cached(self):
+        self.leaderboard.change([(self.app_users[1].id,
+                                  self.competitions[0].id, 7)])
+        self.assertEqual(get_top_bettors()[0]["username"], "bettor1")
+        self.leaderboard.change([(self.app_users[2].id,
+                                  self.competitions[0].id, 9)])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_top_bettors()[0]["username"], "bettor1")
+
+
+@TEST_SETTINGS
+class ConcurrentBetTest(TransactionTestCase):
+    """
+    Fires many simultaneous bets from few users and checks that every
+    accepted bet is debited exactly once - no lost updates, no overdraft
+    """
+    THREADS = 16
+    BETS = 400
+    USERS = 4
+
+    def setUp(self):
+        for target in ['betapp.betting.bet_notifier',
+                       'betapp.betting.leaderboard',
+                       'betapp.signals.schedule_kickoff']:
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        competition = create_competition()
+        home_team, away_team = create_teams(competition, 2)
+        self.fixture = Fixture.objects.create(
+            home_team=home_team, away_team=away_team, competition=competition,
+            matchday=1, date=timezone.now() + timedelta(days=1), status=1,
+            course_team_home_win=1.8
+        )
+        # Enough cash for 3/4 of bets, so some are rejected
+        self.app_users = [create_app_user("bettor{}".format(i),
+                                          cash=self.BETS * 3 // 4 //
+                                          self.USERS)
+                          for i in range(self.USERS)]
+
+    def place_bets(self, app_user_ids, results):
+        try:
+            for app_user_id in app_user_ids:
+                try:
+                    place_bet(app_user_id, self.fixture.id, 1,
+                              Decimal("1.00"), 1.8)
+                    results.append(True)
+                except BetRejected:
+                    results.append(False)
+        finally:
+            connection.close()
+
+    def test_no_lost_updates(self):
+        user_ids = [self.app_users[i % self.USERS].id
+                    for i in range(self.BETS)]
+        results = []
+        threads = [threading.Thread(target=self.place_bets,
+                                    args=(user_ids[i::self.THREADS], results))
+                   for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        accepted = sum(results)
+        debited = sum(cash_before.cash - app_user.cash
+                      for cash_before, app_user
+                      in zip(self.app_users,
+                             AppUser.objects.order_by('id')))
+        self.assertEqual(len(results), self.BETS)
+        self.assertEqual(accepted - debited, 0)
+        self.assertEqual(Bet.objects.count(), accepted)
+        self.assertEqual(accepted, self.BETS * 3 // 4)
+        self.assertFalse(AppUser.objects.filter(cash__lt=0).exists())
+
+
+@TEST_SETTINGS
+class BetConfirmationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        competition = create_competition()
+        home_team, away_team = create_teams(competition, 2)
+        fixture = Fixture.objects.create(
+            home_team=home_team, away_team=away_team, competition=competition,
+            matchday=1, date=timezone.now() + timedelta(days=1), status=1
+        )
+        # Second user first, so AppUser ids differ from User ids
+        User.objects.create_user(username="nobody", email="nobody@newbet.com")
+        cls.app_users = [create_app_user("first"), create_app_user("second")]
+        cls.bets = Bet.objects.bulk_create([
+            Bet(bet_user=cls.app_users[i % 2], fixture=fixture, bet=1,
+                bet_amount=1 + i, bet_course=2)
+            for i in range(5)
+        ])
+
+    def setUp(self):
+        self.notifier = BetNotifier(FakeRedis())
+        patcher = mock.patch('betapp.tasks.bet_notifier', self.notifier)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for bet in Bet.objects.order_by('id'):
+            self.notifier.queue(bet.id)
+
+    def test_one_digest_per_user_in_one_query(self):
+        with self.settings(BET_CONFIRMATION_DIGEST=True), \
+                self.assertNumQueries(1):
+            self.assertEqual(send_bet_confirmations(), 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ["first@newbet.com", "second@newbet.com"])
+        first = [message for message in mail.outbox
+                 if message.to == ["first@newbet.com"]][0]
+        self.assertEqual(first.subject, "Your 3 new bets")
+        self.assertIn("Home Win", first.body)
+        self.assertIn("Team 0 - Team 1", first.body)
+        self.assertEqual(self.notifier.drain(10), [])
+
+    def test_batches_without_digest(self):
+        with self.settings(BET_CONFIRMATION_DIGEST=False,
+                           BET_CONFIRMATION_BATCH_SIZE=2), \
+                self.assertNumQueries(3):
+            self.assertEqual(send_bet_confirmations(), 5)
+        self.assertEqual([message.subject for message in mail.outbox],
+                         ["Bet number {}".format(bet.id)
+                          for bet in Bet.objects.order_by('id')])
+
+    @mock.patch('betapp.notifications.send_mass_mail',
+                side_effect=ConnectionRefusedError)
+    def test_failed_batch_is_queued_again(self, send_mass_mail):
+        with self.assertRaises(ConnectionRefusedError):
+            send_bet_confirmations()
+        self.assertEqual(len(self.notifier.drain(10)), 5)
+
+
+@TEST_SETTINGS
+class LivePollingTest(TestCase):
+    def setUp(self):
+        competition = create_competition(api_id=4328)
+        teams = create_teams(competition, 6)
+        kickoff = timezone.now() - timedelta(minutes=50)
+        self.fixtures = [
+            Fixture.objects.create(home_team=teams[2 * i],
+                                   away_team=teams[2 * i + 1],
+                                   competition=competition, matchday=1,
+                                   date=kickoff, status=3, goals_home_team=0,
+                                   goals_away_team=0, minute=45,
+                                   api_fixture_id=100 + i)
+            for i in range(3)
+        ]
+        create_league_table_rows(competition, [team.id for team in teams])
+        self.app_user = create_app_user("bettor", cash=0)
+        Bet.objects.create(bet_user=self.app_user, fixture=self.fixtures[2],
+                           bet=1, bet_amount=10, bet_course=2)
+
+    def event(self, fixture, home, away, progress, status="2H"):
+        return {"idEvent": str(fixture.api_fixture_id),
+                "strHomeTeam": fixture.home_team.name,
+                "strAwayTeam": fixture.away_team.name,
+                "intHomeScore": str(home), "intAwayScore": str(away),
+                "strProgress": progress, "strStatus": status}
+
+    def live_fixtures(self):
+        return list(Fixture.objects.filter(status=3)
+                    .select_related('home_team', 'away_team', 'competition'))
+
+    def timeline(self, *entries):
+        return [{"intTime": str(minute), "strTimeline": event_type,
+                 "strTimelineDetail": "", "strPlayer": player,
+                 "strHome": "Yes" if home else "No"}
+                for minute, event_type, player, home in entries]
+
+    @mock.patch('betapp.tasks.sports_api')
+    def test_poll_appends_only_new_events(self, sports_api):
+        scored = self.fixtures[0]
+        timelines = {100: self.timeline((12, "Goal", "Smith", True),
+                                         (30, "Card", "Jones", False))}
+        sports_api.get_event_timeline.side_effect = \
+            lambda event_id: {"timeline": timelines.get(event_id)}
+        sports_api.get_live_scores.return_value = {"events": [
+            self.event(scored, 1, 1, "46'")
+        ]}
+        sports_api.get_event.return_value = None
+
+        self.assertEqual(poll_live_fixtures()["new_events"], 2)
+        timelines[100] += self.timeline((50, "Goal", "Brown", False))
+        sports_api.get_live_scores.return_value = {"events": [
+            self.event(scored, 1, 1, "50'")
+        ]}
+        self.assertEqual(poll_live_fixtures()["new_events"], 1)
+        # Nothing changed, timeline isn't requested
+        self.assertEqual(poll_live_fixtures()["new_events"], 0)
+        self.assertEqual([call.args for call in
+                          sports_api.get_event_timeline.call_args_list],
+                         [(100,), (100,)])
+
+        self.assertEqual(list(MatchEvent.objects.filter(fixture=scored)
+                              .order_by('minute')
+                              .values_list('minute', 'event_type', 'player',
+                                           'home')),
+                         [(12, "Goal", "Smith", True),
+                          (30, "Card", "Jones", False),
+                          (50, "Goal", "Brown", False)])
+        scored.refresh_from_db()
+        self.assertEqual(scored.events, {"Goal": {"home": 1, "away": 1},
+                                         "Card": {"home": 0, "away": 1}})
+
+    def test_known_events_cost_one_query(self):
+        timelines = {self.fixtures[0].id: self.timeline(
+            (12, "Goal", "Smith", True)
+        )}
+        append_match_events(timelines)
+        with self.assertNumQueries(1):
+            self.assertEqual(append_match_events(timelines), 0)
+        # Event inserted by concurrent poll meanwhile is skipped by insert
+        MatchEvent.objects.bulk_create([MatchEvent(
+            fixture=self.fixtures[0], minute=12, event_type="Goal",
+            player="Smith"
+        )], ignore_conflicts=True)
+        self.assertEqual(MatchEvent.objects.count(), 1)
+
+    def test_parse_minute(self):
+        self.assertEqual([parse_minute(progress)
+                          for progress in ["67'", "45+2", "", None, "HT"]],
+                         [67, 45, None, None, None])
+
+    def test_unchanged_fixtures_are_not_saved(self):
+        fixtures = self.live_fixtures()
+        events = {fixture.id: self.event(fixture, 0, 0, "45'")
+                  for fixture in fixtures}
+        with self.assertNumQueries(0):
+            self.assertEqual(update_live_fixtures(fixtures, events), (0, 0))
+
+    def test_fixture_finished_by_other_poll_is_not_counted(self):
+        # Both polls loaded the fixture while it was live
+        fixtures, stale_fixtures = self.live_fixtures(), self.live_fixtures()
+        finished = fixtures[2]
+        events = {finished.id: self.event(finished, 2, 1, "90'",
+                                          status="FT")}
+        self.assertEqual(update_live_fixtures(fixtures, events), (0, 1))
+        self.assertEqual(update_live_fixtures(stale_fixtures, events), (0, 0))
+
+    @mock.patch('betapp.tasks.sports_api')
+    def test_poll_saves_changes_and_settles_finished(self, sports_api):
+        scored, unchanged, finished = self.fixtures
+        sports_api.get_live_scores.return_value = {"events": [
+            self.event(scored, 1, 0, "52'"),
+            self.event(unchanged, 0, 0, "45'"),
+        ]}
+        sports_api.get_event.return_value = {"events": [
+            self.event(finished, 2, 1, "90'", status="FT")
+        ]}
+
+        with mock.patch.object(Fixture, 'save', autospec=True,
+                               side_effect=Fixture.save) as save:
+            self.assertEqual(poll_live_fixtures(),
+                             {"polled": 3, "changed": 1, "finished": 1,
+                              "new_events": 0})
+        sports_api.get_live_scores.assert_called_once_with(4328)
+        sports_api.get_event.assert_called_once_with(102)
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(set(save.call_args[1]["update_fields"]),
+                         {"goals_home_team", "minute"})
+
+        scored.refresh_from_db()
+        self.assertEqual((scored.goals_home_team, scored.minute,
+                          scored.status), (1, 52, 3))
+        finished.refresh_from_db()
+        self.assertEqual((finished.status, finished.goals_home_team,
+                          finished.goals_away_team), (2, 2, 1))
+        self.app_user.refresh_from_db()
+        self.assertEqual(self.app_user.cash, Decimal("20.00"))
+
+        # Next poll doesn't settle finished fixture again
+        poll_live_fixtures()
+        self.app_user.refresh_from_db()
+        self.assertEqual(self.app_user.cash, Decimal("20.00"))
+
+
+@TEST_SETTINGS
+class OddsScheduleTest(TestCase):
+    def test_refresh_interval_shrinks_towards_kickoff(self):
+        self.assertEqual([refresh_interval(timedelta(**time_to_kickoff))
+                          for time_to_kickoff in [{"minutes": 30},
+                                                  {"hours": 5},
+                                                  {"days": 3},
+                                                  {"days": 21}]],
+                         [timedelta(minutes=5), timedelta(hours=1),
+                          timedelta(hours=12), timedelta(days=7)])
+
+    def test_most_overdue_fixtures_picked_within_budget(self):
+        now = timezone.now()
+        fixtures = [
+            (1, now + timedelta(days=20), now - timedelta(days=1)),  # fresh
+            (2, now + timedelta(minutes=30), now - timedelta(minutes=6)),
+            (3, now + timedelta(days=2), None),  # never priced
+            (4, now + timedelta(hours=5), now - timedelta(hours=3)),
+            (5, now + timedelta(minutes=20), now - timedelta(minutes=2)),
+        ]
+        picked, due, next_refresh = due_fixtures(fixtures, now, budget=2)
+        self.assertEqual(picked, [4, 2])
+        self.assertEqual(due, 3)
+        self.assertEqual(next_refresh, now)
+
+        picked, due, next_refresh = due_fixtures(fixtures, now, budget=10)
+        self.assertEqual(picked, [4, 2, 3])
+        self.assertEqual(next_refresh, now + timedelta(minutes=3))
+
+    @mock.patch('betapp.update_db.get_team_balance',
+                return_value={"wins": 5, "draws": 3, "losses": 2})
+    def test_refresh_due_odds(self, get_team_balance):
+        competition = create_competition()
+        home_team, away_team = create_teams(competition, 2)
+        now = timezone.now()
+        never, stale, fresh = [
+            Fixture.objects.create(home_team=home_team, away_team=away_team,
+                                   competition=competition, matchday=1,
+                                   date=now + kickoff, status=1,
+                                   last_odds_update=updated)
+            for kickoff, updated in [
+                (timedelta(days=10), None),
+                (timedelta(minutes=40), now - timedelta(minutes=10)),
+                (timedelta(days=11), now - timedelta(hours=1)),
+            ]
+        ]
+        result = refresh_due_odds(budget=5, now=now)
+        self.assertEqual((result["due"], result["refreshed"]), (2, 2))
+        self.assertEqual(result["next_refresh"],
+                         fresh.last_odds_update + timedelta(days=7))
+        updated = dict(Fixture.objects.values_list('id', 'last_odds_update'))
+        self.assertGreaterEqual(updated[never.id], now)
+        self.assertGreaterEqual(updated[stale.id], now)
+        self.assertEqual(updated[fresh.id], fresh.last_odds_update)
+
+    @mock.patch('betapp.update_db.get_team_balance',
+                return_value={"wins": 5, "draws": 3, "losses": 2})
+    def test_refresh_due_odds_within_budget(self, get_team_balance):
+        competition = create_competition()
+        home_team, away_team = create_teams(competition, 2)
+        now = timezone.now()
+        fixtures = [
+            Fixture.objects.create(home_team=home_team, away_team=away_team,
+                                   competition=competition, matchday=1,
+                                   date=now + kickoff, status=1,
+                                   last_odds_update=updated)
+            for kickoff, updated in [
+                (timedelta(days=2), None),
+                (timedelta(minutes=30), now - timedelta(minutes=6)),
+                (timedelta(hours=5), now - timedelta(hours=3)),
+                (timedelta(days=20), now - timedelta(days=1)),
+            ]
+        ]
+        result = refresh_due_odds(budget=2, now=now)
+        self.assertEqual(result, {"due": 3, "refreshed": 2,
+                                  "next_refresh": now})
+        self.assertEqual(list(Fixture.objects.filter(last_odds_update__gte=now)
+                              .order_by('id').values_list('id', flat=True)),
+                         [fixtures[1].id, fixtures[2].id])
+
+
+@TEST_SETTINGS
+class LiveScoresStreamTest(TestCase):
+    def setUp(self):
+        competition = create_competition()
+        home_team, away_team = create_teams(competition, 2)
+        self.fixture = Fixture.objects.create(
+            home_team=home_team, away_team=away_team, competition=competition,
+            matchday=1, date=timezone.now(), status=3, goals_home_team=0,
+            goals_away_team=0, minute=10
+        )
+        self.redis = FakeRedis()
+        self.broadcaster = LiveBroadcaster(self.redis)
+        for target in ['betapp.views.live_scores',
+                       'betapp.update_db.live_scores',
+                       'betapp.tasks.live_scores']:
+            patcher = mock.patch(target, self.broadcaster)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def open_stream(self, competition_id):
+        response = self.client.get(reverse('live-scores',
+                                           args=[competition_id]))
+        self.addCleanup(self.close_stream, response)
+        stream = iter(response.streaming_content)
+        self.assertEqual(next(stream), b"retry: 5000\n\n")
+        return response, stream
+
+    def close_stream(self, response):
+        # Closing fires request_finished, which mustn't close db connection
+        # of the test
+        with mock.patch.object(connection, 'close_if_unusable_or_obsolete'):
+            response.close()
+
+    def read_event(self, stream):
+        event, data = next(stream).decode().strip().split("\n")
+        self.assertEqual(event, "event: fixture")
+        return json.loads(data[len("data: "):])
+
+    @override_settings(LIVE_STREAM_KEEPALIVE=0.2)
+    def test_stream_pushes_changes_without_queries(self):
+        competition_id = self.fixture.competition_id
+        with self.assertNumQueries(0):
+            response, stream = self.open_stream(competition_id)
+            other_response, other_stream = self.open_stream(competition_id)
+        self.assertEqual(response['Content-Type'], "text/event-stream")
+
+        fixture = Fixture.objects.select_related(
+            'home_team', 'away_team').get(id=self.fixture.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            update_live_fixtures([fixture], {fixture.id: {
+                "intHomeScore": "1", "intAwayScore": "0",
+                "strProgress": "52'", "strStatus": "2H"
+            }})
+        expected = {"id": fixture.id, "status": 3, "goals_home_team": 1,
+                    "goals_away_team": 0, "minute": 52}
+        self.assertEqual(self.read_event(stream), expected)
+        self.assertEqual(self.read_event(other_stream), expected)
+        # All clients of process share one redis subscription
+        self.assertEqual(len(self.redis.pubsubs), 1)
+
+        # Changes of other competitions aren't sent
+        self.redis.publish(LiveBroadcaster.channel(competition_id + 1), "{}")
+        self.assertEqual(next(stream), b": keepalive\n\n")
+
+        self.close_stream(response)
+        self.close_stream(other_response)
+        self.assertEqual(self.broadcaster.subscribers, {})
+
+    @override_settings(LIVE_STREAM_KEEPALIVE=0.2)
+    def test_stream_restarts_dead_listener(self):
+        competition_id = self.fixture.competition_id
+        response, stream = self.open_stream(competition_id)
+        listener = self.broadcaster.listener
+        self.redis.pubsubs[0].messages.put(ConnectionError("Connection lost"))
+        listener.join(timeout=5)
+        self.assertFalse(listener.is_alive())
+
+        self.assertEqual(next(stream), b": keepalive\n\n")
+        self.assertTrue(self.broadcaster.listening.wait(timeout=5))
+        self.assertEqual(len(self.redis.pubsubs), 2)
+        self.redis.publish(LiveBroadcaster.channel(competition_id), "{}")
+        self.assertEqual(next(stream), b"event: fixture\ndata: {}\n\n")
+
+    @override_settings(LIVE_STREAM_KEEPALIVE=0.2)
+    async def test_asgi_stream_runs_in_event_loop(self):
+        competition_id = self.fixture.competition_id
+        response = await self.async_client.get(
+            reverse('live-scores', args=[competition_id]))
+        self.assertTrue(response.is_async)
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 5000\n\n")
+
+        self.redis.publish(LiveBroadcaster.channel(competition_id), "{}")
+        self.assertEqual(await asyncio.wait_for(anext(stream), 5),
+                         b"event: fixture\ndata: {}\n\n")
+        self.assertEqual(await anext(stream), b": keepalive\n\n")
+
+        await stream.aclose()
+        # ASGI handler closes response once client disconnects
+        await sync_to_async(self.close_stream)(response)
+        self.assertEqual(self.broadcaster.subscribers, {})
+
+    def test_kickoff_is_published(self):
+        Fixture.objects.filter(id=self.fixture.id).update(status=1, minute=None)
+        with self.captureOnCommitCallbacks(execute=True):
+            subscriber = self.broadcaster.subscribe(self.fixture.competition_id)
+            self.assertTrue(kick_off_fixture(self.fixture.id))
+        self.assertEqual(json.loads(subscriber.get(timeout=5)),
+                         {"id": self.fixture.id, "status": 3,
+                          "goals_home_team": 0, "goals_away_team": 0,
+                          "minute": None})
+
+    def test_finished_fixture_is_published(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            subscriber = self.broadcaster.subscribe(self.fixture.competition_id)
+            update_fixture(self.fixture, 1, 2)
+        self.assertEqual(json.loads(subscriber.get(timeout=5)),
+                         {"id": self.fixture.id, "status": 2,
+                          "goals_home_team": 2, "goals_away_team": 1,
+                          "minute": 10})
+
+
+@TEST_SETTINGS
+class BenchCommandTest(TestCase):
+    @mock.patch('betapp.views.leaderboard', Leaderboard(FakeRedis()))
+    def test_results_are_appended_as_json_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "bench.jsonl")
+            for run in range(2):
+                # Placement needs committed data, see BenchPlacementTest
+                call_command('bench', bets=[50], teams=[4], users=5,
+                             repeat=1, output=output, stdout=io.StringIO(),
+                             only="settlement,odds,import,standings,views")
+            with open(output) as results:
+                runs = [json.loads(line) for line in results]
+
+        self.assertEqual(len(runs), 2)
+        names = {result["name"] for result in runs[0]["results"]}
+        self.assertTrue({"settlement", "odds:scalar", "odds:vectorized",
+                         "import:fixtures", "view:competition",
+                         "view:competition:warm"} <= names)
+        settlement = [result for result in runs[0]["results"]
+                      if result["name"] == "settlement"][0]
+        self.assertEqual(settlement["size"], 50)
+        # Cached page only loads logged in user
+        warm = [result for result in runs[0]["results"]
+                if result["name"] == "view:competition:warm"][0]
+        self.assertEqual(warm["queries"], 1)
+        # Benchmark data is rolled back
+        self.assertFalse(Competition.objects.exists())
+        self.assertFalse(Bet.objects.exists())
+
+    def test_every_import_run_starts_empty(self):
+        from .update_db import create_fixtures
+        existing = []
+
+        def import_fixtures(*args):
+            existing.append(Fixture.objects.count())
+            return create_fixtures(*args)
+
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch('betapp.management.commands.bench.create_fixtures',
+                           side_effect=import_fixtures):
+            call_command('bench', only="import", teams=[4], repeat=3,
+                         output=os.path.join(directory, "bench.jsonl"),
+                         stdout=io.StringIO())
+        self.assertEqual(existing, [0, 0, 0])
+
+
+@TEST_SETTINGS
+class BenchPlacementTest(TransactionTestCase):
+    def test_placement_records_throughput_and_lost_updates(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "bench.jsonl")
+            call_command('bench', only="placement", placements=40,
+                         threads=4, users=2, output=output,
+                         stdout=io.StringIO())
+            with open(output) as results:
+                result = json.loads(results.readline())["results"][0]
+
+        self.assertEqual(result["name"], "placement")
+        self.assertEqual(result["accepted"], 30)
+        self.assertEqual(result["lost_updates"], 0)
+        self.assertGreater(result["bets_per_second"], 0)
+        # Benchmark data is deleted
+        self.assertFalse(Competition.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+
+@TEST_SETTINGS
+class SyntheticDataCommandTest(TestCase):
+    def generate(self, **options):
+        call_command('generate_synthetic_data', stdout=io.StringIO(),
+                     **options)
+
+    def snapshot(self):
+        return (list(Fixture.objects.order_by('id').values_list(
+                    'home_team__name', 'away_team__name', 'matchday',
+                    'status', 'goals_home_team', 'course_draw')),
+                list(Bet.objects.order_by('id').values_list(
+                    'bet_user__user__username', 'fixture__matchday', 'bet',
+                    'bet_amount', 'bet_course')))
+
+    @mock.patch('betapp.management.commands.generate_synthetic_data'
+                '.standings_store')
+    def test_generates_deterministic_data(self, standings_store):
+        self.generate(leagues=2, teams=4, finished_matchdays=2, users=7,
+                      bets=300, standings=True)
+        self.assertEqual(Competition.objects.count(), 2)
+        self.assertEqual(Fixture.objects.count(), 2 * 12)
+        self.assertEqual(Fixture.objects.filter(status=2).count(), 2 * 4)
+        self.assertEqual(AppUser.objects.count(), 7)
+        self.assertEqual(Bet.objects.count(), 300)
+        self.assertFalse(Bet.objects.exclude(fixture__status=1).exists())
+        self.assertEqual(LeagueTableRow.objects.filter(played=2).count(), 8)
+        # Positions after both finished matchdays of both leagues
+        self.assertEqual(standings_store.write_matchday.call_count, 4)
+        competition_id, matchday, positions = \
+            standings_store.write_matchday.call_args[0]
+        self.assertEqual(sorted(positions.values()), [1, 2, 3, 4])
+
+        first = self.snapshot()
+        Competition.objects.all().delete()
+        User.objects.all().delete()
+        self.generate(leagues=2, teams=4, finished_matchdays=2, users=7,
+                      bets=300)
+        self.assertEqual(self.snapshot(), first)
+
+    @mock.patch('betapp.management.commands.generate_synthetic_data'
+                '.SEED_BATCH_SIZE', 2)
+    def test_summaries_computed_once_after_all_chunks(self):
+        with mock.patch('betapp.management.commands.generate_synthetic_data'
+                        '.rebuild_account_summaries',
+                        wraps=rebuild_account_summaries) as rebuild:
+            self.generate(leagues=1, teams=4, finished_matchdays=0, users=7,
+                          bets=300)
+        rebuild.assert_called_once()
+        self.assertEqual(sum(AccountSummary.objects.values_list(
+            'pending_count', flat=True)), 300)
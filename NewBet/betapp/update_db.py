@@ -1,51 +1,62 @@
 from .api_connection import sports_api, get_competitions, get_fixtures, get_league_table
-from .models import AppUser, User, Competition, Fixture, Team, Bet
+from .models import Competition, Fixture, Team, MatchEvent, LeagueTableRow
+from .settlement import settle_fixtures
+from .odds import price_fixtures, group_by_value
+from .odds_schedule import due_fixtures, odds_due_filter, \
+    refresh_at_expression
+from .standings import standings_store
+from .page_cache import invalidate_fixtures
+from .live_stream import live_scores
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Case, When, Value, F, FloatField, Count, Min
 from django.shortcuts import get_object_or_404
 from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
+from collections import Counter
 from random import randint
-from decimal import Decimal
 
-import redis
 
+# Rows written per INSERT by bulk imports
+IMPORT_BATCH_SIZE = 500
+# Fixtures re-priced per UPDATE
+ODDS_UPDATE_BATCH_SIZE = 5000
 
-r = redis.StrictRedis(host=settings.REDIS_HOST,
-                      port=settings.REDIS_PORT,
-                      db=settings.REDIS_DB,
-                      decode_responses=True)
-
-
-def create_team(name, crest_url, short_name, competition):
-    """
-    Creates single Team object and saves it to db
-    """
-    try:
-        Team.objects.get(name=name, competition=competition)
-    except ObjectDoesNotExist:
-        Team.objects.create(
-            name=name,
-            crest_url=crest_url,
-            short_name=short_name,
-            competition=competition
-        )
+ODDS_FIELDS = ('course_team_home_win', 'course_draw', 'course_team_away_win')
 
 
 def create_teams(league_name, competition):
     """
-    Creates teams for a competition using The Sports DB
+    Creates teams for a competition using The Sports DB, teams already in db
+    are updated
+    :return: dict - team name to team id map of all competition's teams
     """
     teams_data = sports_api.get_teams_by_league(league_name)
-    
-    if teams_data and 'teams' in teams_data:
+
+    teams = {}
+    if teams_data and teams_data.get('teams'):
         for team_data in teams_data['teams']:
             name = team_data['strTeam']
-            crest_url = team_data['strTeamBadge']
-            short_name = team_data['strTeamShort'] or name[:10]
-            code = team_data['strTeamShort'] or name[:3].upper()
+            teams[name] = Team(
+                name=name,
+                crest_url=team_data['strTeamBadge'],
+                short_name=team_data['strTeamShort'] or name[:10],
+                code=team_data['strTeamShort'] or name[:3].upper(),
+                competition=competition
+            )
 
-            create_team(name, crest_url, short_name, competition)
+    with transaction.atomic():
+        Team.objects.bulk_create(
+            teams.values(), batch_size=IMPORT_BATCH_SIZE,
+            update_conflicts=True, unique_fields=['competition', 'name'],
+            update_fields=['crest_url', 'short_name', 'code']
+        )
+    invalidate_fixtures(competition.id)
+    return dict(Team.objects.filter(competition=competition)
+                .values_list('name', 'id'))
 
 
 def get_team_balance(team_name, venue):
@@ -106,78 +117,198 @@ def calculate_result_odds(balance):
     return odds
 
 
-def calculate_odds(home_team_name, away_team_name):
+def calculate_fixtures_odds(fixtures_teams):
     """
-    Calculate odds for a fixture
+    Calculates odds for many fixtures in one pass, getting balance of each
+    team only once
+    :param fixtures_teams: list of (home team name, away team name) tuples
+    :return: array (n, 3) - home win, draw, away win odds in order of fixtures
     """
-    home_team_balance = get_team_balance(home_team_name, 'home')
-    away_team_balance = get_team_balance(away_team_name, 'away')
-
-    both_teams_balance = {
-        'home_wins': home_team_balance['wins'],
-        'home_draws': home_team_balance['draws'],
-        'home_losses': home_team_balance['losses'],
-        'away_wins': away_team_balance['wins'],
-        'away_draws': away_team_balance['draws'],
-        'away_losses': away_team_balance['losses'],
-    }
+    home_balances = {}
+    away_balances = {}
+    for home_team_name, away_team_name in fixtures_teams:
+        if home_team_name not in home_balances:
+            home_balances[home_team_name] = get_team_balance(home_team_name,
+                                                             'home')
+        if away_team_name not in away_balances:
+            away_balances[away_team_name] = get_team_balance(away_team_name,
+                                                             'away')
 
-    return calculate_result_odds(both_teams_balance)
+    def balance_rows(balances, names):
+        return [(balances[name]['wins'], balances[name]['draws'],
+                 balances[name]['losses']) for name in names]
 
+    return price_fixtures(
+        balance_rows(home_balances, [home for home, away in fixtures_teams]),
+        balance_rows(away_balances, [away for home, away in fixtures_teams])
+    )
 
-def create_fixture(home_team_name, away_team_name, date, competition, matchday=1):
-    """
-    Creates fixture and saves it to db
-    """
-    try:
-        home_team = Team.objects.get(name=home_team_name, competition=competition)
-        away_team = Team.objects.get(name=away_team_name, competition=competition)
-        
-        odds = calculate_odds(home_team_name, away_team_name)
 
-        # Try to get fixture if exists, else create new fixture object
-        try:
-            fixture = Fixture.objects.get(
-                home_team=home_team,
-                away_team=away_team,
-                competition=competition,
-                date=date
-            )
-        except ObjectDoesNotExist:
-            Fixture.objects.create(
-                home_team=home_team,
-                away_team=away_team,
+def write_fixtures_odds(fixture_ids, odds):
+    """
+    Saves odds of many fixtures with one UPDATE per ODDS_UPDATE_BATCH_SIZE
+    fixtures. Fixtures are grouped by odds value, so CASE of each field has
+    a branch per distinct value instead of per fixture
+    :param fixture_ids: list of Fixture ids
+    :param odds: array (n, 3) - home win, draw, away win odds
+    :return: int - number of updated fixtures
+    """
+    updated = 0
+    now = timezone.now()
+    for start in range(0, len(fixture_ids), ODDS_UPDATE_BATCH_SIZE):
+        batch_ids = fixture_ids[start:start + ODDS_UPDATE_BATCH_SIZE]
+        batch_odds = odds[start:start + ODDS_UPDATE_BATCH_SIZE]
+        update_kwargs = {
+            field: Case(*[When(id__in=ids, then=Value(value))
+                          for value, ids in
+                          group_by_value(batch_ids, batch_odds[:, column])
+                          .items()],
+                        output_field=FloatField())
+            for column, field in enumerate(ODDS_FIELDS)
+        }
+        updated += Fixture.objects.filter(id__in=batch_ids)\
+            .update(last_odds_update=now, **update_kwargs)
+    return updated
+
+
+def parse_event_date(event):
+    """
+    Returns aware kickoff datetime of API event
+    """
+    date = parse_datetime("{} {}".format(event['dateEvent'],
+                                         event.get('strTime') or '15:00:00'))
+    if date is not None and timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+def create_fixtures(league_id, competition, team_ids=None, events_data=None):
+    """
+    Creates fixtures for a competition using The Sports DB, keyed on API
+    event id - fixtures already in db keep their odds and status, only their
+    matchday and kickoff are updated, so rescheduled events move instead of
+    being imported again. Playing fixtures moved to later kickoff were
+    postponed and become scheduled again.
+    :param team_ids: dict - team name to team id map of competition's teams
+    :param events_data: eventsseason.php response, fetched if None
+    :return: int - number of imported fixtures
+    """
+    if events_data is None:
+        events_data = sports_api.get_events_by_league(league_id)
+    if not events_data or not events_data.get('events'):
+        return 0
+    if team_ids is None:
+        team_ids = dict(Team.objects.filter(competition=competition)
+                        .values_list('name', 'id'))
+
+    # Parse all events first, keyed on API event id
+    fixtures = {}
+    events = events_data['events']
+    matchday = 1
+    for event in events:
+        home_team_id = team_ids.get(event['strHomeTeam'])
+        away_team_id = team_ids.get(event['strAwayTeam'])
+        date = parse_event_date(event)
+        if home_team_id is None or away_team_id is None:
+            print(f"Team not found: {event['strHomeTeam']} or "
+                  f"{event['strAwayTeam']}")
+        elif not event.get('idEvent'):
+            print(f"Event without id: {event['strHomeTeam']} - "
+                  f"{event['strAwayTeam']}")
+        elif date is not None:
+            fixtures[int(event['idEvent'])] = Fixture(
+                home_team_id=home_team_id,
+                away_team_id=away_team_id,
                 competition=competition,
                 matchday=matchday,
                 date=date,
-                course_team_home_win=odds['home_win'],
-                course_team_away_win=odds['away_win'],
-                course_draw=odds['draw']
+                api_fixture_id=int(event['idEvent'])
             )
-    except Team.DoesNotExist:
-        print(f"Team not found: {home_team_name} or {away_team_name}")
 
+        # Simple matchday increment for demo
+        if len(events) > 10:
+            matchday = (matchday % 5) + 1  # Cycle through 5 matchdays
+
+    kickoffs = {}
+    legacy_ids = {}
+    for fixture_id, api_fixture_id, home_team_id, away_team_id, date in \
+            Fixture.objects.filter(competition=competition).values_list(
+                'id', 'api_fixture_id', 'home_team_id', 'away_team_id',
+                'date'):
+        if api_fixture_id is None:
+            legacy_ids[(home_team_id, away_team_id, date)] = fixture_id
+        else:
+            kickoffs[api_fixture_id] = date
+    # Fixtures imported before they were keyed on API event id are matched
+    # on teams and kickoff and get id of their event
+    adopted = []
+    for api_fixture_id, fixture in fixtures.items():
+        fixture_id = legacy_ids.pop((fixture.home_team_id,
+                                     fixture.away_team_id, fixture.date),
+                                    None)
+        if fixture_id is not None and api_fixture_id not in kickoffs:
+            adopted.append(Fixture(id=fixture_id,
+                                   api_fixture_id=api_fixture_id))
+            kickoffs[api_fixture_id] = fixture.date
+    # Only new fixtures get odds, existing ones keep theirs on conflict
+    new_fixtures = [fixture for api_fixture_id, fixture in fixtures.items()
+                    if api_fixture_id not in kickoffs]
+    team_names = {team_id: name for name, team_id in team_ids.items()}
+    odds = calculate_fixtures_odds([(team_names[fixture.home_team_id],
+                                     team_names[fixture.away_team_id])
+                                    for fixture in new_fixtures])
+    # Odds priced now aren't due for refresh until their interval passes
+    now = timezone.now()
+    for fixture, fixture_odds in zip(new_fixtures, odds.tolist()):
+        for field, value in zip(ODDS_FIELDS, fixture_odds):
+            setattr(fixture, field, value)
+        fixture.last_odds_update = now
+
+    rescheduled = [api_fixture_id
+                   for api_fixture_id, fixture in fixtures.items()
+                   if api_fixture_id in kickoffs
+                   and kickoffs[api_fixture_id] != fixture.date]
+    with transaction.atomic():
+        if adopted:
+            Fixture.objects.bulk_update(adopted, ['api_fixture_id'],
+                                        batch_size=IMPORT_BATCH_SIZE)
+        Fixture.objects.bulk_create(
+            fixtures.values(), batch_size=IMPORT_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['competition', 'api_fixture_id'],
+            update_fields=['matchday', 'date']
+        )
+        if rescheduled:
+            # Postponed fixtures were started at their old kickoff, they
+            # wait for the new one again
+            Fixture.objects.filter(competition=competition, status=3,
+                                   api_fixture_id__in=rescheduled,
+                                   date__gt=now).update(status=1)
+    invalidate_fixtures(competition.id)
+
+    schedule_kickoffs(competition, [
+        api_fixture_id for api_fixture_id in fixtures
+        if api_fixture_id not in kickoffs or api_fixture_id in rescheduled
+    ])
+    return len(fixtures)
 
-def create_fixtures(league_id, competition):
+
+def schedule_kickoffs(competition, api_fixture_ids):
     """
-    Creates fixtures for a competition using The Sports DB
+    Queues kickoff tasks of given new or rescheduled fixtures of competition
+    which are still upcoming, bulk imports skip post_save signal which does
+    it for single fixtures
+    :param api_fixture_ids: list of API event ids of fixtures
     """
-    events_data = sports_api.get_events_by_league(league_id)
-    
-    if events_data and 'events' in events_data:
-        matchday = 1
-        for event in events_data['events']:
-            home_team = event['strHomeTeam']
-            away_team = event['strAwayTeam']
-            date_str = event['dateEvent']
-            time_str = event.get('strTime', '15:00:00')
-            date = f"{date_str} {time_str}"
-            
-            create_fixture(home_team, away_team, date, competition, matchday)
-            
-            # Simple matchday increment for demo
-            if len(events_data['events']) > 10:
-                matchday = (matchday % 5) + 1  # Cycle through 5 matchdays
+    from .tasks import schedule_kickoff
+
+    if not api_fixture_ids:
+        return
+    for fixture in Fixture.objects.filter(competition=competition, status=1,
+                                          api_fixture_id__in=api_fixture_ids,
+                                          date__gt=timezone.now())\
+            .only('id', 'date'):
+        schedule_kickoff(fixture)
 
 
 def create_competition(league_id, league_name):
@@ -204,8 +335,9 @@ def create_competition(league_id, league_name):
         print(f"Created competition: {league_name}")
         
         # Create teams and fixtures
-        create_teams(league_name, comp)
-        create_fixtures(league_id, comp)
+        team_ids = create_teams(league_name, comp)
+        create_fixtures(league_id, comp, team_ids)
+        create_league_table_rows(comp, team_ids.values())
         
         return comp
 
@@ -242,82 +374,327 @@ def get_fixture_result(goals_home_team, goals_away_team):
         return 2
 
 
-def cash_user(bet):
+def check_bets(fixture):
     """
-    Transfers money to AppUser account if user won their bet
+    Checks all bets related to given fixture
     """
-    app_user = bet.bet_user
-    if bet.bet_result == 1:
-        cash_win = bet.bet_amount * Decimal(bet.bet_course)
-        app_user.cash += cash_win
-        app_user.save()
+    return settle_fixtures([fixture])
 
 
-def check_bets(fixture):
+def table_row_changes(goals_for, goals_against):
     """
-    Checks all bets related to given fixture
+    Returns league table row increments for team's result in one fixture
+    """
+    return {
+        'played': 1,
+        'wins': int(goals_for > goals_against),
+        'draws': int(goals_for == goals_against),
+        'losses': int(goals_for < goals_against),
+        'goals_for': goals_for,
+        'goals_against': goals_against,
+        'goal_difference': goals_for - goals_against,
+        'points': 3 if goals_for > goals_against
+        else int(goals_for == goals_against),
+    }
+
+
+def create_league_table_rows(competition, team_ids):
+    """
+    Creates missing league table rows of competition's teams
+    :param team_ids: iterable of ids of competition's teams
     """
-    bets = Bet.objects.filter(fixture=fixture)
+    LeagueTableRow.objects.bulk_create(
+        [LeagueTableRow(competition=competition, team_id=team_id)
+         for team_id in team_ids],
+        ignore_conflicts=True
+    )
 
-    for bet in bets:
-        if bet.bet == fixture.fixture_result:
-            bet.bet_result = 1
-            bet.save()
-            cash_user(bet)
-        else:
-            bet.bet_result = 0
-            bet.save()
+
+def update_league_table(fixture):
+    """
+    Adds result of finished fixture to league table rows of its two teams
+    """
+    rows = LeagueTableRow.objects.filter(competition=fixture.competition_id)
+    for team_id, goals_for, goals_against in (
+            (fixture.home_team_id, fixture.goals_home_team,
+             fixture.goals_away_team),
+            (fixture.away_team_id, fixture.goals_away_team,
+             fixture.goals_home_team)):
+        changes = table_row_changes(goals_for, goals_against)
+        updated = rows.filter(team=team_id).update(
+            **{field: F(field) + value for field, value in changes.items()}
+        )
+        if not updated:
+            LeagueTableRow.objects.create(competition_id=fixture.competition_id,
+                                          team_id=team_id, **changes)
+
+
+def rebuild_league_table(competition):
+    """
+    Computes competition's league table from all its finished fixtures
+    """
+    totals = {team_id: Counter() for team_id in
+              Team.objects.filter(competition=competition)
+              .values_list('id', flat=True)}
+    for home_team_id, away_team_id, goals_home_team, goals_away_team in \
+            Fixture.objects.filter(competition=competition, status=2,
+                                   goals_home_team__isnull=False,
+                                   goals_away_team__isnull=False)\
+            .values_list('home_team_id', 'away_team_id', 'goals_home_team',
+                         'goals_away_team'):
+        totals.setdefault(home_team_id, Counter()).update(
+            table_row_changes(goals_home_team, goals_away_team))
+        totals.setdefault(away_team_id, Counter()).update(
+            table_row_changes(goals_away_team, goals_home_team))
+
+    with transaction.atomic():
+        LeagueTableRow.objects.filter(competition=competition).delete()
+        LeagueTableRow.objects.bulk_create(
+            [LeagueTableRow(competition=competition, team_id=team_id,
+                            **row) for team_id, row in totals.items()],
+            batch_size=IMPORT_BATCH_SIZE
+        )
 
 
 def update_fixture(fixture, goals_away_team, goals_home_team):
     """
-    Updates given fixture with away/home goals
+    Updates given fixture with away/home goals, settles its bets and adds it
+    to league table. Fixture already finished by other run is left alone
+    :return: bool - whether this call finished the fixture
     """
     if fixture.status == 1 or fixture.status == 3:
-        fixture.goals_home_team = goals_home_team
-        fixture.goals_away_team = goals_away_team
-        fixture.status = 2
-        fixture.fixture_result = get_fixture_result(goals_home_team, goals_away_team)
-        fixture.save()
-        check_bets(fixture)
+        fixture_result = get_fixture_result(goals_home_team, goals_away_team)
+        with transaction.atomic():
+            finished = Fixture.objects.filter(id=fixture.id,
+                                              status__in=[1, 3]).update(
+                goals_home_team=goals_home_team,
+                goals_away_team=goals_away_team,
+                status=2,
+                fixture_result=fixture_result
+            )
+            if not finished:
+                return False
+            invalidate_fixtures(fixture.competition_id)
+            fixture.goals_home_team = goals_home_team
+            fixture.goals_away_team = goals_away_team
+            fixture.status = 2
+            fixture.fixture_result = fixture_result
+            update_league_table(fixture)
+            check_bets(fixture)
+            live_scores.publish(fixture)
+            return True
+    return False
 
 
-def update_fixtures(api_id, matchday=""):
+def parse_minute(progress):
     """
-    Updates fixtures with data from API
-    Note: The Sports DB doesn't have live score updates in the free version
-    This is a placeholder for when you upgrade to a paid API
+    :param progress: string like "67'" or "45+2" from API, or None
+    :return: int - minute of match or None
     """
-    print(f"Would update fixtures for competition {api_id}")
-    # For now, we'll just update odds
-    update_odds_in_fixtures(api_id)
+    digits = ""
+    for char in str(progress or ""):
+        if not char.isdigit():
+            break
+        digits += char
+    return int(digits) if digits else None
 
 
-def update_odds_in_fixtures(api_id):
+def live_event_state(event):
     """
-    Updates odds for scheduled fixtures
+    :param event: API event of live match
+    :return: dict - Fixture field to value, fields missing in event are
+    left out
     """
-    fixtures = Fixture.objects.filter(status=1, competition__api_id=api_id)
+    state = {'goals_home_team': event.get('intHomeScore'),
+             'goals_away_team': event.get('intAwayScore'),
+             'minute': parse_minute(event.get('strProgress'))}
+    return {field: int(value) for field, value in state.items()
+            if value not in (None, "")}
 
+
+FINISHED_EVENT_STATUSES = ("Match Finished", "FT", "AET", "PEN")
+
+
+def update_live_fixtures(fixtures, events):
+    """
+    Writes polled state of live fixtures, only fixtures whose score or
+    minute changed are saved and only with changed fields, and published to
+    live score streams. Fixture which has just finished is settled by
+    update_fixture.
+    :param fixtures: list of live Fixture objects with teams loaded
+    :param events: dict - fixture id to its API event
+    :return: tuple (int - number of changed fixtures,
+                    int - number of finished fixtures)
+    """
+    changed = finished = 0
     for fixture in fixtures:
-        odds = calculate_odds(fixture.home_team.name, fixture.away_team.name)
-        fixture.course_team_home_win = odds['home_win']
-        fixture.course_draw = odds['draw']
-        fixture.course_team_away_win = odds['away_win']
-        fixture.save()
+        event = events.get(fixture.id)
+        if event is None:
+            continue
+        state = live_event_state(event)
+        if event.get('strStatus') in FINISHED_EVENT_STATUSES \
+                and 'goals_home_team' in state and 'goals_away_team' in state:
+            finished += update_fixture(fixture, state['goals_away_team'],
+                                       state['goals_home_team'])
+            continue
+        update_fields = [field for field, value in state.items()
+                         if getattr(fixture, field) != value]
+        if update_fields:
+            for field in update_fields:
+                setattr(fixture, field, state[field])
+            fixture.save(update_fields=update_fields)
+            live_scores.publish(fixture)
+            changed += 1
+    return changed, finished
+
+
+def parse_timeline_entry(fixture_id, entry):
+    """
+    :param entry: item of lookuptimeline.php response
+    :return: unsaved MatchEvent or None if entry has no minute
+    """
+    minute = parse_minute(entry.get('intTime'))
+    if minute is None or not entry.get('strTimeline'):
+        return None
+    return MatchEvent(fixture_id=fixture_id, minute=minute,
+                      event_type=entry['strTimeline'][:32],
+                      detail=(entry.get('strTimelineDetail') or "")[:64],
+                      player=(entry.get('strPlayer') or "")[:100],
+                      home=entry.get('strHome') == "Yes")
+
+
+def events_summary(fixture_ids):
+    """
+    Counts match events of fixtures per type and side in one query
+    :return: dict - fixture id to {event type: {"home": int, "away": int}}
+    """
+    summaries = {fixture_id: {} for fixture_id in fixture_ids}
+    for fixture_id, event_type, home, count in MatchEvent.objects\
+            .filter(fixture_id__in=fixture_ids).order_by()\
+            .values_list('fixture_id', 'event_type', 'home')\
+            .annotate(count=Count('id')):
+        sides = summaries[fixture_id].setdefault(event_type,
+                                                 {"home": 0, "away": 0})
+        sides["home" if home else "away"] = count
+    return summaries
+
+
+def append_match_events(timelines):
+    """
+    Appends events of fixtures which aren't stored yet - stored keys are
+    read in one query, new events are inserted with one bulk insert.
+    Fixtures which got new events have their events summary refreshed.
+    :param timelines: dict - fixture id to list of lookuptimeline.php items
+    :return: int - number of new events
+    """
+    new_events = {}
+    for fixture_id, entries in timelines.items():
+        for entry in entries or []:
+            event = parse_timeline_entry(fixture_id, entry)
+            if event is not None:
+                new_events[(fixture_id, event.minute, event.event_type,
+                            event.player)] = event
+    if not new_events:
+        return 0
+    for key in MatchEvent.objects.filter(fixture_id__in=list(timelines))\
+            .values_list('fixture_id', 'minute', 'event_type', 'player'):
+        new_events.pop(key, None)
+    if not new_events:
+        return 0
+
+    # Concurrent poll might have inserted some of them meanwhile
+    MatchEvent.objects.bulk_create(new_events.values(), ignore_conflicts=True,
+                                   batch_size=IMPORT_BATCH_SIZE)
+    changed_ids = {fixture_id for fixture_id, minute, event_type, player
+                   in new_events}
+    for fixture_id, summary in events_summary(changed_ids).items():
+        Fixture.objects.filter(id=fixture_id).update(events=summary)
+    return len(new_events)
+
+
+def update_fixtures(competition, events_data=None):
+    """
+    Updates competition's fixtures with data from API - new and rescheduled
+    events are synced by create_fixtures. Fixtures are finished by live
+    polling and odds of scheduled ones are refreshed separately by
+    refresh_due_odds when they are due.
+    :param competition: Competition object
+    :param events_data: eventsseason.php response fetched beforehand
+    :return: int - number of fixtures in API data
+    """
+    if not events_data or not events_data.get('events'):
+        return 0
+    return create_fixtures(competition.api_id, competition,
+                           events_data=events_data)
+
+
+def reprice_fixtures(fixtures):
+    """
+    Recalculates and saves odds of given fixtures
+    :param fixtures: Fixture queryset
+    :return: int - number of updated fixtures
+    """
+    fixtures = list(fixtures.values_list('id', 'home_team__name',
+                                         'away_team__name', 'competition_id'))
+    if not fixtures:
+        return 0
+    odds = calculate_fixtures_odds([(home_team_name, away_team_name)
+                                    for fixture_id, home_team_name,
+                                    away_team_name, competition_id
+                                    in fixtures])
+    updated = write_fixtures_odds([fixture[0] for fixture in fixtures], odds)
+    invalidate_fixtures(*[fixture[3] for fixture in fixtures])
+    return updated
+
+
+def refresh_due_odds(budget=None, now=None):
+    """
+    Refreshes odds of upcoming fixtures which are due - the closer kickoff
+    is, the more often (see odds_schedule). At most budget most overdue
+    fixtures are refreshed, the rest waits for next run. Due fixtures are
+    filtered and ordered in db, only budget of them is loaded.
+    :param budget: int - max number of refreshed fixtures,
+    ODDS_REFRESH_BUDGET by default
+    :param now: datetime
+    :return: dict with numbers of due and refreshed fixtures and time of
+    next refresh
+    """
+    budget = budget or settings.ODDS_REFRESH_BUDGET
+    now = now or timezone.now()
+    upcoming = Fixture.objects.filter(status=1, date__gte=now)
+    due_filter = odds_due_filter(now)
+    # One more than budget tells when the first fixture left in queue is due
+    candidates = list(
+        upcoming.filter(due_filter)
+        .annotate(refresh_at=refresh_at_expression(now))
+        .order_by('refresh_at', 'date')
+        .values_list('id', 'date', 'last_odds_update')[:budget + 1]
+    )
+    fixture_ids, due, next_refresh_at = due_fixtures(candidates, now, budget)
+    if len(candidates) > budget:
+        due = upcoming.filter(due_filter).count()
+    else:
+        next_refresh_at = upcoming.filter(last_odds_update__isnull=False)\
+            .exclude(due_filter)\
+            .aggregate(next=Min(refresh_at_expression(now)))['next']
+    refreshed = reprice_fixtures(Fixture.objects.filter(id__in=fixture_ids)) \
+        if fixture_ids else 0
+    return {"due": due, "refreshed": refreshed,
+            "next_refresh": next_refresh_at}
 
 
 def create_team_standing(competition_id):
     """
-    Creates team standing in Redis
+    Creates team standing in Redis, whole matchday of competition is written
+    at once
     Note: The Sports DB has limited standing data, so we'll simulate it
     """
     competition = get_object_or_404(Competition, id=competition_id)
-    teams = Team.objects.filter(competition=competition)
-    
-    for i, team in enumerate(teams):
-        matchday = 1
-        position = i + 1  # Simple ranking for demo
-        list_name = "{}:{}:standing".format(competition.id, team.id)
-        if not r.hexists(list_name, matchday):
-            r.hset(list_name, matchday, position)
\ No newline at end of file
+    team_ids = Team.objects.filter(competition=competition)\
+        .values_list('id', flat=True)
+
+    matchday = 1
+    # Simple ranking for demo
+    positions = {team_id: i + 1 for i, team_id in enumerate(team_ids)}
+    standings_store.write_matchday(competition.id, matchday, positions,
+                                   overwrite=False)
@@ -1,29 +1,44 @@
-from django.shortcuts import render
+import asyncio
+import hmac
+import queue
+
+from asgiref.sync import sync_to_async
+
+from django.shortcuts import render, get_object_or_404
 from django.views import View
 from django.views.generic.edit import FormView
 from django.contrib.auth.mixins import PermissionRequiredMixin, \
     LoginRequiredMixin
 from django.shortcuts import redirect
+from django.http import StreamingHttpResponse, HttpResponse, \
+    HttpResponseForbidden
 from django.urls import reverse_lazy
 from django.views.generic.list import ListView
 from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+from django.utils.cache import get_conditional_response
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-import redis
-
 from .models import *
 from .forms import *
-from .api_connection import get_competitions, get_league_table
+from .api_connection import get_competitions, sports_api
 from .update_db import create_competition
-from .tasks import bet_created
+from .standings import standings_store
+from .page_cache import get_fixtures_version, get_competitions_version
+from .live_stream import live_scores, AsyncSubscriber
+from .metrics import metrics
+from .betting import place_bet, BetRejected, COURSE_FIELDS
+from .accounts import bets_page, get_summary
+from .leaderboard import leaderboard, with_usernames
 
 
-r = redis.StrictRedis(host=settings.REDIS_HOST,
-                      port=settings.REDIS_PORT,
-                      db=settings.REDIS_DB,
-                      decode_responses=True)
+TOP_BETTORS_CACHE_KEY = "top_bettors"
 
 
 class CompetitionsView(ListView):
@@ -33,6 +48,41 @@ class CompetitionsView(ListView):
     model = Competition
     template_name = "competitions.html"
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["cache_timeout"] = settings.FIXTURES_CACHE_TIMEOUT
+        context["competitions_version"] = get_competitions_version()
+        context["top_bettors"] = get_top_bettors()
+        return context
+
+
+def get_top_bettors():
+    """
+    Returns best users of overall ranking with their usernames, cached for
+    TOP_BETTORS_CACHE_TIMEOUT seconds, so competitions page doesn't query
+    redis and db on every view
+    :return: list of dicts, see with_usernames
+    """
+    top_bettors = cache.get(TOP_BETTORS_CACHE_KEY)
+    if top_bettors is None:
+        try:
+            entries, count = leaderboard.page(size=settings.TOP_BETTORS)
+        except Exception as e:
+            print(f"Loading top bettors failed: {e}")
+            return []
+        top_bettors = with_usernames(entries)
+        cache.set(TOP_BETTORS_CACHE_KEY, top_bettors,
+                  settings.TOP_BETTORS_CACHE_TIMEOUT)
+    return top_bettors
+
+
+def get_lazy_competition(id):
+    """
+    Returns Competition which is fetched from db only when used - not at all
+    when page is rendered from cache
+    """
+    return SimpleLazyObject(lambda: get_object_or_404(Competition, id=id))
+
 
 class CompetitionView(View):
     def get(self, request, id):
@@ -42,12 +92,16 @@ class CompetitionView(View):
         :param id: int - competition id in db
         :return: rendered html with competition and fixtures
         """
-        competition = Competition.objects.get(id=id)
-        fixtures = Fixture.objects.filter(competition=competition,
+        competition = get_lazy_competition(id)
+        fixtures = Fixture.objects.filter(competition=id,
                                           status=1,
-                                          )
+                                          ).select_related('home_team',
+                                                           'away_team')
         context = {"competition": competition,
-                   "fixtures": fixtures
+                   "competition_id": id,
+                   "fixtures": fixtures,
+                   "fixtures_version": get_fixtures_version(id),
+                   "cache_timeout": settings.FIXTURES_CACHE_TIMEOUT
                    }
         return render(request, 'fixtures.html', context)
 
@@ -55,80 +109,75 @@ class CompetitionView(View):
 class CompetitionTableView(View):
     def get(self, request, id):
         competition = Competition.objects.get(id=id)
-        api_id = competition.api_id
-        league_table = get_league_table(api_id)
+        rows = LeagueTableRow.objects.filter(competition=competition)\
+            .select_related('team')\
+            .order_by('-points', '-goal_difference', '-goals_for', 'team__name')
         table = []
-        for team in league_table['standing']:
-            table.append({"position": team['position'],
-                          "name": team['teamName'],
-                          "games": team['playedGames'],
-                          "wins": team['wins'],
-                          "draws": team['draws'],
-                          "losses": team['losses'],
-                          "points": team['points'],
+        for position, row in enumerate(rows, 1):
+            table.append({"position": position,
+                          "name": row.team.name,
+                          "games": row.played,
+                          "wins": row.wins,
+                          "draws": row.draws,
+                          "losses": row.losses,
+                          "goals": "{}:{}".format(row.goals_for,
+                                                  row.goals_against),
+                          "points": row.points,
                           })
         context = {"table": table, "competition": competition}
         return render(request, 'league_table.html', context)
 
 
-def get_bet_course(fixture, bet):
-    """
-    Gets bet course from fixture and returns it
-    :param fixture: Fixture object
-    :param bet: int - 1:home_win, 2:away_win, 0:draw
-    :return: float - course
-    """
-    if bet == 1:
-        return fixture.course_team_home_win
-    elif bet == 0:
-        return fixture.course_draw
-    elif bet == 2:
-        return fixture.course_team_away_win
-
-
 class BetFixtureView(LoginRequiredMixin, View):
     redirect_field_name = "next"
 
+    def render_form(self, request, id, form, messages=()):
+        fixture = get_object_or_404(Fixture.objects
+                                    .select_related('home_team', 'away_team'),
+                                    id=id)
+        if fixture.status == 1:
+            if form is None:
+                form = BetForm(initial={
+                    field: getattr(fixture, field)
+                    for field in COURSE_FIELDS.values()
+                })
+            context = {"fixture": fixture,
+                       "form": form,
+                       "messages": messages
+                       }
+            return render(request, "bet_form.html", context)
+        return redirect(reverse_lazy('competitions'))
+
     def get(self, request, id):
         """
         Displays form for betting 
         :param id: int - id of fixture
         :return: rendered form
         """
-        fixture = Fixture.objects.get(id=id)
-        if fixture.status == 1:
-            form = BetForm
-            context = {"fixture": fixture,
-                       "form": form
-                       }
-            return render(request, "bet_form.html", context)
+        return self.render_form(request, id, None)
 
     def post(self, request, id):
         """
-        Checks if form is valid, user has the cash, cash amount is valid and 
-        then saves bet ot db
+        Checks if form is valid and places bet with course user saw
         :param id: int - fixture id
-        :return: redirection to competitions view
+        :return: redirection to competitions view or form with reason of
+        rejection
         """
-        fixture = Fixture.objects.get(id=id)
-        user = request.user
-        app_user = AppUser.objects.get(user=user)
         form = BetForm(request.POST)
-        if form.is_valid():
-            bet_amount = form.cleaned_data['bet_amount']
-            bet = form.cleaned_data['bet']
-            bet_course = get_bet_course(fixture, bet)
-            # check if cash amount is valid
-            if app_user.cash - bet_amount >= 0 and bet_amount >= 0.01:
-                app_user.cash -= bet_amount
-                app_user.save()
-                bet = Bet.objects.create(bet_user=app_user,
-                                         bet_amount=bet_amount,
-                                         fixture=fixture,
-                                         bet=bet,
-                                         bet_course=bet_course
-                                         )
-                bet_created.delay(bet.id)
+        if not form.is_valid():
+            return self.render_form(request, id, form)
+        bet = form.cleaned_data['bet']
+        course_field = COURSE_FIELDS.get(bet)
+        try:
+            place_bet(app_user_id=AppUser.objects.only('id')
+                      .get(user=request.user).id,
+                      fixture_id=id,
+                      bet=bet,
+                      bet_amount=form.cleaned_data['bet_amount'],
+                      bet_course=form.cleaned_data[course_field]
+                      if course_field else None)
+        except BetRejected as e:
+            return self.render_form(request, id, form, [str(e)])
         return redirect(reverse_lazy('competitions'))
 
 
@@ -193,26 +242,31 @@ class AccountDetailsView(LoginRequiredMixin, View):
 
     def get(self, request):
         """
-        Displays AppUser's account details
+        Displays AppUser's account details with summary of all bets and
+        one page of bets, newest first - "before" parameter is cursor of
+        the page
         :return: html with account details
         """
         user = request.user
-        app_user = AppUser.objects.get(user=user)
-        bets = Bet.objects.filter(bet_user=app_user)
+        app_user = AppUser.objects.select_related('summary').get(user=user)
+        bets, next_cursor = bets_page(app_user.id,
+                                      request.GET.get('before'),
+                                      settings.BET_HISTORY_PAGE_SIZE)
         context = {"user": user,
                    "app_user": app_user,
+                   "summary": get_summary(app_user),
                    "bets": bets,
+                   "next_cursor": next_cursor,
+                   "is_first_page": not request.GET.get('before'),
                    }
         return render(request, "my_account.html", context)
 
 
 class TeamStandingsView(APIView):
     def get(self, request, competition_id, team_id):
-        print(competition_id, team_id)
-        list_name = "{}:{}:standing".format(competition_id, team_id)
-        standings = r.hgetall(list_name)
-        matchday_list = sorted([int(i) for i in standings.keys()])
-        standing_list = [int(standings[str(mday)])for mday in matchday_list]
+        matchday_list, standing_list = standings_store.team_history(
+            competition_id, team_id
+        )
         data = {"matchday_list": matchday_list,
                 "standing_list": standing_list
                 }
@@ -220,6 +274,184 @@ class TeamStandingsView(APIView):
 
 
 
+class CompetitionStandingsView(APIView):
+    def get(self, request, competition_id):
+        """
+        Returns standings history of all competition's teams - list of
+        matchdays, list of team ids and for each team list of its positions
+        (None if team has no position on matchday). Responds 304 if client's
+        copy is up to date
+        """
+        last_modified = standings_store.last_modified(competition_id)
+        if last_modified is None:
+            return Response({"matchday_list": [],
+                             "team_list": [],
+                             "standings": []
+                             })
+
+        etag = '"{}-{}"'.format(competition_id, last_modified)
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified)
+        )
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        history, updated = standings_store.read_history(competition_id)
+        matchday_list = sorted(history)
+        team_list = sorted({team_id for positions in history.values()
+                            for team_id in positions})
+        data = {"matchday_list": matchday_list,
+                "team_list": team_list,
+                "standings": [[history[matchday].get(team_id)
+                               for matchday in matchday_list]
+                              for team_id in team_list]
+                }
+        response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+def live_score_events(competition_id):
+    """
+    Yields Server-Sent Events with changes of competition's live fixtures,
+    comment line is sent when nothing changes so dead clients are noticed
+    and dead redis listener is restarted
+    """
+    subscriber = live_scores.subscribe(competition_id)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                message = subscriber.get(
+                    timeout=settings.LIVE_STREAM_KEEPALIVE
+                )
+            except queue.Empty:
+                live_scores.ensure_listener()
+                yield ": keepalive\n\n"
+                continue
+            yield "event: fixture\ndata: {}\n\n".format(message)
+    finally:
+        live_scores.unsubscribe(competition_id, subscriber)
+
+
+class AsyncLiveScoreEvents:
+    """
+    Same events as live_score_events, yielded in event loop of ASGI server,
+    so open streams don't hold any thread. Response closes it when client
+    disconnects.
+    """
+    def __init__(self, competition_id):
+        self.competition_id = competition_id
+        self.subscriber = None
+
+    def __aiter__(self):
+        return self.events()
+
+    async def events(self):
+        self.subscriber = AsyncSubscriber(asyncio.get_running_loop())
+        # Waiting for redis subscription blocks, so it runs outside the loop
+        await sync_to_async(live_scores.subscribe, thread_sensitive=False)(
+            self.competition_id, self.subscriber
+        )
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                message = await self.subscriber.get(
+                    timeout=settings.LIVE_STREAM_KEEPALIVE
+                )
+            except asyncio.TimeoutError:
+                live_scores.ensure_listener()
+                yield ": keepalive\n\n"
+                continue
+            yield "event: fixture\ndata: {}\n\n".format(message)
+
+    def close(self):
+        if self.subscriber is not None:
+            live_scores.unsubscribe(self.competition_id, self.subscriber)
+
+
+class LiveScoresView(View):
+    def get(self, request, competition_id):
+        """
+        Streams score, minute and status changes of competition's fixtures
+        as Server-Sent Events, without querying db. Under ASGI server streams
+        are async generators served by event loop, so one process serves
+        many subscribers. Under WSGI every open stream holds one worker
+        thread for as long as the client stays connected.
+        :param competition_id: int
+        :return: text/event-stream response
+        """
+        if isinstance(request, ASGIRequest):
+            events = AsyncLiveScoreEvents(competition_id)
+        else:
+            events = live_score_events(competition_id)
+        response = StreamingHttpResponse(events,
+                                         content_type="text/event-stream")
+        response['Cache-Control'] = "no-cache"
+        response['X-Accel-Buffering'] = "no"
+        return response
+
+
+class LeaderboardView(APIView):
+    def get(self, request):
+        """
+        Returns page of AppUsers ranked by profit, overall or in competition
+        given by "competition" parameter. "page" parameter selects page,
+        "app_user" adds rank and profit of given AppUser
+        """
+        try:
+            competition_id = int(request.GET.get('competition', '')) \
+                if request.GET.get('competition') else None
+            page = max(int(request.GET.get('page', 1)), 1)
+            app_user_id = int(request.GET.get('app_user', '')) \
+                if request.GET.get('app_user') else None
+        except ValueError:
+            return Response({"detail": "Invalid parameter"}, status=400)
+
+        size = settings.LEADERBOARD_PAGE_SIZE
+        entries, count = leaderboard.page(competition_id, page, size)
+        data = {"competition": competition_id,
+                "page": page,
+                "count": count,
+                "next": page + 1 if page * size < count else None,
+                "results": with_usernames(entries),
+                }
+        if app_user_id is not None:
+            position = leaderboard.rank(app_user_id, competition_id)
+            data["app_user"] = {"app_user_id": app_user_id,
+                                "rank": position and position[0],
+                                "profit": position and position[1]}
+        return Response(data)
+
+
+def metrics_token_valid(request):
+    """
+    :return: bool - whether request carries METRICS_TOKEN as bearer token,
+    always False if no token is configured
+    """
+    if not settings.METRICS_TOKEN:
+        return False
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return scheme.lower() == 'bearer' and \
+        hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode())
+
+
+class MetricsView(View):
+    def get(self, request):
+        """
+        Returns request, SQL, redis, API and task metrics of all processes
+        in Prometheus text format, to staff and to scrapers sending
+        METRICS_TOKEN as bearer token only
+        """
+        if not metrics_token_valid(request) and not request.user.is_staff:
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.render(),
+                            content_type="text/plain; version=0.0.4; "
+                                         "charset=utf-8")
+
+
 class ShowTeamView(View):
     def get(self, request, team_id):
         """
@@ -227,16 +459,15 @@ class ShowTeamView(View):
         :param team_id: int - id of Team object in db
         :return: html with team details
         """
-        team = Team.objects.get(id=team_id)
+        team = Team.objects.select_related('competition').get(id=team_id)
         competition = team.competition
-        team_fixtures_home = Fixture.objects.filter(home_team=team)
-        team_fixtures_away = Fixture.objects.filter(away_team=team)
-
-        all_fixtures = [game for game in team_fixtures_away] +\
-                       [game for game in team_fixtures_home]
-
-        played_fixtures = [game for game in all_fixtures if game.status == 2]
-        scheduled_fixtures = [game for game in all_fixtures if game.status == 1]
+        team_fixtures = Fixture.objects.filter(Q(home_team=team) |
+                                               Q(away_team=team))\
+            .select_related('home_team', 'away_team')
+        team_fixtures_home = team_fixtures.filter(home_team=team)
+        team_fixtures_away = team_fixtures.filter(away_team=team)
+        played_fixtures = team_fixtures.filter(status=2)
+        scheduled_fixtures = team_fixtures.filter(status=1)
 
         context = {"team": team,
                    "competition": competition,
@@ -257,8 +488,6 @@ class AddCompetitionsView(PermissionRequiredMixin, View):
         """
         Displays all available leagues from The Sports DB
         """
-        from .api_connection import sports_api
-        
         competitions_data = sports_api.get_all_leagues()
         
         football_leagues = []
@@ -275,28 +504,30 @@ class AddCompetitionsView(PermissionRequiredMixin, View):
         """
         Adds selected competitions to db
         """
-        from .update_db import create_competition
-        
         selected_competitions = request.POST.getlist('competition')
-        for competition_id in selected_competitions:
-            # Get league name from the form data
-            # We need to find the league name from the ID
-            competitions_data = sports_api.get_all_leagues()
-            if competitions_data and 'leagues' in competitions_data:
-                for league in competitions_data['leagues']:
-                    if str(league['idLeague']) == competition_id:
-                        create_competition(league['idLeague'], league['strLeague'])
-                        break
-        
+        competitions_data = sports_api.get_all_leagues()
+        if competitions_data and 'leagues' in competitions_data:
+            leagues = {str(league['idLeague']): league
+                       for league in competitions_data['leagues']}
+            for competition_id in selected_competitions:
+                league = leagues.get(competition_id)
+                if league is not None:
+                    create_competition(league['idLeague'],
+                                       league['strLeague'])
+
         return redirect(reverse_lazy('competitions'))
 
 
 class FinishedFixturesView(View):
     def get(self, request, id):
-        competition = Competition.objects.get(id=id)
-        finished_fixtures = Fixture.objects.filter(competition=competition,
-                                                 status=2)
+        competition = get_lazy_competition(id)
+        finished_fixtures = Fixture.objects.filter(competition=id,
+                                                 status=2)\
+            .select_related('home_team', 'away_team')
         context = {"competition": competition,
-                   "finished_fixtures": finished_fixtures
+                   "competition_id": id,
+                   "finished_fixtures": finished_fixtures,
+                   "fixtures_version": get_fixtures_version(id),
+                   "cache_timeout": settings.FIXTURES_CACHE_TIMEOUT
                    }
         return render(request, 'finished_fixtures.html', context)